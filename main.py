@@ -20,20 +20,50 @@
 import logging
 
 from mtoolkit.console import cmd_line, build_logger
-from mtoolkit.workflow import Context, PipeLineBuilder
 
 
 if __name__ == '__main__':
-    INPUT_CONFIG_FILENAME = cmd_line()
-    if INPUT_CONFIG_FILENAME != None:
-        CONTEXT = Context(INPUT_CONFIG_FILENAME)
+    ARGS = cmd_line()
+    if ARGS != None:
+        # Imported once the cmdline is parsed: help
+        # and version don't pay for the toolkit import
+        from mtoolkit.workflow import Context, PipeLineBuilder
+        from mtoolkit.jobs import warm_source_model_cache, \
+        clear_source_model_cache
+        from mtoolkit.kernels import set_backend
+
+        CONTEXT = Context(ARGS.input_file)
         build_logger()
+        LOGGER = logging.getLogger('mt_logger')
+        LOGGER.debug('Kernels backend: %s' % set_backend(
+                ARGS.backend or CONTEXT.config.get('backend')))
 
-        PIPELINE = PipeLineBuilder("test pipeline").build(
-                CONTEXT.config)
-        PIPELINE.run(CONTEXT)
+        if ARGS.serve_port is not None:
+            from mtoolkit.server import serve
 
-        LOGGER = logging.getLogger('mt_logger')
-        LOGGER.debug(CONTEXT.vcl)
-        LOGGER.debug(CONTEXT.catalog_matrix)
-        LOGGER.debug(CONTEXT.flag_vector)
+            serve(CONTEXT.config, ARGS.serve_port, ARGS.workers)
+        elif ARGS.store_dir:
+            from mtoolkit.jobs import build_catalogue_store
+
+            LOGGER.info('Catalogue store of %s events built' %
+                    build_catalogue_store(CONTEXT, ARGS.store_dir))
+        elif ARGS.sweep_file:
+            from mtoolkit.sweep import run_sweep, read_sweep_config
+
+            LOGGER.info('Sweep of %s combinations done' % len(run_sweep(
+                CONTEXT.config, read_sweep_config(ARGS.sweep_file))))
+        elif ARGS.clear_cache or ARGS.warm_cache:
+            if ARGS.clear_cache:
+                LOGGER.info('Removed %s source model cache entries' %
+                        clear_source_model_cache(CONTEXT))
+            if ARGS.warm_cache:
+                warm_source_model_cache(CONTEXT)
+                LOGGER.info('Source model cache warmed')
+        else:
+            PIPELINE = PipeLineBuilder("test pipeline").build(
+                    CONTEXT.config)
+            PIPELINE.run(CONTEXT)
+
+            LOGGER.debug(CONTEXT.vcl)
+            LOGGER.debug(CONTEXT.catalog_matrix)
+            LOGGER.debug(CONTEXT.flag_vector)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+"""
+The purpose of this module is to provide an object
+to store on disk the source model definitions read
+from a nrml file, so that an unchanged source model
+is neither parsed nor validated again.
+"""
+
+import os
+import glob
+import hashlib
+import cPickle as pickle
+
+from mtoolkit import utils
+
+CACHE_EXTENSION = '.pkl'
+BLOCK_SIZE = 1 << 20
+
+
+class SourceModelCache(object):
+    """
+    SourceModelCache stores the list of sm definitions
+    built by NRMLReader in a binary (pickle) file.
+    Every entry is keyed by the content of the source
+    model file and by the schema (nrml namespace and
+    content of all the xsd files of the schema directory,
+    as the schema imports the gml and quakeml ones) used
+    to validate it, so any change to one of them
+    invalidates the entry.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, filename, schema):
+        """
+        Return the cache key of a source model
+        validated against the given schema.
+        """
+
+        digest = hashlib.sha1(utils.NRML_NS)
+        schema_files = sorted(glob.glob(os.path.join(
+            os.path.dirname(os.path.abspath(schema)), '*.xsd')))
+        if os.path.abspath(schema) not in schema_files:
+            schema_files.insert(0, schema)
+        for path in schema_files + [filename]:
+            digest.update(os.path.basename(path))
+            with open(path, 'rb') as data_file:
+                for block in iter(lambda: data_file.read(BLOCK_SIZE), ''):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def entry_path(self, filename, schema):
+        """Return the path of the cache entry of a source model"""
+
+        return os.path.join(self.cache_dir,
+                self.key(filename, schema) + CACHE_EXTENSION)
+
+    def load(self, filename, schema):
+        """
+        Return the cached sm definitions of a source
+        model or None if the source model is not cached.
+        """
+
+        entry_path = self.entry_path(filename, schema)
+        if not os.path.exists(entry_path):
+            return None
+        with open(entry_path, 'rb') as entry_file:
+            return pickle.load(entry_file)
+
+    def store(self, filename, schema, sm_definitions):
+        """Store the sm definitions of a source model"""
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        entry_path = self.entry_path(filename, schema)
+        # Write to a temporary file first, a concurrent
+        # reader never sees a partially written entry
+        tmp_path = '%s.%s' % (entry_path, os.getpid())
+        with open(tmp_path, 'wb') as entry_file:
+            pickle.dump(sm_definitions, entry_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, entry_path)
+
+    def clear(self):
+        """Remove all the cache entries, return their number"""
+
+        entries = glob.glob(os.path.join(self.cache_dir,
+                '*' + CACHE_EXTENSION))
+        for entry_path in entries:
+            os.remove(entry_path)
+        return len(entries)
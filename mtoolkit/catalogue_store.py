@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+"""
+The purpose of this module is to provide a binary eq
+catalog (catalogue store) with a spatial index, so that
+the events of a region are read without reading the
+whole catalog. The store is a directory holding one
+numpy (.npy) file per field, the events are grouped in
+tiles of tile_size degrees sorted by Morton code, and
+the offsets of the tiles give the slice of every tile.
+Files are memory mapped, only the pages of the tiles
+intersecting a region are read.
+"""
+
+import os
+import json
+
+import numpy as np
+
+from mtoolkit.eqcatalog import EqEntryReader, EqEntryValidationError, \
+CsvReader, _entry_values, _column_array
+
+
+META_FILE = 'meta.json'
+STORE_VERSION = 1
+TILE_SIZE = 1.0
+
+# Arrays of the spatial index, stored along with the fields
+ROW = '_row'
+TILES = '_tiles'
+OFFSETS = '_offsets'
+
+
+def tile_coordinates(longitude, latitude, tile_size=TILE_SIZE):
+    """Return the column and row of the tiles holding the points"""
+
+    columns = np.floor((np.asarray(longitude) + 180.) / tile_size)
+    rows = np.floor((np.asarray(latitude) + 90.) / tile_size)
+    return columns.astype(np.int64), rows.astype(np.int64)
+
+
+def _spread_bits(values):
+    """Insert a zero bit before every bit of 32 bit values"""
+
+    values = values & 0xFFFFFFFF
+    values = (values | (values << 16)) & 0x0000FFFF0000FFFF
+    values = (values | (values << 8)) & 0x00FF00FF00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F0F0F0F0F
+    values = (values | (values << 2)) & 0x3333333333333333
+    values = (values | (values << 1)) & 0x5555555555555555
+    return values
+
+
+def morton_code(columns, rows):
+    """
+    Return the Morton code (interleaved bits) of tiles,
+    near tiles get near codes
+    """
+
+    return _spread_bits(np.asarray(columns, dtype=np.int64)) | \
+            (_spread_bits(np.asarray(rows, dtype=np.int64)) << 1)
+
+
+def _polygon(points):
+    """Return a polygon from a flat list of lon, lat values"""
+
+    from shapely.geometry import Polygon
+
+    return Polygon(zip(points[::2], points[1::2]))
+
+
+def region_bounds(region):
+    """
+    Return the bounding box (min lon, min lat, max lon,
+    max lat) of a region: a dict with a bbox or with a
+    polygon, given as a flat list of lon, lat values
+    """
+
+    if 'bbox' in region:
+        bounds = [float(value) for value in region['bbox']]
+    elif 'polygon' in region:
+        points = region['polygon']
+        bounds = [min(points[::2]), min(points[1::2]),
+                max(points[::2]), max(points[1::2])]
+    else:
+        raise RuntimeError('Invalid region: %s' % region)
+    if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+        raise RuntimeError('Invalid region bounds: %s' % bounds)
+    return bounds
+
+
+def region_mask(region, longitude, latitude):
+    """
+    Return the mask of the points inside a region, the
+    bbox includes its border, the polygon doesn't
+    """
+
+    longitude = np.asarray(longitude)
+    latitude = np.asarray(latitude)
+    min_lon, min_lat, max_lon, max_lat = region_bounds(region)
+    mask = (longitude >= min_lon) & (longitude <= max_lon) & \
+            (latitude >= min_lat) & (latitude <= max_lat)
+    if 'polygon' in region:
+        from shapely.geometry import Point
+
+        polygon = _polygon(region['polygon'])
+        candidates = np.nonzero(mask)[0]
+        mask[candidates] = [polygon.contains(Point(longitude[i],
+            latitude[i])) for i in candidates]
+    return mask
+
+
+def is_catalogue_store(path):
+    """Return True if path is the directory of a catalogue store"""
+
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+class CatalogueStore(object):
+    """
+    CatalogueStore reads the eq entries of a catalogue
+    store, all of them or the ones inside a region. The
+    eq entries read are the ones given by EqEntryReader
+    for the eq catalog the store was built from.
+    """
+
+    def __init__(self, directory):
+        if not is_catalogue_store(directory):
+            raise IOError('Catalogue store %s not found' % directory)
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE), 'r') as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta['version'] != STORE_VERSION:
+            raise RuntimeError('Unsupported catalogue store version: %s' %
+                    self.meta['version'])
+        self.fieldnames = [str(name) for name in self.meta['fieldnames']]
+        self.tile_size = self.meta['tile_size']
+
+    @classmethod
+    def build(cls, eq_catalog_file, directory, tile_size=TILE_SIZE):
+        """
+        Build the catalogue store of a csv eq catalog,
+        events without Mw are stored, return the store
+        """
+
+        fieldnames = CsvReader(eq_catalog_file).fieldnames
+        eq_entries = list(EqEntryReader(eq_catalog_file, False).read())
+        values = zip(*map(_entry_values(fieldnames), eq_entries)) or \
+                [()] * len(fieldnames)
+        arrays = dict(zip(fieldnames, map(_column_array, values)))
+
+        codes = morton_code(*tile_coordinates(arrays['longitude'],
+            arrays['latitude'], tile_size))
+        # Events of a tile keep the eq catalog order
+        order = np.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        tiles, starts = np.unique(codes, return_index=True)
+        arrays = dict((name, array[order]) for name, array in
+                arrays.iteritems())
+        arrays[ROW] = order
+        arrays[TILES] = tiles
+        arrays[OFFSETS] = np.append(starts, len(codes))
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for name, array in arrays.iteritems():
+            np.save(cls._path(directory, name), array)
+        # Written last, a store is complete once it has meta
+        with open(os.path.join(directory, META_FILE), 'w') as meta_file:
+            json.dump({'version': STORE_VERSION, 'fieldnames': fieldnames,
+                'tile_size': tile_size, 'events': len(eq_entries)},
+                meta_file)
+        return cls(directory)
+
+    @staticmethod
+    def _path(directory, name):
+        """Return the path of the file of an array"""
+
+        return os.path.join(directory, name + '.npy')
+
+    def _array(self, name):
+        """Return the memory mapped array of a field"""
+
+        return np.load(self._path(self.directory, name), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['events']
+
+    def tile_slices(self, region):
+        """
+        Return the slices of the stored events of the
+        tiles intersecting the bounding box of a region
+        """
+
+        min_lon, min_lat, max_lon, max_lat = region_bounds(region)
+        (min_column, max_column), (min_row, max_row) = tile_coordinates(
+                [min_lon, max_lon], [min_lat, max_lat], self.tile_size)
+        tiles = np.array(self._array(TILES))
+        offsets = self._array(OFFSETS)
+        # Decode the columns and rows of the tiles
+        columns, rows = np.zeros_like(tiles), np.zeros_like(tiles)
+        for bit in xrange(32):
+            columns |= ((tiles >> (2 * bit)) & 1) << bit
+            rows |= ((tiles >> (2 * bit + 1)) & 1) << bit
+        selected = np.nonzero((columns >= min_column) &
+                (columns <= max_column) & (rows >= min_row) &
+                (rows <= max_row))[0]
+        # Tiles following each other are read as one slice
+        slices = []
+        for i in selected:
+            if slices and slices[-1][1] == offsets[i]:
+                slices[-1][1] = offsets[i + 1]
+            else:
+                slices.append([offsets[i], offsets[i + 1]])
+        return [slice(start, end) for start, end in slices]
+
+    def read(self, region=None, compulsory_mw=True):
+        """
+        Return the list of the eq entries, in the eq
+        catalog order, inside the region if given
+        """
+
+        if region is None:
+            index = np.arange(len(self))
+        else:
+            index = np.concatenate([np.arange(event_slice.start,
+                event_slice.stop) for event_slice in
+                self.tile_slices(region)] + [np.zeros(0, dtype=int)])
+            index = index[region_mask(region,
+                self._array('longitude')[index],
+                self._array('latitude')[index])]
+        index = index[np.argsort(self._array(ROW)[index], kind='mergesort')]
+
+        columns = []
+        for name in self.fieldnames:
+            values = self._array(name)[index]
+            if values.dtype.kind == 'f' and np.isnan(values).any():
+                if name == 'Mw' and compulsory_mw:
+                    raise EqEntryValidationError(name,
+                            EqEntryReader.EMPTY_STRING, self._array(ROW)[
+                                index[np.isnan(values)][0]] + 2)
+                values = [EqEntryReader.EMPTY_STRING if value != value
+                        else value for value in values.tolist()]
+            else:
+                values = values.tolist()
+            columns.append(values)
+        return [dict(zip(self.fieldnames, entry_values))
+                for entry_values in zip(*columns)]
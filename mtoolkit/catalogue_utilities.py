@@ -25,59 +25,216 @@ calculations on features in an eq catalogue
 import numpy as np
 
 
-def decimal_year(year, month, day):
-    """Function to calculate the decimal year for a vector of dates"""
-    marker = np.array([0., 31., 59., 90., 120., 151., 181.,
-                                 212., 243., 273., 304., 334.])
-    tmonth = (month - 1).astype(int)
-    day_count = marker[tmonth] + day - 1.
-    dec_year = year + (day_count / 365.)
-    return dec_year
+def decimal_year(year, month, day, hour=0., minute=0., second=0.):
+    """
+    Function to calculate the decimal year for a vector of dates,
+    taking into account leap years and the time of the day
+    """
+    year = np.asarray(year, dtype=float)
+    start = greg2julian(year, 1., 1., 0., 0., 0.)
+    end = greg2julian(year + 1., 1., 1., 0., 0., 0.)
+    time = greg2julian(year, month, day, hour, minute, second)
+    return year + (time - start) / (end - start)
 
 
 def greg2julian(year, month, day, hour, minute, second):
     """ Function to convert a date from Gregorian to Julian format"""
+    year = np.asarray(year, dtype=float)
+    month = np.asarray(month, dtype=float)
     timeut = hour + (minute / 60.0) + (second / 3600.0)
+    # (month - 9) / 7 is an integer division truncated towards zero
     jd = (367.0 * year) - np.floor(7.0 * (year +
              np.floor((month + 9.0) / 12.0)) / 4.0) - np.floor(3.0 *
-             (np.floor((year + (month - 9.0) / 7.0) / 100.0) + 1.0) /
+             (np.floor((year + np.fix((month - 9.0) / 7.0)) / 100.0) + 1.0) /
              4.0) + np.floor((275.0 * month) / 9.0) + day +\
              1721028.5 + (timeut / 24.0)
     return jd
 
 
-def haversine(lon1, lat1, lon2, lat2, radians=False, earth_rad=6371.227):
+def julian2year(jd):
+    """
+    Return the Gregorian calendar year of
+    dates given in Julian days (greg2julian)
+    """
+    jd = np.asarray(jd, dtype=float)
+    # Estimate, one year off at most, corrected
+    # by the first day of the estimated year
+    year = np.floor((jd - 1721425.5) / 365.2425) + 1.
+    year -= jd < greg2julian(year, 1., 1., 0., 0., 0.)
+    year += jd >= greg2julian(year + 1., 1., 1., 0., 0., 0.)
+    return year
+
+
+# Largest absolute error (km) of float32 haversine distances
+# below 10000 km, measured error is about 5 m
+HAVERSINE_FLOAT32_ERROR = 0.01
+
+
+def haversine(lon1, lat1, lon2, lat2, radians=False, earth_rad=6371.227,
+    dtype=np.float64):
     '''Quick function to perform geographical distance calculation
-    using the haversine formula. The distance is returned in km'''
+    using the haversine formula. The distance is returned in km,
+    computed with the given float dtype: float32 distances have
+    an absolute error below HAVERSINE_FLOAT32_ERROR km'''
+    # kernels (numba when available) is imported on first use
+    from mtoolkit.kernels import kernel
+
+    lon1 = np.asarray(lon1, dtype=dtype)
+    lat1 = np.asarray(lat1, dtype=dtype)
+    lon2 = np.asarray(lon2, dtype=dtype)
+    lat2 = np.asarray(lat2, dtype=dtype)
     if radians == False:
-        cfact = np.pi / 180.
+        cfact = dtype(np.pi / 180.)
         lon1 = cfact * lon1
         lat1 = cfact * lat1
         lon2 = cfact * lon2
         lat2 = cfact * lat2
-    # Number of locations in each set of points
-    if not np.shape(lon1):
-        nlocs1 = 1
-        lon1 = np.array([lon1])
-        lat1 = np.array([lat1])
-    else:
-        nlocs1 = np.max(np.shape(lon1))
-    if not np.shape(lon2):
-        nlocs2 = 1
-        lon2 = np.array([lon2])
-        lat2 = np.array([lat2])
-    else:
-        nlocs2 = np.max(np.shape(lon2))
+    lon1, lat1 = np.ravel(lon1), np.ravel(lat1)
+    lon2, lat2 = np.ravel(lon2), np.ravel(lat2)
     # Pre-allocate array
-    distance = np.zeros((nlocs1, nlocs2))
-    i = 0
-    while i < nlocs2:
-        # Perform distance calculation
-        dlat = lat1 - lat2[i]
-        dlon = lon1 - lon2[i]
-        aval = (np.sin(dlat / 2.) ** 2.) + (np.cos(lat1) * np.cos(lat2[i]) *
-             (np.sin(dlon / 2.) ** 2.))
-        distance[:, i] = (2. * earth_rad * np.arctan2(np.sqrt(aval),
-                                                    np.sqrt(1 - aval))).T
-        i += 1
+    distance = np.zeros((len(lon1), len(lon2)), dtype=dtype)
+    kernel('haversine')(lon1, lat1, lon2, lat2, earth_rad, distance)
     return distance
+
+
+class CatalogueIndex(object):
+    """
+    CatalogueIndex keeps a time sorted permutation
+    of the events of a catalogue and answers time
+    window queries with a binary search, returning
+    slices of the permutation rather than masks
+    over the whole catalogue.
+    """
+
+    def __init__(self, time):
+        """
+        order - positions of the events sorted by time
+        sorted_time - time of the events sorted by time
+        """
+
+        self.order = np.argsort(time, kind='mergesort')
+        self.sorted_time = np.asarray(time)[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def events_between(self, start, end):
+        """
+        Return the slice of order holding the
+        events with start <= time <= end.
+        """
+
+        return slice(np.searchsorted(self.sorted_time, start, side='left'),
+                np.searchsorted(self.sorted_time, end, side='right'))
+
+    def events(self, start, end):
+        """
+        Return the positions of the events
+        with start <= time <= end, sorted by time.
+        """
+
+        return self.order[self.events_between(start, end)]
+
+    def reordered(self, order):
+        """
+        Return the index of the same events taken in the
+        given order, i.e. of the catalogue indexed by order.
+        """
+
+        position = np.empty(len(order), dtype=int)
+        position[order] = np.arange(len(order))
+        index = object.__new__(CatalogueIndex)
+        index.order = position[self.order]
+        index.sorted_time = self.sorted_time
+        return index
+
+
+# Columns of a catalogue matrix in the sample format
+SAMPLE_FORMAT = ('year', 'month', 'day', 'longitude', 'latitude', 'Mw',
+                 'time')
+
+
+class CatalogueMatrix(np.ndarray):
+    """
+    CatalogueMatrix is a numpy matrix with one row per
+    event and named columns, rows selected from it keep
+    the names of its columns and columns selected from
+    it get the names of the selected columns.
+    """
+
+    def __new__(cls, data, columns):
+        matrix = np.asarray(data).view(cls)
+        if matrix.ndim != 2 or matrix.shape[1] != len(columns):
+            raise ValueError('Expected %d columns' % len(columns))
+        matrix.columns = tuple(columns)
+        return matrix
+
+    def __array_finalize__(self, obj):
+        # Views with other columns lose the names,
+        # the ones given by an index are set by __getitem__
+        columns = getattr(obj, 'columns', None)
+        if columns is not None and (self.ndim != 2 or
+                self.shape[1] != len(columns)):
+            columns = None
+        self.columns = columns
+
+    def __getitem__(self, key):
+        matrix = super(CatalogueMatrix, self).__getitem__(key)
+        if isinstance(matrix, CatalogueMatrix) and matrix.ndim == 2 and \
+                self.columns is not None:
+            matrix.columns = self._selected_columns(key)
+        return matrix
+
+    def _selected_columns(self, key):
+        """
+        Return the names of the columns selected by an index,
+        None when the index is not a (rows, columns) pair
+        """
+
+        if not isinstance(key, tuple):
+            return self.columns
+        if len(key) != 2 or any(item is Ellipsis or item is None
+                for item in key):
+            return None
+        return tuple(self.columns[i] for i in
+                np.arange(len(self.columns))[key[1]])
+
+    def __reduce__(self):
+        reconstruct, args, state = super(CatalogueMatrix, self).__reduce__()
+        return reconstruct, args, (state, self.columns)
+
+    def __setstate__(self, state):
+        super(CatalogueMatrix, self).__setstate__(state[0])
+        self.columns = state[1]
+
+
+def column_names(data):
+    """
+    Return the names of the columns of a catalogue matrix,
+    a matrix without names is in the sample format
+    """
+
+    columns = getattr(data, 'columns', None)
+    if columns is None:
+        columns = SAMPLE_FORMAT[:np.shape(data)[1]]
+    return columns
+
+
+def catalogue_column(data, name):
+    """Return a column of a catalogue matrix given its name"""
+
+    columns = column_names(data)
+    if name not in columns:
+        raise ValueError('No %s column in the catalogue matrix' % name)
+    return np.asarray(data)[:, columns.index(name)]
+
+
+def event_year(data):
+    """
+    Return the year of the events of a catalogue matrix,
+    derived from its time column when it is present
+    """
+
+    if 'time' in column_names(data):
+        return julian2year(catalogue_column(data, 'time'))
+    return catalogue_column(data, 'year')
@@ -22,8 +22,12 @@
 
 import numpy as np
 
+from mtoolkit.catalogue_utilities import CatalogueIndex
+from mtoolkit.catalogue_store import tile_coordinates, morton_code
+from mtoolkit.kernels import kernel
 
-def stepp_analysis(year, mw, dm=0.1, dt=1, ttol=0.2, iloc=True):
+
+def stepp_analysis(year, mw, dm=0.1, dt=1, ttol=0.2, iloc=True, index=None):
     """
     Stepp function
     Year    = Year of earthquake
@@ -35,90 +39,307 @@ def stepp_analysis(year, mw, dm=0.1, dt=1, ttol=0.2, iloc=True):
               can only increase with catalogue duration
               (i.e. completess cannot increase for more
                recent catalogues)
+    index   = CatalogueIndex of the events by time (e.g. the
+              catalog index of the context), built from
+              Year when not given
     """
 
     # Round off the magnitudes to 2 d.p
-    mw = np.around(100.0 * mw) / 100.0
-    lowm = np.floor(10. * np.min(mw)) / 10.
-    highm = np.ceil(10. * np.max(mw)) / 10.
+    mw = _round_magnitudes(mw)
+    mbin, T, TLB = _stepp_bins(np.min(year), np.max(year), np.min(mw),
+            np.max(mw), dm, dt)
+    N = np.zeros((len(T), len(mbin) - 1))
+    # Magnitude bin of every event, the last bin
+    # holds all the events above its lower bound
+    if index is None:
+        index = CatalogueIndex(year)
+    mag_bin = _magnitude_bins(mbin, mw[index.order])
+    # count number of events catalogue and magnitude windows
+    kernel('stepp_counts')(mag_bin, np.asarray(year)[index.order], TLB, N)
+
+    return _stepp_table(N, mbin, T, np.max(year), ttol, iloc)
+
+
+def _round_magnitudes(mw):
+    """Round off the magnitudes to 2 d.p"""
+
+    return np.around(100.0 * mw) / 100.0
+
+
+def _stepp_bins(startT, endT, minm, maxm, dm, dt):
+    """
+    Return the magnitude bins, the time windows and the
+    lower bounds of the time windows of a catalogue
+    """
+
+    lowm = np.floor(10. * minm) / 10.
+    highm = np.ceil(10. * maxm) / 10.
     # Determine magnitude bins
     mbin = np.arange(lowm, highm + dm, dm)
-    ntb = np.max(np.shape(mbin))
     # Determine time bins
-    endT = np.max(year)
-    startT = np.min(year)
     T = np.arange(dt, endT - startT + 2, dt)
     #T = np.vstack([np.arange(dt, endT - startT, dt)[:, np.newaxis], endT])
-    nt = np.max(np.shape(T))
-    TUB = endT * np.ones(nt)
+    TUB = endT * np.ones(len(T))
     TLB = TUB - T
-    TRT = 1. / np.sqrt(T)  # Poisson rate
+    return mbin, T, TLB
 
-    N = np.zeros((nt, ntb - 1))
-    lamda = np.zeros((nt, ntb - 1))
-    siglam = np.zeros((nt, ntb - 1))
-    ii = 0
-    # count number of events catalogue and magnitude windows
-    while ii <= (nt - 1):
-    # Select earthquakes later than or in Year[ii]
-        yrchk = year >= TLB[ii]
-        mtmp = mw[yrchk]
-        jj = 0
-        while jj <= (ntb - 2):
-            #Count earthquakes in magnitude bin
-            if jj == (ntb - 2):
-                N[ii, jj] = np.sum(mtmp >= np.sum(mbin[jj]))
-            else:
-                N[ii, jj] = np.sum(np.logical_and(mtmp >= mbin[jj],
-                                           mtmp < mbin[jj + 1]))
-            jj = jj + 1
-        ii = ii + 1
+
+def _magnitude_bins(mbin, mw):
+    """
+    Return the magnitude bin of the magnitudes, the last
+    bin holds all the magnitudes above its lower bound
+    """
+
+    mag_bin = np.searchsorted(mbin, mw, side='right') - 1
+    return np.minimum(mag_bin, np.max(np.shape(mbin)) - 2)
+
+
+def _stepp_table(N, mbin, T, endT, ttol, iloc):
+    """
+    Return the completeness table given by the tolerance
+    test of the counts N (time windows x magnitude bins)
+    """
+
+    return _stepp_tables(N[np.newaxis], mbin, T, endT, ttol, iloc)[0]
+
+
+def _stepp_tables(N, mbin, T, endT, ttol, iloc):
+    """
+    Return the completeness tables given by the tolerance
+    test of the counts N of several catalogues (catalogues x
+    time windows x magnitude bins), the test runs on all the
+    catalogues and time windows at once
+    """
+
+    ncat = N.shape[0]
+    ntb = np.max(np.shape(mbin))
+    nt = np.max(np.shape(T))
+    Tcol = T[:, np.newaxis]
+    TRT = 1. / np.sqrt(T)  # Poisson rate
 
     diffT = (np.log10(TRT[1:]) - np.log10(TRT[:-1]))
     diffT = diffT / (np.log10(T[1:]) - np.log10(T[:-1]))
-    comp_length = np.zeros((ntb - 1, 1))
-    tloc = np.zeros((ntb - 1, 1), dtype=int)
+    lamda = N / Tcol
+    siglam = np.sqrt(lamda / Tcol)
+    siglam[siglam < 1E-14] = 1E-14   # To avoid divide by zero
+    grad1 = (np.log10(siglam[:, 1:]) - np.log10(siglam[:, :-1]))
+    grad1 = grad1 / (np.log10(Tcol[1:]) - np.log10(Tcol[:-1]))
+    resid1 = grad1 - diffT[:, np.newaxis]
+    test1 = np.abs(resid1[:, 1:] - resid1[:, :-1]) > ttol
+    # Last location passing the test, the first location
+    # alone doesn't count (as in the original algorithm)
+    if test1.shape[1]:
+        last = test1.shape[1] - 1 - np.argmax(test1[:, ::-1], axis=1)
+        tloct = np.where(np.any(test1, axis=1) & (last > 0), last, -1)
+    else:
+        tloct = -np.ones((ncat, ntb), dtype=int)
+
+    tloc = np.zeros((ncat, ntb - 1), dtype=int)
     ii = 0
     while ii < (ntb - 1):
-        lamda[:, ii] = N[:, ii] / T
-        siglam[:, ii] = np.sqrt(lamda[:, ii] / T)
-        zero_find = siglam[:, ii] < 1E-14   # To avoid divide by zero
-        siglam[zero_find, ii] = 1E-14
-        #print siglam[:, ii]
-        grad1 = (np.log10(siglam[1:, ii]) - np.log10(siglam[:-1, ii]))
-        grad1 = grad1 / (np.log10(T[1:]) - np.log10(T[:-1]))
-        resid1 = grad1 - diffT
-        test1 = np.abs(resid1[1:] - resid1[:-1])
-        tloct = np.nonzero(test1 > ttol)[0]
-        if not(np.any(tloct)):
-            tloct = -1
-        else:
-            tloct = tloct[-1]
-        if tloct < 0:
-            # No location passes test
-            if ii > 0:
-                # Use previous value
-                tloc[ii] = tloc[ii - 1]
-            else:
-                # Print warning
-                #print "Fitting tolerance removed all data - change parameter"
-                pass
-        else:
-            tloc[ii] = tloct
-        if tloct > np.max(np.shape(T)):
-            tloc[ii] = np.max(np.shape(T))
-
         if ii > 0:
+            # No location passes test: use previous value
+            tloc[:, ii] = np.where(tloct[:, ii] < 0, tloc[:, ii - 1],
+                    tloct[:, ii])
             # If the increasing completeness is option is set
             # and the completeness is lower than the previous value
             # then fix at previous value
-            inc_check = np.logical_and(iloc, (tloc[ii] < tloc[ii - 1]))
-            if inc_check:
-                tloc[ii] = tloc[ii - 1]
-        comp_length[ii] = T[tloc[ii]]
-
+            if iloc:
+                tloc[:, ii] = np.maximum(tloc[:, ii], tloc[:, ii - 1])
+        else:
+            tloc[:, ii] = np.maximum(tloct[:, ii], 0)
         ii = ii + 1
+    comp_length = T[tloc]
+
+    return np.dstack([np.tile(mbin[:-1], (ncat, 1)), endT - comp_length])
+
+
+def grouped_stepp_analysis(group, year, mw, ngroups, dm=0.1, dt=1, ttol=0.2,
+        iloc=True):
+    """
+    Stepp function applied at once to groups of events
+    (e.g. the cells of a grid or the sources of a source
+    model), group holds the group of every event, events
+    belonging to several groups are given once per group.
+    The events are binned by group, time window and magnitude
+    bin in a single histogram, all the groups share the
+    magnitude bins and the time windows of the events given.
+    Return the completeness tables (groups x magnitude bins x 2)
+    """
+
+    group = np.asarray(group, dtype=int)
+    year = np.asarray(year)
+    mw = _round_magnitudes(np.asarray(mw, dtype=float))
+    mbin, T, TLB = _stepp_bins(np.min(year), np.max(year), np.min(mw),
+            np.max(mw), dm, dt)
+    nt, nbins = len(T), len(mbin) - 1
+    mag_bin = _magnitude_bins(mbin, mw)
+    # First time window holding every event, the lower
+    # bounds of the time windows move back in time
+    window = nt - np.searchsorted(TLB[::-1], year, side='right')
+    counted = mag_bin >= 0
+    histogram = np.bincount((group[counted] * (nt + 1) + window[counted]) *
+            nbins + mag_bin[counted], minlength=ngroups * (nt + 1) * nbins)
+    histogram = histogram.reshape(ngroups, nt + 1, nbins)
+    # Events later than the lower bound of each window
+    N = np.cumsum(histogram[:, :nt], axis=1).astype(float)
+
+    return _stepp_tables(N, mbin, T, np.max(year), ttol, iloc)
+
+
+def gridded_completeness(longitude, latitude, year, mw, cell_size=1.0,
+        dm=0.1, dt=1, ttol=0.2, iloc=True):
+    """
+    Stepp function applied at once to the events of every
+    cell (cell_size degrees) of a grid, return the lower
+    left corners (longitude, latitude) of the cells holding
+    events and their completeness tables
+    """
+
+    columns, rows = tile_coordinates(longitude, latitude, cell_size)
+    _, first, group = np.unique(morton_code(columns, rows),
+            return_index=True, return_inverse=True)
+    corners = np.column_stack([columns[first] * cell_size - 180.,
+        rows[first] * cell_size - 90.])
+    return corners, grouped_stepp_analysis(group, year, mw, len(first),
+            dm, dt, ttol, iloc)
+
+
+def cell_groups(longitude, latitude, corners, cell_size=1.0):
+    """
+    Return the position in corners (lower left corners of
+    cells, as returned by gridded_completeness) of the cell
+    holding every point, -1 for the points of other cells
+    """
+
+    codes = morton_code(*tile_coordinates(longitude, latitude, cell_size))
+    corners = np.reshape(corners, (-1, 2))
+    if not len(corners):
+        return np.zeros(len(codes), dtype=int) - 1
+    # Cells are found by their centre, away from rounding
+    cell_codes = morton_code(*tile_coordinates(corners[:, 0] +
+        cell_size / 2., corners[:, 1] + cell_size / 2., cell_size))
+    order = np.argsort(cell_codes)
+    position = np.minimum(np.searchsorted(cell_codes[order], codes),
+            len(order) - 1)
+    return np.where(cell_codes[order][position] == codes, order[position],
+            -1)
+
+
+# Tolerance used when comparing magnitudes with the
+# completeness magnitudes, so that values lying on a
+# bin edge are not lost to rounding
+MAGNITUDE_TOL = 1E-7
+
+
+def completeness_flags(year, mw, completeness_table, group=None):
+    """
+    Return a bool array flagging the events recorded in the
+    complete part of the catalogue: every [magnitude, year]
+    row of the completeness table gives the year since which
+    events of greater or equal magnitude are complete. When
+    group is given, completeness_table holds the tables of
+    several groups sharing their magnitudes (groups x rows x 2,
+    as returned by grouped_stepp_analysis) and every event
+    is flagged by the table of its group.
+    """
+
+    completeness_table = np.asarray(completeness_table, dtype=float)
+    if group is None:
+        completeness_table = completeness_table[np.newaxis]
+        group = np.zeros(np.shape(mw), dtype=int)
+    irow = np.searchsorted(completeness_table[0, :, 0], mw + MAGNITUDE_TOL,
+            side='right') - 1
+    complete = irow >= 0
+    complete[complete] = year[complete] >= \
+            completeness_table[group[complete], irow[complete], 1]
+    return complete
+
+
+class SteppAnalyser(object):
+    """
+    SteppAnalyser keeps the count of the events of a growing
+    catalogue for every (year, magnitude) pair, magnitudes
+    rounded off to 2 d.p. Adding (or removing) events updates
+    the counts in O(events), the completeness table is then
+    given by the cumulative counts of the Stepp time windows
+    and by the tolerance test, as stepp_analysis would give
+    it for the whole catalogue.
+    """
+
+    def __init__(self, dm=0.1, dt=1, ttol=0.2, iloc=True):
+        self.dm = dm
+        self.dt = dt
+        self.ttol = ttol
+        self.iloc = iloc
+        # Sorted distinct years and magnitudes of the
+        # counts, counts[i, j] events of years[i], mws[j]
+        self.years = np.zeros(0)
+        self.mws = np.zeros(0)
+        self.counts = np.zeros((0, 0), dtype=int)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def add(self, year, mw, sign=1):
+        """Add the events of the given years and magnitudes"""
+
+        year = np.asarray(year, dtype=float)
+        mw = _round_magnitudes(np.asarray(mw, dtype=float))
+        self.years = self._insert(self.years, year, 0)
+        self.mws = self._insert(self.mws, mw, 1)
+        cells = (np.searchsorted(self.years, year),
+                np.searchsorted(self.mws, mw))
+        np.add.at(self.counts, cells, sign)
+        if sign < 0 and np.any(self.counts < 0):
+            np.add.at(self.counts, cells, -sign)
+            raise RuntimeError('Removed events were not added')
+
+    def remove(self, year, mw):
+        """Remove the events of the given years and magnitudes"""
+
+        self.add(year, mw, -1)
+
+    def _insert(self, values, new_values, axis):
+        """
+        Insert the new distinct values in the sorted values,
+        along with zero counts, return the values
+        """
+
+        new_values = np.setdiff1d(new_values, values)
+        if len(new_values):
+            positions = np.searchsorted(values, new_values)
+            self.counts = np.insert(self.counts, positions, 0, axis=axis)
+            values = np.insert(values, positions, new_values)
+        return values
+
+    def window_counts(self):
+        """
+        Return the magnitude bins, the time windows and the
+        counts of the events of every time window and
+        magnitude bin (time windows x magnitude bins)
+        """
+
+        years = self.years[self.counts.any(axis=1)]
+        mws = self.mws[self.counts.any(axis=0)]
+        if not len(years):
+            raise RuntimeError('No events to analyse')
+        mbin, T, TLB = _stepp_bins(years[0], years[-1], mws[0], mws[-1],
+                self.dm, self.dt)
+        # Counts of the magnitude bins, events of the
+        # later years first
+        bin_counts = np.zeros((len(self.years), len(mbin) - 1))
+        for j, mag_bin in enumerate(_magnitude_bins(mbin, self.mws)):
+            if mag_bin >= 0:
+                bin_counts[:, mag_bin] += self.counts[:, j]
+        later = np.vstack([np.cumsum(bin_counts[::-1], axis=0)[::-1],
+            np.zeros((1, len(mbin) - 1))])
+        # Events later than the lower bound of each window
+        return mbin, T, later[np.searchsorted(self.years, TLB, side='left')]
 
-    completeness_table = np.column_stack([mbin[:-1].T, endT - comp_length])
+    def completeness_table(self):
+        """Return the completeness table of the events added"""
 
-    return completeness_table
+        mbin, T, N = self.window_counts()
+        return _stepp_table(N, mbin, T, self.years[
+            self.counts.any(axis=1)][-1], self.ttol, self.iloc)
@@ -39,6 +39,53 @@ def build_cmd_parser():
                         help="""Specify the configuration
                         file (i.e. config.yml)""")
 
+    parser.add_argument('--warm-cache',
+                        dest='warm_cache',
+                        action='store_true',
+                        help="""Read the source model and store
+                        it in the source model cache""")
+
+    parser.add_argument('--clear-cache',
+                        dest='clear_cache',
+                        action='store_true',
+                        help="""Remove all the entries of
+                        the source model cache""")
+
+    parser.add_argument('--build-store',
+                        dest='store_dir',
+                        metavar='store directory',
+                        help="""Build the catalogue store (binary eq
+                        catalog with a spatial index) of the eq catalog
+                        in the given directory""")
+
+    parser.add_argument('--sweep',
+                        dest='sweep_file',
+                        metavar='sweep file',
+                        help="""Run the configuration with every
+                        combination of the overrides defined
+                        in the sweep file (i.e. sweep.yml)""")
+
+    parser.add_argument('--serve',
+                        dest='serve_port',
+                        type=int,
+                        metavar='port',
+                        help="""Serve on localhost the configuration,
+                        the configs posted to /run override it""")
+
+    parser.add_argument('--workers',
+                        dest='workers',
+                        type=int,
+                        default=1,
+                        help="""Number of workers running the
+                        configs posted to the server""")
+
+    parser.add_argument('--backend',
+                        dest='backend',
+                        choices=['numpy', 'numba'],
+                        help="""Backend of the declustering, completeness
+                        and distance kernels, it overrides the backend
+                        of the configuration file""")
+
     parser.add_argument('-v', '--version',
                         action='version',
                         version="%(prog)s 0.0.1")
@@ -47,24 +94,26 @@ def build_cmd_parser():
 
 def cmd_line():
     """
-    Return cmdline input argument
+    Return cmdline input arguments, where
+    input_file is the configuration filename,
     after checking the proper input
     has been given.
     """
 
     parser = build_cmd_parser()
-    input_filename = None
+    args = None
     if len(sys.argv) == 1:
         parser.print_help()
     else:
         args = parser.parse_args()
-        if os.path.exists(args.input_file[0]):
-            input_filename = args.input_file[0]
+        if args.input_file and os.path.exists(args.input_file[0]):
+            args.input_file = args.input_file[0]
         else:
             print 'Error: non existent input file\n'
             parser.print_help()
+            args = None
 
-    return input_filename
+    return args
 
 
 def build_logger():
@@ -19,12 +19,28 @@
 
 '''Module to implement declustering algorithms'''
 
+from multiprocessing import Pool
+
 import numpy as np
-from mtoolkit.catalogue_utilities import decimal_year, haversine
+from mtoolkit.catalogue_utilities import greg2julian, haversine, \
+CatalogueIndex, CatalogueMatrix, catalogue_column, column_names
+from mtoolkit.sharedmem import share, attach
+from mtoolkit.kernels import kernel
+
+
+# Earth radius (km) used by haversine
+EARTH_RADIUS = 6371.227
+
+# Magnitude range covered by the grids of the window tables
+TABLE_MIN_MAGNITUDE = -3.0
+TABLE_MAX_MAGNITUDE = 10.0
+# Maximum number of decimals of the magnitudes looked
+# up in a window table, finer magnitudes get exact windows
+TABLE_MAX_DECIMALS = 3
 
 
 # Choose Calculate Magnitude and Distance Windows (for Gardner & Knopoff)
-def calc_windows(m, window_opt):
+def window_formulas(m, window_opt):
     """Function to calculate time and distance windows according \
     to the methods of "Gruenthal", "Uhrhammer" or "GardnerKnopoff"""
     if window_opt == 'Gruenthal':
@@ -44,88 +60,594 @@ def calc_windows(m, window_opt):
     return f_space, f_time
 
 
+def magnitude_decimals(m, max_decimals=TABLE_MAX_DECIMALS):
+    """
+    Return the number of decimals of the magnitudes of
+    a catalogue, None if they have more than max_decimals
+    """
+    for decimals in xrange(max_decimals + 1):
+        if np.all(np.round(m, decimals) == m):
+            return decimals
+    return None
+
+
+class WindowTable(object):
+    """
+    WindowTable provides the distance and time windows
+    of a set of magnitudes looking them up in a grid
+    of magnitudes with the precision of the catalogue,
+    the grid is sampled once per precision and reused
+    across declustering runs.
+    """
+
+    def __init__(self, magnitudes=None, f_space=None, f_time=None,
+            window_opt=None):
+        """
+        A table is defined either by the name of one of the window
+        formulas (window_opt) or by the distance (km) and time
+        (years) windows at some magnitudes, linearly interpolated
+        between them and held constant outside them.
+        """
+
+        self.window_opt = window_opt
+        if window_opt is None:
+            order = np.argsort(magnitudes)
+            self.magnitudes = np.asarray(magnitudes, dtype=float)[order]
+            self.f_space = np.asarray(f_space, dtype=float)[order]
+            self.f_time = np.asarray(f_time, dtype=float)[order]
+        self._grids = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a table from a config dict with magnitude,
+        distance (km) and time (days) lists
+        """
+
+        return cls(config['magnitude'], config['distance'],
+                np.asarray(config['time'], dtype=float) / 365.)
+
+    def sample(self, m):
+        """Return the windows of the given magnitudes"""
+
+        if self.window_opt is not None:
+            return window_formulas(m, self.window_opt)
+        return (np.interp(m, self.magnitudes, self.f_space),
+                np.interp(m, self.magnitudes, self.f_time))
+
+    def grid(self, decimals, dtype=np.float64):
+        """
+        Return the magnitudes, distance and time windows
+        of the grid with the given number of decimals,
+        windows are stored with the given float dtype
+        """
+
+        key = (decimals, np.dtype(dtype))
+        if key not in self._grids:
+            step = 10. ** -decimals
+            nmag = int(round((TABLE_MAX_MAGNITUDE - TABLE_MIN_MAGNITUDE) /
+                    step)) + 1
+            grid_m = np.round(TABLE_MIN_MAGNITUDE + step * np.arange(nmag),
+                    decimals)
+            # The formulas are not defined for every magnitude of
+            # the grid, those windows are never looked up
+            with np.errstate(invalid='ignore'):
+                f_space, f_time = self.sample(grid_m)
+            self._grids[key] = (grid_m, f_space.astype(dtype),
+                    f_time.astype(dtype))
+        return self._grids[key]
+
+    def windows(self, m, dtype=np.float64):
+        """
+        Return the distance and time windows of the
+        given magnitudes, with the given float dtype
+        """
+
+        decimals = magnitude_decimals(m)
+        if decimals is None or len(m) == 0 or \
+                np.min(m) < TABLE_MIN_MAGNITUDE or \
+                np.max(m) > TABLE_MAX_MAGNITUDE:
+            f_space, f_time = self.sample(m)
+            return f_space.astype(dtype), f_time.astype(dtype)
+        grid_m, f_space, f_time = self.grid(decimals, dtype)
+        idx = np.round((m - TABLE_MIN_MAGNITUDE) *
+                10. ** decimals).astype(int)
+        return f_space[idx], f_time[idx]
+
+
+# Window tables of the window formulas, shared by all the runs
+WINDOW_TABLES = {}
+
+
+def calc_windows(m, window_opt, dtype=np.float64):
+    """
+    Return the distance and time windows of the given magnitudes,
+    window_opt is either a WindowTable or the name of one of the
+    window formulas ("Gruenthal", "Uhrhammer" or "GardnerKnopoff"),
+    windows are returned with the given float dtype
+    """
+    if not isinstance(window_opt, WindowTable):
+        if window_opt not in WINDOW_TABLES:
+            WINDOW_TABLES[window_opt] = WindowTable(window_opt=window_opt)
+        window_opt = WINDOW_TABLES[window_opt]
+    return window_opt.windows(m, dtype)
+
+
+def event_time(data):
+    """
+    Return the time in Julian days of the events of a catalogue
+    matrix, taken from its time column when it is present
+    """
+    if 'time' in column_names(data):
+        return catalogue_column(data, 'time')
+    return greg2julian(catalogue_column(data, 'year'),
+            catalogue_column(data, 'month'),
+            catalogue_column(data, 'day'), 0., 0., 0.)
+
+
+def _gardner_knopoff_events(data, window_opt, precision):
+    '''Return the magnitudes, the coordinates (radians), the
+       distance (km) and time (days) windows and the times of
+       the events of a catalogue matrix'''
+    dtype = np.dtype(precision).type
+    m = catalogue_column(data, 'Mw')
+    cfact = dtype(np.pi / 180.)
+    lon = cfact * np.asarray(catalogue_column(data, 'longitude'), dtype=dtype)
+    lat = cfact * np.asarray(catalogue_column(data, 'latitude'), dtype=dtype)
+    # Get space and time windows corresponding to each event
+    f_space, f_time = calc_windows(m, window_opt, dtype)
+    # Time windows are given in years of 365 days
+    return m, lon, lat, f_space, f_time * 365., event_time(data)
+
+
+def _gardner_knopoff_clusters(events, order, fs_time_prop, index=None):
+    '''Return the clusters of the events taken in the given order
+       (descending magnitude), cluster i + 1 is the one of the
+       i-th event in order. index is the time index of the
+       events, built when not given'''
+    m, lon, lat, f_space, f_time, time_day = [values[order]
+            for values in events]
+    # Index of the events sorted by time, time windows
+    # are answered with a binary search
+    if index is None:
+        index = CatalogueIndex(time_day)
+    else:
+        index = index.reordered(order)
+    # Cluster identification, vcl indicates the cluster to
+    # which an event belongs: +vcl = aftershock, -vcl = foreshock
+    vcl = np.zeros(len(order), dtype=int)
+    kernel('gardner_knopoff')(time_day, lon, lat, f_space, f_time,
+            fs_time_prop, index.order, index.sorted_time, EARTH_RADIUS, vcl)
+    return vcl
+
+
+def _gardner_knopoff_results(data, vcl):
+    '''Return vcl, the mainshocks and the flag vector'''
+    # Now to produce a catalogue with aftershocks purged
+    vmain_shock = data[np.nonzero(vcl == 0)[0], :]
+    # Also create a simple flag vector which, for each event, takes
+    # a value of 1 if aftershock, -1 if foreshock, and 0 otherwise
+    flagvector = np.copy(vcl)
+    flagvector[vcl < 0] = -1
+    flagvector[vcl > 0] = 1
+
+    return vcl, vmain_shock, flagvector
+
+
 def gardner_knopoff_decluster(
-    data, window_opt='GardnerKnopoff', fs_time_prop=0):
+    data, window_opt='GardnerKnopoff', fs_time_prop=0, precision='float64',
+    index=None):
     ''' Function to implement Gardner & Knopoff Declustering Algorithm
-        data = EQ catalogue in sample format
+        data = EQ catalogue matrix, with named columns or in sample
+               format, when present the time column holds the
+               event time in Julian days
         WindowOpt = 'GardnerKnopoff' for Gardner & Knopoff windows
                               'Uhrhammer' for 'Uhrhammer' implementation
                               'Gruenthal' for Gruenthal implementation
+                              or a WindowTable of custom windows
         FSTimeProp = Foreshock time window as a proportion of aftershock
-                              time window '''
+                              time window
+        precision = float type ('float64' or 'float32') of windows and
+                    distances, event times are always float64: float32
+                    distances are within HAVERSINE_FLOAT32_ERROR km
+                    and windows within a relative 1E-7 of float64
+        index = CatalogueIndex of the events by time (e.g. the
+                catalog index of the context), built when not given '''
 
     #~ #Define reference ellipsoid for geospatial calculations
     #~ ref_geoid = Geod(ellps="WGS84")
 
     # Get relevent parameters
-    m = data[:, 5]
-    neq = np.shape(data)[0]  # Number of earthquakes
-    # Get decimal year (needed for time windows)
-    year_dec = decimal_year(data[:, 0], data[:, 1], data[:, 2])
-    # Get space and time windows corresponding to each event
-    f_space, f_time = calc_windows(m, window_opt)
-    eqid = np.arange(0, neq, 1)  # Initial Position Identifier
-
-    # Pre-allocate cluster index vectors
-    vcl = np.zeros(neq, dtype=int)
-
-    # Sort magnitudes into descending order
-    id0 = np.flipud(np.argsort(m, kind='heapsort'))
-    m = m[id0]
-    data = data[id0, :]
-    f_space = f_space[id0]
-    f_time = f_time[id0]
-    year_dec = year_dec[id0]
-    eqid = eqid[id0]
-    #Begin cluster identification
+    events = _gardner_knopoff_events(data, window_opt, precision)
+    # Sort magnitudes into descending order, events of
+    # equal magnitude are taken in catalogue order
+    id0 = np.argsort(-events[0], kind='mergesort')
+    vcl = np.zeros(len(id0), dtype=int)
+    vcl[id0] = _gardner_knopoff_clusters(events, id0, fs_time_prop, index)
+    return _gardner_knopoff_results(data, vcl)
+
+
+# Relative margin of the distance windows when looking
+# for linked events, covers the rounding of the distances
+LINK_TOLERANCE = 1E-5
+# Proportion of the events of the catalogue above which
+# an append declusters the whole catalogue again
+APPEND_MAX_LINKED = 0.1
+
+
+def _distances(events, candidates, i):
+    '''Return the distances (km) of the candidates from event i'''
+    lon, lat = events[1], events[2]
+    distance = np.zeros((len(candidates), 1), dtype=lon.dtype)
+    kernel('haversine')(lon[candidates], lat[candidates], lon[i:i + 1],
+            lat[i:i + 1], EARTH_RADIUS, distance)
+    return distance[:, 0]
+
+
+def _linked_events(events, seeds, fs_time_prop, limit=None):
+    '''Return the mask of the events linked to the seed events by a
+       chain of events, each one inside the window of the previous
+       one or holding the previous one in its window. Declustering
+       the linked events alone gives their clusters in the whole
+       catalogue, as no other event is in the window of a linked
+       event or holds one in its window. Return None when more
+       than limit events are linked.'''
+    f_space, f_time, time_day = events[3:]
+    index = CatalogueIndex(time_day)
+    # Widest windows, they bound the events which can hold an
+    # event in their window (one day covers the rounding)
+    max_after = f_time.max() + 1. if len(f_time) else 0.
+    max_before = fs_time_prop * max_after + 1.
+    linked = np.zeros(len(time_day), dtype=bool)
+    linked[seeds] = True
+    pending = list(seeds)
+    count = len(pending)
+    while pending:
+        i = pending.pop()
+        # Events inside the window of i
+        inside = index.events(time_day[i] - f_time[i] * fs_time_prop,
+                time_day[i] + f_time[i])
+        inside = inside[_distances(events, inside, i) <=
+                f_space[i] * (1. + LINK_TOLERANCE)]
+        # Events holding i in their window
+        holding = index.events(time_day[i] - max_after,
+                time_day[i] + max_before)
+        holding = holding[(time_day[holding] - f_time[holding] *
+            fs_time_prop <= time_day[i]) &
+            (time_day[i] <= time_day[holding] + f_time[holding])]
+        holding = holding[_distances(events, holding, i) <=
+                f_space[holding] * (1. + LINK_TOLERANCE)]
+        new = np.union1d(inside, holding)
+        new = new[~linked[new]]
+        linked[new] = True
+        pending.extend(new)
+        count += len(new)
+        if limit is not None and count > limit:
+            return None
+    return linked
+
+
+def gardner_knopoff_append(data, vcl, new_data,
+    window_opt='GardnerKnopoff', fs_time_prop=0, precision='float64'):
+    ''' Gardner & Knopoff declustering of a catalogue extended by
+        new events, given the clusters of the catalogue
+        data = EQ catalogue matrix declustered
+        vcl = clusters of data given by gardner_knopoff_decluster
+              with the same window_opt, fs_time_prop and precision
+        new_data = EQ catalogue matrix of the new events, with the
+                   columns of data
+        Only the events linked to the new ones by their windows are
+        declustered again, the results are the ones given by
+        gardner_knopoff_decluster on the extended catalogue '''
+
+    columns = column_names(data)
+    if tuple(column_names(new_data)) != tuple(columns):
+        raise ValueError('The new events have columns %s instead of %s' %
+                (column_names(new_data), columns))
+    nold = len(vcl)
+    named = getattr(data, 'columns', None) is not None
+    data = np.concatenate((np.asarray(data), np.asarray(new_data)))
+    if named:
+        data = CatalogueMatrix(data, columns)
+    events = _gardner_knopoff_events(data, window_opt, precision)
+    # Order of the extended catalogue, the old events keep
+    # their order as ties are taken in catalogue order
+    id0 = np.argsort(-events[0], kind='mergesort')
+    rank = np.empty(len(id0), dtype=int)
+    rank[id0] = np.arange(len(id0))
+
+    # Clusters are numbered by the rank of their mainshock
+    old_id0 = id0[id0 < nold]
+    vcl = np.asarray(vcl)
+    new_vcl = np.zeros(len(id0), dtype=int)
+    new_vcl[:nold] = np.sign(vcl) * (rank[old_id0[np.abs(vcl) - 1]] + 1)
+
+    linked = _linked_events(events, np.arange(nold, len(id0)),
+            fs_time_prop, len(id0) * APPEND_MAX_LINKED)
+    if linked is None:
+        # Declustering the whole catalogue is faster
+        return gardner_knopoff_decluster(data, window_opt, fs_time_prop,
+                precision)
+    order = id0[linked[id0]]
+    clusters = _gardner_knopoff_clusters(events, order, fs_time_prop)
+    new_vcl[order] = np.sign(clusters) * (
+            rank[order[np.abs(clusters) - 1]] + 1)
+    return _gardner_knopoff_results(data, new_vcl)
+
+
+def crack_radius(m):
+    """
+    Return the radius (km) of the crack of events
+    of the given magnitudes (Kanamori and Anderson, 1975)
+    """
+    return 0.011 * np.power(10., 0.4 * m)
+
+
+def _find(parent, i):
+    """Return the root of the cluster of an event, compressing its path"""
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:
+        parent[i], i = root, parent[i]
+    return root
+
+
+def reasenberg_decluster(data, taumin=1., taumax=10., p=0.95, xk=0.5,
+    xmeff=1.5, rfact=10., cell_size=1., precision='float64', index=None):
+    ''' Function to implement Reasenberg (1985) Declustering Algorithm
+        data = EQ catalogue matrix, with named columns or in sample
+               format, when present the time column holds the
+               event time in Julian days
+        taumin = look ahead time (days) of events not clustered
+        taumax = maximum look ahead time (days) of clustered events
+        p = confidence of observing the next event of a cluster
+        xk = increase of the lower cutoff magnitude during clusters
+        xmeff = effective lower cutoff magnitude of the catalogue
+        rfact = number of crack radii surrounding each event
+                within which to consider linking it to a cluster
+        cell_size = size (degrees) of the cells of the spatial grid
+                    used to discard far events before computing
+                    their distance
+        precision = float type ('float64' or 'float32') of distances,
+                    event times are always float64: float32 distances
+                    are within HAVERSINE_FLOAT32_ERROR km of float64
+        index = CatalogueIndex of the events by time (e.g. the
+                catalog index of the context), built when not given
+        Distances are epicentral, the catalogue matrix
+        has no depth. The output is the same of
+        gardner_knopoff_decluster, clusters are numbered
+        in order of time of their first event and
+        their mainshock is their largest event '''
+
+    neq = np.shape(data)[0]
+    time_day = event_time(data)
+    # Events are processed in time order, the look ahead
+    # window of each event is a slice of the following events
+    if index is None:
+        index = CatalogueIndex(time_day)
+    order = index.order
+    time_day = time_day[order]
+    dtype = np.dtype(precision).type
+    lon = np.asarray(catalogue_column(data, 'longitude'), dtype=dtype)[order]
+    lat = np.asarray(catalogue_column(data, 'latitude'), dtype=dtype)[order]
+    m = catalogue_column(data, 'Mw')[order]
+    # Cells of the spatial grid, the columns
+    # wrap around at the antimeridian
+    ncol = int(np.ceil(360. / cell_size))
+    row = np.floor((lat + 90.) / cell_size).astype(int)
+    col = np.floor((lon + 180.) / cell_size).astype(int) % ncol
+    rmain = crack_radius(m).astype(dtype)
+    rtest = (rfact * crack_radius(m)).astype(dtype)
+    tau_factor = -np.log(1. - p)
+
+    # Clusters are the trees of a union find forest, the root
+    # of each cluster keeps its largest event processed so far
+    parent = np.arange(neq)
+    big_event = np.arange(neq)
+    clustered = np.zeros(neq, dtype=bool)
     i = 0
     while i < neq:
-        if vcl[i] == 0:
-            #fMag = m[i]
-            #mPos = data[i, 10:11]
-
-            # Find Events inside both fore- and aftershock time windows
-            dt = year_dec - year_dec[i]
-            ick = np.zeros(neq, dtype=int)
-            vsel = np.logical_and(dt >= (-f_time[i] * fs_time_prop),
-                                              dt <= f_time[i], vcl == 0)
-            # Of those events inside time window, find those inside distance
-            # window
-            vsel1 = haversine(data[vsel, 3], data[vsel, 4], data[i, 3],
-                               data[i, 4]) <= f_space[i]
-            # Update logical array so that those events inside time window
-            # but outside distance window are switched to False
-            vsel[vsel] = vsel1
-            # Allocate a cluster number
-            vcl[vsel] = i + 1
-            ick[vsel] = i + 1
-            # Number of elements in cluster
-            #nCl = np.max(np.shape(np.nonzero(ick != 0)[0]))
-            ick[i] = 0  # Remove mainshock from cluster
-            # Indicate the foreshocks
-            tempick = ick[vsel]
-            id2 = year_dec[vsel] < year_dec[i]
-            tempick[id2] = -1 * (i + 1)
-            vcl[vsel] = tempick
-
-            # vcl indicates the cluster to which an event belongs
-            # +vcl = aftershock, -vcl = foreshock
-            i += 1
+        if clustered[i]:
+            root = _find(parent, i)
+            big = big_event[root]
+            if m[i] >= m[big]:
+                big_event[root] = big = i
+                tau = taumin
+            else:
+                deltam = max((1. - xk) * m[big] - xmeff, 0.)
+                tau = tau_factor * (time_day[i] - time_day[big]) / \
+                        10. ** ((deltam - 1.) * 2. / 3.)
+                tau = min(max(tau, taumin), taumax)
         else:
-            # Already allocated to cluster - skip event
-            i += 1
-
-    # Re-sort the data into original order
-    id1 = np.argsort(eqid, kind='heapsort')
-    eqid = eqid[id1]
-    data = data[id1, :]
-    vcl = vcl[id1]
-    # Now to produce a catalogue with aftershocks purged
+            big = i
+            tau = taumin
+        # Following events inside the look ahead window
+        window_end = np.searchsorted(time_day, time_day[i] + tau,
+                side='right')
+        vsel = np.arange(i + 1, window_end)
+        # Discard the events outside the cells surrounding the
+        # interaction zones of the event and of the largest event
+        radius = max(rtest[i], rmain[big]) / EARTH_RADIUS
+        nrow = int(np.ceil(np.degrees(radius) / cell_size)) + \
+                abs(row[i] - row[big])
+        vsel = vsel[np.abs(row[vsel] - row[i]) <= nrow]
+        # Largest longitude difference of two events closer than radius,
+        # from the haversine formula, given their largest latitude
+        cos_lat = np.cos(min(np.radians(max(abs(lat[i]), abs(lat[big]))) +
+                radius, np.pi / 2.))
+        if np.sin(radius / 2.) < cos_lat:
+            dlon = np.degrees(2. * np.arcsin(np.sin(radius / 2.) / cos_lat))
+            ncell = int(np.ceil(dlon / cell_size)) + \
+                    min((col[i] - col[big]) % ncol,
+                        (col[big] - col[i]) % ncol)
+            dcol = (col[vsel] - col[i]) % ncol
+            vsel = vsel[np.minimum(dcol, ncol - dcol) <= ncell]
+        if len(vsel):
+            # Interaction zones of the event and of the
+            # largest event of its cluster
+            linked = haversine(lon[vsel], lat[vsel], lon[i],
+                    lat[i], dtype=dtype)[:, 0] <= rtest[i]
+            if big != i:
+                linked = np.logical_or(linked, haversine(lon[vsel],
+                        lat[vsel], lon[big], lat[big], dtype=dtype)[:, 0] <=
+                        rmain[big])
+            vsel = vsel[linked]
+        if len(vsel):
+            clustered[i] = True
+            root = _find(parent, i)
+            for j in vsel:
+                other = _find(parent, j)
+                if other != root:
+                    # Merge the clusters keeping the largest event, events
+                    # become the largest of their cluster once processed
+                    if clustered[j] and \
+                            m[big_event[other]] > m[big_event[root]]:
+                        big_event[root] = big_event[other]
+                    parent[other] = root
+            clustered[vsel] = True
+        i += 1
+
+    # Number the clusters by time of their first event
+    while True:
+        grand_parent = parent[parent]
+        if np.array_equal(grand_parent, parent):
+            break
+        parent = grand_parent
+    roots = np.where(clustered, parent, -1)
+    cluster_roots, first = np.unique(roots, return_index=True)
+    cluster_roots = cluster_roots[np.argsort(first)]
+    cluster_roots = cluster_roots[cluster_roots >= 0]
+    cluster_id = np.zeros(neq, dtype=int)
+    cluster_id[cluster_roots] = np.arange(1, len(cluster_roots) + 1)
+    vcl = np.where(clustered, cluster_id[parent], 0)
+    # The mainshock of each cluster is its largest
+    # event, the first of them in time on ties
+    members = np.nonzero(clustered)[0]
+    members = members[np.lexsort((members, -m[members], vcl[members]))]
+    first = np.unique(vcl[members], return_index=True)[1]
+    mainshock = np.zeros(len(cluster_roots) + 1, dtype=int)
+    mainshock[1:] = members[first]
+    # Indicate the foreshocks
+    foreshock = members[time_day[members] < time_day[mainshock[vcl[members]]]]
+    vcl[foreshock] = -vcl[foreshock]
+    vcl[mainshock[1:]] = 0
+
+    # Re-sort the results into original order
+    vcl_orig = np.zeros(neq, dtype=int)
+    vcl_orig[order] = vcl
+    vcl = vcl_orig
     vmain_shock = data[np.nonzero(vcl == 0)[0], :]
-    # Also create a simple flag vector which, for each event, takes
-    # a value of 1 if aftershock, -1 if foreshock, and 0 otherwise
     flagvector = np.copy(vcl)
     flagvector[vcl < 0] = -1
     flagvector[vcl > 0] = 1
 
     return vcl, vmain_shock, flagvector
+
+
+# Ratio of the 90% confidence radius of a circular
+# normal location error to its standard deviation
+SIGMA_90 = np.sqrt(-2. * np.log(0.1))
+# Catalogue and uncertainties of the current stochastic
+# declustering, shared by the worker processes
+_CATALOGUE = {}
+
+
+def _attach_catalogue(shared):
+    """Pool initializer attaching the shared catalogue"""
+
+    _CATALOGUE.update((key, attach(value))
+            for key, value in shared.iteritems())
+
+
+def _realisations_chunk(args):
+    """
+    Decluster one chunk of realisations of the shared catalogue,
+    the random generator is seeded with the seed and the chunk
+    number so results do not depend on how chunks are distributed.
+    Return the number of realisations in which every event
+    is a mainshock.
+    """
+
+    windows, fs_time_prop, precision, nrealisations, seed, chunk, \
+            columns = args
+    data = CatalogueMatrix(_CATALOGUE['data'], columns)
+    lon = columns.index('longitude')
+    lat = columns.index('latitude')
+    mw = columns.index('Mw')
+    sigma_mw = _CATALOGUE['sigma_mw']
+    sigma_location = _CATALOGUE['semi_major90'] / SIGMA_90
+    decimals = magnitude_decimals(data[:, mw])
+    rnd = np.random.RandomState([seed, chunk])
+    neq = np.shape(data)[0]
+    nmainshocks = np.zeros(neq, dtype=int)
+    for _ in xrange(nrealisations):
+        realisation = data.copy()
+        magnitude = data[:, mw] + sigma_mw * rnd.standard_normal(neq)
+        if decimals is not None:
+            # Keep the precision of the catalogue
+            magnitude = np.round(magnitude, decimals)
+        realisation[:, mw] = magnitude
+        # Epicentres are moved by a circular normal error
+        dx, dy = np.degrees(sigma_location *
+                rnd.standard_normal((2, neq)) / EARTH_RADIUS)
+        realisation[:, lat] = np.clip(data[:, lat] + dy, -90., 90.)
+        realisation[:, lon] = data[:, lon] + dx / \
+                np.maximum(np.cos(np.radians(realisation[:, lat])), 1E-6)
+        realisation[:, lon] = (realisation[:, lon] + 180.) % 360. - 180.
+        window_opt = windows[rnd.randint(len(windows))]
+        vcl = gardner_knopoff_decluster(realisation, window_opt,
+                fs_time_prop, precision)[0]
+        nmainshocks += vcl == 0
+    return nmainshocks
+
+
+def stochastic_decluster(data, sigma_mw, semi_major90,
+    windows=('GardnerKnopoff', ), fs_time_prop=0, nrealisations=100,
+    seed=0, processes=1, precision='float64', chunk_size=10):
+    ''' Function to implement Monte Carlo Gardner & Knopoff Declustering
+        data = EQ catalogue matrix, with named columns or in sample format
+        sigma_mw = standard deviation of the magnitude of every event
+        semi_major90 = semi major axis (km) of the 90% confidence
+                       ellipse of the epicentre of every event, it
+                       is used as radius of a circular normal error
+        windows = time and distance windows (see gardner_knopoff_decluster)
+                  among which every realisation draws its windows
+        fs_time_prop = Foreshock time window as a proportion of
+                       aftershock time window
+        nrealisations = number of declustered realisations
+        seed = seed of the random generator
+        processes = number of worker processes, the catalogue is
+                    shared with them through shared memory
+        precision = float type of windows and distances
+                    (see gardner_knopoff_decluster)
+        chunk_size = number of realisations of each task
+        Perturbed magnitudes are rounded to the precision of the
+        catalogue. Return the probability of every event to be a
+        mainshock, i.e. the fraction of the realisations in which
+        it is a mainshock. '''
+
+    catalogue = {'data': np.asarray(data),
+            'sigma_mw': np.asarray(sigma_mw, dtype=float),
+            'semi_major90': np.asarray(semi_major90, dtype=float)}
+    chunks = [(list(windows), fs_time_prop, precision,
+            min(chunk_size, nrealisations - start), seed, chunk,
+            column_names(data))
+            for chunk, start in
+            enumerate(xrange(0, nrealisations, chunk_size))]
+    try:
+        if processes > 1:
+            shared = dict((key, share(value))
+                    for key, value in catalogue.iteritems())
+            pool = Pool(processes, _attach_catalogue, (shared, ))
+            try:
+                results = pool.map(_realisations_chunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _CATALOGUE.update(catalogue)
+            results = [_realisations_chunk(chunk) for chunk in chunks]
+    finally:
+        _CATALOGUE.clear()
+    return np.sum(results, axis=0) / float(nrealisations)
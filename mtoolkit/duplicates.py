@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+
+"""
+The purpose of this module is to provide functions
+to find the events of a merged eq catalog reported
+by several agencies, hashing events in a space-time
+grid so that only events of neighbouring cells are
+compared.
+"""
+
+import itertools
+
+import numpy as np
+
+# Earth radius (km) used by haversine
+EARTH_RADIUS = 6371.227
+# Largest value of the keys of the grid cells
+MAX_KEY = 2 ** 62
+
+
+def _unit_vectors(longitude, latitude):
+    """Return the cartesian coordinates of the epicentres on the unit sphere"""
+
+    lon = np.radians(longitude)
+    lat = np.radians(latitude)
+    return np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)
+
+
+def _grid_cells(time, xyz, time_tolerance, distance_tolerance):
+    """
+    Return the cells of the events in a grid of time and of
+    cartesian coordinates, with cells not smaller than the
+    tolerances, and the number of cells along every axis
+    """
+
+    # The chord between two epicentres is shorter than their distance
+    chord = max(distance_tolerance / EARTH_RADIUS, 1E-9)
+    time_cell = np.floor((time - time.min()) /
+            max(time_tolerance, 1E-9)).astype(np.int64)
+    ntime = int(time_cell.max()) + 1
+    # Coarsen the spatial cells until the cell keys fit in 64 bits
+    nspace = int(np.floor(2. / chord)) + 1
+    while ntime * nspace ** 3 >= MAX_KEY and nspace > 1:
+        nspace = (nspace + 1) // 2
+    size = 2. / max(nspace - 1, 1)
+    cells = [time_cell] + [np.minimum(np.floor((coordinate + 1.) /
+            size).astype(np.int64), nspace - 1) for coordinate in xyz]
+    return cells, [ntime, nspace, nspace, nspace]
+
+
+def _cell_keys(cells, shape, offset=(0, 0, 0, 0)):
+    """Return the keys of the cells shifted by offset, -1 outside the grid"""
+
+    key = np.zeros(len(cells[0]), dtype=np.int64)
+    outside = np.zeros(len(cells[0]), dtype=bool)
+    for cell, size, shift in zip(cells, shape, offset):
+        cell = cell + shift
+        outside |= (cell < 0) | (cell >= size)
+        key = key * size + cell
+    key[outside] = -1
+    return key
+
+
+def _expand(first, start, stop):
+    """
+    Return the pairs of every first event with the
+    events from its start to its stop position
+    """
+
+    counts = np.maximum(stop - start, 0)
+    total = counts.sum()
+    first = np.repeat(first, counts)
+    position = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+            counts) + np.repeat(start, counts)
+    return first, position
+
+
+def _components(nevents, first, second):
+    """
+    Return the connected component of every event given
+    the pairs of linked events, every component is labelled
+    with the smallest index of its events
+    """
+
+    labels = np.arange(nevents)
+    while len(first):
+        low = np.minimum(labels[first], labels[second])
+        targets = np.concatenate([first, second, labels[first],
+                labels[second]])
+        values = np.concatenate([low, low, low, low])
+        order = np.lexsort((values, targets))
+        targets, start = np.unique(targets[order], return_index=True)
+        new_labels = labels.copy()
+        new_labels[targets] = np.minimum(labels[targets],
+                values[order][start])
+        # Point every event to the root of its tree
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+def find_duplicates(time, longitude, latitude, magnitude, agency,
+        time_tolerance, distance_tolerance, magnitude_tolerance):
+    """
+    Find the events reported by different agencies.
+    time = time of every event (days)
+    longitude, latitude = epicentre of every event
+    magnitude = magnitude of every event
+    agency = agency of every event
+    time_tolerance = largest time difference of duplicates (days)
+    distance_tolerance = largest distance of duplicates (km)
+    magnitude_tolerance = largest magnitude difference of duplicates
+    Two events of different agencies are duplicates if they are
+    within all the tolerances, groups of duplicates are the
+    connected components of the duplicate pairs.
+    Return the group of every event, labelled with the
+    index of the first event of the group.
+    """
+
+    time = np.asarray(time, dtype=float)
+    neq = len(time)
+    if not neq:
+        return np.zeros(0, dtype=int)
+    agency = np.unique(np.asarray(agency), return_inverse=True)[1]
+    xyz = _unit_vectors(np.asarray(longitude, dtype=float),
+            np.asarray(latitude, dtype=float))
+    cells, shape = _grid_cells(time, xyz, time_tolerance, distance_tolerance)
+    key = _cell_keys(cells, shape)
+    order = np.argsort(key, kind='mergesort')
+    sorted_key = key[order]
+
+    first = []
+    second = []
+    # Neighbouring cells, each pair of cells is visited once
+    offsets = [offset for offset in itertools.product([-1, 0, 1], repeat=4)
+            if offset > (0, 0, 0, 0)]
+    for offset in [None] + offsets:
+        if offset is None:
+            # Pairs of events of the same cell
+            start = np.arange(1, neq + 1)
+            stop = np.searchsorted(sorted_key, sorted_key, side='right')
+            pairs = _expand(np.arange(neq), start, stop)
+        else:
+            neighbour = _cell_keys([cell[order] for cell in cells], shape,
+                    offset)
+            start = np.searchsorted(sorted_key, neighbour, side='left')
+            stop = np.searchsorted(sorted_key, neighbour, side='right')
+            stop[neighbour < 0] = start[neighbour < 0]
+            pairs = _expand(np.arange(neq), start, stop)
+        i, j = order[pairs[0]], order[pairs[1]]
+        # Compare the candidate pairs with the tolerances
+        linked = (agency[i] != agency[j]) & \
+                (np.abs(time[i] - time[j]) <= time_tolerance) & \
+                (np.abs(magnitude[i] - magnitude[j]) <= magnitude_tolerance)
+        i, j = i[linked], j[linked]
+        chord = np.sqrt(sum((coordinate[i] - coordinate[j]) ** 2
+                for coordinate in xyz))
+        linked = 2. * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2., 1.)) \
+                <= distance_tolerance
+        first.append(i[linked])
+        second.append(j[linked])
+    return _components(neq, np.concatenate(first), np.concatenate(second))
+
+
+def preferred_events(groups, agency, agency_priority):
+    """
+    Return the mask of the events kept from every group of
+    duplicates: the event of the agency with the highest
+    priority, the first one on ties. Agencies not in the
+    priority list come after all the listed ones.
+    """
+
+    agency = np.asarray(agency)
+    rank = np.empty(len(agency), dtype=int)
+    rank.fill(len(agency_priority))
+    for priority, preferred in enumerate(agency_priority):
+        rank[agency == preferred] = priority
+    order = np.lexsort((np.arange(len(groups)), rank, groups))
+    keep = np.zeros(len(groups), dtype=bool)
+    keep[order[np.unique(groups[order], return_index=True)[1]]] = True
+    return keep
@@ -20,12 +20,15 @@
 """
 The purpose of this module is to provide objects
 to read csv files containing eq definitions and
-create eq entries.
+create eq entries, and to write them back.
 """
 
 import os
 from datetime import datetime as time
 import csv
+import operator
+
+import numpy as np
 
 
 class CsvReader(object):
@@ -78,12 +81,13 @@ class EqEntryReader(object):
 
     EMPTY_STRING = ''
 
-    def __init__(self, eq_entries_source):
+    def __init__(self, eq_entries_source, compulsory_mw=True):
         """
         to_int   - fields to be converted in integer
         to_float - fields to be converted in float
         check_map - associates each field with its own check
         current_line - denotes the line in use by the read method
+        compulsory_mw - if False events without Mw are accepted
         """
 
         self.eq_entries_source = eq_entries_source
@@ -100,6 +104,8 @@ class EqEntryReader(object):
 
         self.compulsory_fields = self.to_int + [self.to_float[2],
                 self.to_float[3], self.to_float[7], self.to_float[9]]
+        if not compulsory_mw:
+            self.compulsory_fields.remove('Mw')
 
         self.check_map = {
                 'eventID': self.check_positive_value,
@@ -284,6 +290,117 @@ class EqEntryReader(object):
         return True
 
 
+def _entry_values(fieldnames):
+    """
+    Return a function giving the tuple of the values of
+    the fields of an eq entry, empty strings for the
+    fields missing in the eq entry
+    """
+
+    getter = operator.itemgetter(*fieldnames)
+    if len(fieldnames) == 1:
+        getter = lambda eq_entry, field=fieldnames[0]: (eq_entry[field],)
+
+    def entry_values(eq_entry):
+        """Return the values of the fields of an eq entry"""
+        try:
+            return getter(eq_entry)
+        except KeyError:
+            return tuple(eq_entry.get(field, EqEntryReader.EMPTY_STRING)
+                    for field in fieldnames)
+    return entry_values
+
+
+def _column_array(values):
+    """
+    Return the numpy array of the values of a column: int,
+    float (NaN for empty strings) or string if the column
+    holds any value which is not a number
+    """
+
+    array = np.array(values)
+    if array.dtype.kind in 'biuf':
+        return array
+    objects = np.array(values, dtype=object)
+    empty = objects == EqEntryReader.EMPTY_STRING
+    numbers = np.array(objects[~empty].tolist())
+    if numbers.dtype.kind in 'biuf':
+        column = np.empty(len(values))
+        column[empty] = np.nan
+        column[~empty] = numbers
+        return column
+    return array
+
+
+class EqCatalogWriter(object):
+    """
+    EqCatalogWriter allows to write eq entries, along with
+    columns of per event results, in a csv file having the
+    column layout of the eq catalog read or, when the file
+    name ends with .npz, in a numpy npz file holding one
+    array per column. Csv rows are built and written a
+    chunk of eq entries at a time.
+    """
+
+    CHUNK_SIZE = 10000
+    BUFFER_SIZE = 1 << 20
+
+    def __init__(self, filename, fieldnames, chunk_size=CHUNK_SIZE):
+        """
+        fieldnames - eq entry fields written, in order
+        chunk_size - number of csv rows built at once
+        """
+
+        self.filename = filename
+        self.fieldnames = list(fieldnames)
+        self.chunk_size = chunk_size
+
+    def write(self, eq_entries, columns=()):
+        """
+        Write the eq entries, columns is a list of (name,
+        array) pairs giving a value for every eq entry
+        """
+
+        columns = [(name, np.asarray(values)) for name, values in columns]
+        for name, values in columns:
+            if len(values) != len(eq_entries):
+                raise RuntimeError('Column %s has %s values for %s eq '
+                        'entries' % (name, len(values), len(eq_entries)))
+        if self.filename.endswith('.npz'):
+            self._write_npz(eq_entries, columns)
+        else:
+            self._write_csv(eq_entries, columns)
+
+    def _write_csv(self, eq_entries, columns):
+        """Write the csv file, one chunk of rows at a time"""
+
+        # Bool columns are written as 0/1
+        columns = [(name, values.astype(int) if values.dtype == bool
+            else values) for name, values in columns]
+        entry_values = _entry_values(self.fieldnames)
+        with open(self.filename, 'wb', self.BUFFER_SIZE) as csv_file:
+            # The csv writer formats floats with repr,
+            # the values read back are the ones written
+            writer = csv.writer(csv_file, lineterminator='\n')
+            writer.writerow(self.fieldnames + [name for name, _ in columns])
+            for start in xrange(0, len(eq_entries), self.chunk_size):
+                end = start + self.chunk_size
+                rows = map(entry_values, eq_entries[start:end])
+                if columns:
+                    rows = map(operator.add, rows, zip(*[
+                        values[start:end].tolist() for _, values in columns]))
+                writer.writerows(rows)
+
+    def _write_npz(self, eq_entries, columns):
+        """Write the npz file, one array per column"""
+
+        values = zip(*map(_entry_values(self.fieldnames), eq_entries)) or \
+                [()] * len(self.fieldnames)
+        arrays = dict(zip(self.fieldnames, map(_column_array, values)))
+        arrays.update(columns)
+        np.savez(self.filename, **arrays)
+
+
 class EqEntryValidationError(Exception):
     """
     EqEntry validation error could be raised
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+
+"""
+The purpose of this module is to provide functions
+to convert the magnitudes of an eq catalog to a
+common scale (Mw), applying regressions to whole
+columns of magnitudes at once.
+"""
+
+import numpy as np
+
+# Magnitude scales of an eq catalog, with their sigma fields
+MAGNITUDE_SCALES = {'Mw': 'sigmaMw', 'Ms': 'sigmaMs',
+                    'mb': 'sigmamb', 'ML': 'sigmaML'}
+
+
+class Conversion(object):
+    """
+    Conversion defines a regression from a magnitude
+    scale to Mw, as a polynomial of the magnitude, valid
+    within a magnitude range and optionally restricted
+    to the events of some agencies.
+    """
+
+    def __init__(self, scale, coefficients=(0., 1.), magnitude_range=None,
+            sigma=0., agencies=None, name=None):
+        """
+        scale - magnitude scale converted (Mw, Ms, mb or ML)
+        coefficients - polynomial coefficients in increasing
+                       order of degree, Mw = c0 + c1 * M + ...
+        magnitude_range - lowest and highest magnitude converted
+        sigma - standard deviation of the regression
+        agencies - agencies whose magnitudes are converted
+        name - source recorded for the converted magnitudes
+        """
+
+        if scale not in MAGNITUDE_SCALES:
+            raise ValueError('Invalid magnitude scale: %s' % scale)
+        self.scale = scale
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.magnitude_range = magnitude_range
+        self.sigma = sigma
+        self.agencies = agencies
+        self.name = name or scale
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a conversion from a config dict"""
+
+        return cls(**config)
+
+    def applicable(self, magnitude, agency):
+        """Return the mask of the events this conversion applies to"""
+
+        mask = ~np.isnan(magnitude)
+        if self.magnitude_range is not None:
+            lower, upper = self.magnitude_range
+            # Missing (NaN) magnitudes are already masked out
+            with np.errstate(invalid='ignore'):
+                mask &= (magnitude >= lower) & (magnitude <= upper)
+        if self.agencies is not None:
+            mask &= np.in1d(agency, self.agencies)
+        return mask
+
+    def convert(self, magnitude, sigma):
+        """
+        Return Mw and its sigma, combining the sigma
+        of the magnitude and of the regression
+        """
+
+        mw = np.polynomial.polynomial.polyval(magnitude, self.coefficients)
+        slope = np.polynomial.polynomial.polyval(magnitude,
+                np.polynomial.polynomial.polyder(self.coefficients))
+        sigma = np.where(np.isnan(sigma), 0., sigma)
+        return mw, np.sqrt((slope * sigma) ** 2 + self.sigma ** 2)
+
+
+def homogenise(magnitudes, sigmas, agency, conversions):
+    """
+    Convert the magnitudes of a catalog to Mw.
+    magnitudes = dict of magnitude scale and its column,
+                 NaN where the magnitude is missing
+    sigmas = dict of magnitude scale and the column of
+             its sigma, NaN where the sigma is missing
+    agency = column of the agency of every event
+    conversions = Conversions in order of priority, the
+                  first one applicable to an event gives
+                  its Mw
+    Return the Mw of every event, its sigma and the index
+    of the conversion which gives it (-1 where no conversion
+    applies and Mw is NaN).
+    """
+
+    agency = np.asarray(agency)
+    neq = len(agency)
+    mw = np.empty(neq)
+    mw.fill(np.nan)
+    sigma_mw = np.empty(neq)
+    sigma_mw.fill(np.nan)
+    source = -np.ones(neq, dtype=int)
+    for i, conversion in enumerate(conversions):
+        magnitude = magnitudes[conversion.scale]
+        mask = (source < 0) & conversion.applicable(magnitude, agency)
+        mw[mask], sigma_mw[mask] = conversion.convert(magnitude[mask],
+                sigmas[conversion.scale][mask])
+        source[mask] = i
+    return mw, sigma_mw, source
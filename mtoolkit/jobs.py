@@ -22,16 +22,21 @@ The purpose of this module is to provide functions
 which tackle specific job.
 """
 
+import os
+import csv
+import copy
+import hashlib
 import logging
 import numpy as np
-from shapely.geometry import Polygon, Point
 
-from mtoolkit.eqcatalog     import EqEntryReader
-from mtoolkit.smodel        import NRMLReader
+# lxml (through smodel), shapely and the algorithm modules are
+# imported by the jobs using them, pipelines processing only
+# the eq catalog and the cmdline don't pay for their import
+from mtoolkit.eqcatalog     import EqEntryReader, EqCatalogWriter, CsvReader
+from mtoolkit.catalogue_utilities import greg2julian, CatalogueMatrix, \
+catalogue_column, event_year, SAMPLE_FORMAT
 from mtoolkit.utils import get_data_path, SCHEMA_DIR
 
-NRML_SCHEMA_PATH = get_data_path('nrml.xsd', SCHEMA_DIR)
-
 
 def logged_job(job):
     """
@@ -48,75 +53,658 @@ def logged_job(job):
         logger.info(start_job_line)
         job(context)
         logger.info(end_job_line)
+    wrapper.catalog_columns = getattr(job, 'catalog_columns', {})
+    wrapper.config_sections = getattr(job, 'config_sections', ())
     return wrapper
 
 
+def uses_columns(**columns):
+    """
+    Declare the catalog matrix columns used by a job,
+    with the narrowest dtype at which each of them can
+    be stored without changing the results of the job
+    """
+
+    def decorator(job):
+        """Attach the columns to the job"""
+        job.catalog_columns = columns
+        return job
+    return decorator
+
+
+def uses_config(*sections):
+    """
+    Declare the config sections read by a job besides
+    the one of its own step (e.g. the Stepp parameters
+    used by GriddedStepp)
+    """
+
+    def decorator(job):
+        """Attach the config sections to the job"""
+        job.config_sections = sections
+        return job
+    return decorator
+
+
+def _precision(context, step):
+    """
+    Return the float precision of the computations
+    of a step, defined in its config or globally
+    """
+
+    return context.config[step].get('precision') or \
+            context.config.get('precision') or 'float64'
+
+
+# Columns used by the declustering algorithms
+DECLUSTERING_COLUMNS = {'longitude': 'float64', 'latitude': 'float64',
+                        'Mw': 'float64', 'time': 'float64'}
+
+
 @logged_job
 def read_eq_catalog(context):
-    """Create eq entries by reading an eq catalog"""
+    """
+    Create eq entries by reading an eq catalog, a csv file
+    or a catalogue store, keeping the events inside the
+    region when one is defined in the config
+    """
 
-    reader = EqEntryReader(context.config['eq_catalog_file'])
+    from mtoolkit.catalogue_store import CatalogueStore, is_catalogue_store, \
+            region_mask
+
+    # Events without Mw can get one by magnitude homogenisation
+    compulsory_mw = 'MagnitudeHomogenisation' not in \
+            context.config.get('preprocessing_steps', [])
+    filename = context.config['eq_catalog_file']
+    region = context.config.get('region')
+    if is_catalogue_store(filename):
+        # Only the tiles intersecting the region are read
+        context.eq_catalog = CatalogueStore(filename).read(region,
+                compulsory_mw)
+        return
+    reader = EqEntryReader(filename, compulsory_mw)
     eq_entries = []
     for eq_entry in reader.read():
         eq_entries.append(eq_entry)
+    if region:
+        inside = region_mask(region,
+                _eq_catalog_column(eq_entries, 'longitude'),
+                _eq_catalog_column(eq_entries, 'latitude'))
+        eq_entries = [eq_entries[i] for i in np.nonzero(inside)[0]]
     context.eq_catalog = eq_entries
 
 
-@logged_job
-def read_source_model(context):
-    """Create smodel definitions by reading a source model"""
+def _eq_catalog_fieldnames(filename):
+    """Return the fields of an eq catalog file or store"""
+
+    from mtoolkit.catalogue_store import CatalogueStore, is_catalogue_store
+
+    if is_catalogue_store(filename):
+        return list(CatalogueStore(filename).fieldnames)
+    return CsvReader(filename).fieldnames
 
-    reader = NRMLReader(context.config['source_model_file'],
-            NRML_SCHEMA_PATH)
+
+def build_catalogue_store(context, directory):
+    """
+    Build the catalogue store of the eq catalog defined
+    in the config, return the number of stored events
+    """
+
+    from mtoolkit.catalogue_store import CatalogueStore, TILE_SIZE
+
+    return len(CatalogueStore.build(context.config['eq_catalog_file'],
+        directory, context.config.get('store_tile_size') or TILE_SIZE))
+
+
+def _source_model_cache(context):
+    """
+    Return the source model cache defined in the config
+    or None if no cache directory is defined.
+    """
+
+    from mtoolkit.cache import SourceModelCache
+
+    cache_dir = context.config.get('source_model_cache_dir')
+    if cache_dir:
+        return SourceModelCache(cache_dir)
+    return None
+
+
+def nrml_schema_path():
+    """Return the path of the nrml schema validating source models"""
+
+    return get_data_path('nrml.xsd', SCHEMA_DIR)
+
+
+def _parse_source_model(filename, schema_path):
+    """Return the list of smodel definitions read from a nrml file"""
+
+    from mtoolkit.smodel import NRMLReader
+
+    reader = NRMLReader(filename, schema_path)
     sm_definitions = []
     for sm in reader.read():
         sm_definitions.append(sm)
+    return sm_definitions
+
+
+@logged_job
+def read_source_model(context):
+    """
+    Create smodel definitions by reading a source model,
+    if a cache directory is defined in the config the
+    definitions are loaded from the cache when the source
+    model has already been read.
+    """
+
+    filename = context.config['source_model_file']
+    schema_path = nrml_schema_path()
+    cache = _source_model_cache(context)
+    sm_definitions = None
+    if cache is not None:
+        sm_definitions = cache.load(filename, schema_path)
+    if sm_definitions is None:
+        sm_definitions = _parse_source_model(filename, schema_path)
+        if cache is not None:
+            cache.store(filename, schema_path, sm_definitions)
     context.sm_definitions = sm_definitions
 
 
+@logged_job
+def write_source_model(context):
+    """
+    Write the smodel definitions in the result file,
+    validating the nrml document while it is written
+    """
+
+    from mtoolkit.smodel import NRMLWriter
+
+    with NRMLWriter(context.config['result_file'],
+            nrml_schema_path()) as writer:
+        for sm in context.sm_definitions:
+            writer.serialize(sm)
+    _write_confidence_intervals(context)
+
+
+# Fields of the confidence intervals file, written along
+# with the result file (the nrml schema has no element
+# for the confidence intervals)
+CONFIDENCE_INTERVALS_FIELDS = ['id_sm', 'source_id', 'name',
+        'confidence_level', 'a_value_cumulative_lower',
+        'a_value_cumulative_upper', 'b_value_lower', 'b_value_upper']
+
+
+def confidence_intervals_filename(result_file):
+    """Return the confidence intervals file of a result file"""
+
+    return '%s_confidence_intervals.csv' % os.path.splitext(result_file)[0]
+
+
+def _write_confidence_intervals(context):
+    """
+    Write the bootstrap confidence intervals of the
+    source models, when computed by the recurrence step
+    """
+
+    rows = []
+    for sm in context.sm_definitions:
+        source_id = [sm[key] for key in ('id_as', 'id_sf', 'id_cf', 'id_sp')
+                if key in sm]
+        for rrm_entry in sm.get('rupture_rate_model', []):
+            if 'confidence_level' in rrm_entry:
+                rows.append([sm.get('id_sm'), source_id[0] if source_id
+                    else None, sm.get('name'), rrm_entry['confidence_level']]
+                    + rrm_entry['a_value_cumulative_confidence_interval']
+                    + rrm_entry['b_value_confidence_interval'])
+    if not rows:
+        return
+
+    with open(confidence_intervals_filename(
+            context.config['result_file']), 'wb') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(CONFIDENCE_INTERVALS_FIELDS)
+        writer.writerows(rows)
+
+
+def warm_source_model_cache(context):
+    """Store the source model defined in the config in the cache"""
+
+    cache = _source_model_cache(context)
+    if cache is None:
+        raise RuntimeError('No source_model_cache_dir defined')
+    filename = context.config['source_model_file']
+    schema_path = nrml_schema_path()
+    if cache.load(filename, schema_path) is None:
+        cache.store(filename, schema_path,
+                _parse_source_model(filename, schema_path))
+
+
+def clear_source_model_cache(context):
+    """
+    Remove all the entries of the source model cache,
+    return the number of removed entries.
+    """
+
+    cache = _source_model_cache(context)
+    if cache is None:
+        raise RuntimeError('No source_model_cache_dir defined')
+    return cache.clear()
+
+
+def _eq_catalog_column(eq_catalog, field):
+    """
+    Return the values of a float field of the eq entries,
+    NaN where the value is missing
+    """
+
+    column = np.empty(len(eq_catalog))
+    for i, eq_entry in enumerate(eq_catalog):
+        value = eq_entry.get(field, EqEntryReader.EMPTY_STRING)
+        column[i] = np.nan if value == EqEntryReader.EMPTY_STRING else value
+    return column
+
+
+@logged_job
+def magnitude_homogenisation(context):
+    """
+    Convert the magnitudes of the eq catalog to Mw, the events
+    without any convertible magnitude are removed and the
+    conversion which gives the Mw of every event is stored
+    in its MwSource field
+    """
+
+    from mtoolkit.homogenisation import Conversion, MAGNITUDE_SCALES
+
+    conversions = [Conversion.from_config(config) for config in
+            context.config['MagnitudeHomogenisation']['conversions']]
+    magnitudes = {}
+    sigmas = {}
+    for scale, sigma_field in MAGNITUDE_SCALES.iteritems():
+        magnitudes[scale] = _eq_catalog_column(context.eq_catalog, scale)
+        sigmas[scale] = _eq_catalog_column(context.eq_catalog, sigma_field)
+    agency = [eq_entry.get('Agency') for eq_entry in context.eq_catalog]
+
+    mw, sigma_mw, source = context.map_sc['homogenise'](magnitudes, sigmas,
+            agency, conversions)
+
+    eq_catalog = []
+    for i in np.nonzero(source >= 0)[0]:
+        eq_entry = context.eq_catalog[i]
+        eq_entry['Mw'] = mw[i]
+        eq_entry['sigmaMw'] = sigma_mw[i]
+        eq_entry['MwSource'] = conversions[source[i]].name
+        eq_catalog.append(eq_entry)
+    context.eq_catalog = eq_catalog
+
+
+@logged_job
+def duplicate_removal(context):
+    """
+    Remove from the eq catalog the events reported by
+    several agencies, keeping the solution of the agency
+    with the highest priority
+    """
+
+    from mtoolkit.duplicates import preferred_events
+
+    config = context.config['DuplicateRemoval']
+    eq_catalog = context.eq_catalog
+    time = greg2julian(*[np.nan_to_num(_eq_catalog_column(eq_catalog, field))
+            for field in ['year', 'month', 'day', 'hour', 'minute',
+                'second']])
+    agency = [eq_entry.get('Agency') for eq_entry in eq_catalog]
+
+    groups = context.map_sc['find_duplicates'](time,
+            _eq_catalog_column(eq_catalog, 'longitude'),
+            _eq_catalog_column(eq_catalog, 'latitude'),
+            _eq_catalog_column(eq_catalog, 'Mw'), agency,
+            config['time_window'] / 86400.,
+            config['distance_window'],
+            config['magnitude_window'])
+
+    keep = preferred_events(groups, agency, config['agency_priority'])
+    context.eq_catalog = [eq_catalog[i] for i in np.nonzero(keep)[0]]
+
+
+def _catalog_matrix_columns(context):
+    """
+    Return the names and the dtype of the catalog matrix
+    columns: the ones defined in the config, or the ones
+    used by the jobs of the pipeline, or all the columns of
+    the sample format. The dtype is the narrowest one at
+    which all the columns can be stored.
+    """
+
+    columns = context.config.get('catalog_columns') or \
+            getattr(context, 'catalog_columns', None) or \
+            dict((name, 'float64') for name in SAMPLE_FORMAT)
+    names = [name for name in SAMPLE_FORMAT if name in columns] + \
+            sorted(name for name in columns if name not in SAMPLE_FORMAT)
+    dtype = reduce(np.promote_types,
+            [np.dtype(columns[name]) for name in names])
+    return names, dtype
+
+
 @logged_job
 def create_catalog_matrix(context):
-    """Create a numpy matrix according to fixed attributes"""
+    """
+    Create a numpy matrix with named columns holding the
+    attributes of the eq entries, the time column holds the
+    time of every event as a Julian day, computed once from
+    all the date and time fields and shared by the algorithms
+    """
+
+    names, dtype = _catalog_matrix_columns(context)
+    reader = EqEntryReader(context.config.get('eq_catalog_file'))
+    eq_fields = reader.to_int + reader.to_float
+    columns = []
+    for name in names:
+        if name == 'time':
+            columns.append(greg2julian(*[np.nan_to_num(_eq_catalog_column(
+                context.eq_catalog, field)) for field in ['year', 'month',
+                    'day', 'hour', 'minute', 'second']]))
+        elif name in eq_fields:
+            columns.append(_eq_catalog_column(context.eq_catalog, name))
+        else:
+            raise RuntimeError('Invalid catalog column: %s' % name)
+    matrix = np.column_stack(columns).astype(dtype) if columns else \
+            np.zeros((len(context.eq_catalog), 0), dtype=dtype)
+    context.catalog_matrix = CatalogueMatrix(matrix, names)
 
-    matrix = []
-    attributes = ['year', 'month', 'day', 'longitude', 'latitude', 'Mw']
-    for eq_entry in context.eq_catalog:
-        matrix.append([eq_entry[attribute] for attribute in attributes])
-    context.catalog_matrix = np.array(matrix)
+
+def _gardner_knopoff_windows(config):
+    """Return the windows of the GardnerKnopoff step config"""
+
+    from mtoolkit.declustering import WindowTable
+
+    if config.get('window_table'):
+        return WindowTable.from_config(config['window_table'])
+    return config['time_dist_windows']
 
 
 @logged_job
+@uses_columns(**DECLUSTERING_COLUMNS)
 def gardner_knopoff(context):
     """Apply gardner_knopoff declustering algorithm to the eq catalog"""
 
+    config = context.config['GardnerKnopoff']
     vcl, vmain_shock, flag_vector = context.map_sc['gardner_knopoff'](
+            context.catalog_matrix, _gardner_knopoff_windows(config),
+            config['foreshock_time_window'],
+            _precision(context, 'GardnerKnopoff'), context.catalog_index)
+
+    # Declustered events, extended by append_eq_entries
+    context.declustered_matrix = context.catalog_matrix
+    context.vcl = vcl
+    context.catalog_matrix = vmain_shock
+    context.vmain_shock = vmain_shock
+    context.flag_vector = flag_vector
+
+
+def append_eq_entries(context, eq_entries):
+    """
+    Append eq entries, ready for declustering (e.g. already
+    homogenised), to the eq catalog declustered by the
+    gardner_knopoff job and update the clusters, flags and
+    mainshocks: only the events linked to the new ones by
+    their windows are declustered again
+    """
+
+    matrix = getattr(context, 'declustered_matrix', None)
+    if matrix is None:
+        raise RuntimeError('No eq catalog declustered by GardnerKnopoff')
+    new_context = copy.copy(context)
+    new_context.eq_catalog = eq_entries
+    create_catalog_matrix(new_context)
+
+    config = context.config['GardnerKnopoff']
+    vcl, vmain_shock, flag_vector = context.map_sc['gardner_knopoff_append'](
+            matrix, context.vcl, new_context.catalog_matrix,
+            _gardner_knopoff_windows(config),
+            config['foreshock_time_window'],
+            _precision(context, 'GardnerKnopoff'))
+
+    context.eq_catalog = context.eq_catalog + list(eq_entries)
+    context.declustered_matrix = CatalogueMatrix(
+            np.concatenate((matrix, new_context.catalog_matrix)),
+            matrix.columns)
+    context.vcl = vcl
+    context.catalog_matrix = vmain_shock
+    context.vmain_shock = vmain_shock
+    context.flag_vector = flag_vector
+
+
+@logged_job
+@uses_columns(**DECLUSTERING_COLUMNS)
+def reasenberg(context):
+    """Apply reasenberg declustering algorithm to the eq catalog"""
+
+    config = context.config['Reasenberg']
+
+    vcl, vmain_shock, flag_vector = context.map_sc['reasenberg'](
             context.catalog_matrix,
-            context.config['GardnerKnopoff']['time_dist_windows'],
-            context.config['GardnerKnopoff']['foreshock_time_window'])
+            config['taumin'], config['taumax'],
+            config['p'], config['xk'], config['xmeff'],
+            config['rfact'], precision=_precision(context, 'Reasenberg'),
+            index=context.catalog_index)
 
     context.vcl = vcl
     context.catalog_matrix = vmain_shock
+    context.vmain_shock = vmain_shock
     context.flag_vector = flag_vector
 
 
 @logged_job
+@uses_columns(**DECLUSTERING_COLUMNS)
+def stochastic_declustering(context):
+    """
+    Apply the Monte Carlo gardner_knopoff declustering
+    algorithm to the eq catalog, the mainshock probability
+    of every event is stored and the catalog is left unchanged
+    """
+
+    config = context.config['StochasticDeclustering']
+    if len(context.eq_catalog) != len(context.catalog_matrix):
+        raise RuntimeError('Stochastic declustering needs the '
+                'uncertainties of all the events of the eq catalog')
+    sigma_mw = [eq_entry['sigmaMw'] or 0. for eq_entry in context.eq_catalog]
+    semi_major90 = [eq_entry['SemiMajor90'] or 0.
+            for eq_entry in context.eq_catalog]
+
+    context.mainshock_probability = context.map_sc['stochastic_decluster'](
+            context.catalog_matrix, sigma_mw, semi_major90,
+            config['time_dist_windows'],
+            config['foreshock_time_window'],
+            config['realisations'],
+            config['seed'],
+            config['processes'],
+            _precision(context, 'StochasticDeclustering'))
+
+
+@logged_job
+@uses_columns(Mw='float64', time='float64')
 def stepp(context):
     """
     Apply step algorithm to the eq catalog
     or to the numpy array built by a
-    declustering algorithm
+    declustering algorithm, the events are
+    sorted by the catalog index
     """
 
-    year_index = 0
-    mw_index = 5
-
     context.completeness_table = context.map_sc['stepp'](
-        context.catalog_matrix[:, year_index],
-        context.catalog_matrix[:, mw_index],
+        event_year(context.catalog_matrix),
+        catalogue_column(context.catalog_matrix, 'Mw'),
         context.config['Stepp']['magnitude_windows'],
         context.config['Stepp']['time_window'],
         context.config['Stepp']['sensitivity'],
-        context.config['Stepp']['increment_lock'])
+        context.config['Stepp']['increment_lock'],
+        context.catalog_index)
+
+
+@logged_job
+@uses_columns(longitude='float64', latitude='float64', Mw='float64',
+        time='float64')
+@uses_config('Stepp')
+def gridded_stepp(context):
+    """
+    Apply step algorithm at once to the events of
+    every cell of a grid, the cells holding events
+    and their completeness tables are stored
+    """
+
+    config = context.config['Stepp']
+    context.completeness_cells, context.completeness_tables = \
+        context.map_sc['gridded_stepp'](
+            catalogue_column(context.catalog_matrix, 'longitude'),
+            catalogue_column(context.catalog_matrix, 'latitude'),
+            event_year(context.catalog_matrix),
+            catalogue_column(context.catalog_matrix, 'Mw'),
+            context.config['GriddedStepp']['cell_size'],
+            config['magnitude_windows'], config['time_window'],
+            config['sensitivity'], config['increment_lock'])
+
+
+@logged_job
+@uses_columns(longitude='float64', latitude='float64', Mw='float64',
+        time='float64')
+def completeness_filter(context):
+    """
+    Flag the eq events recorded in the complete part of the
+    catalogue. Before the source models are read the events
+    of the catalog matrix are flagged by the completeness
+    tables (completeness_mask): the pprocessing result holds
+    only the complete events and the processing steps get
+    only the complete events of the catalog matrix, unless
+    a later step replaces it. Otherwise the events of every
+    source model are flagged by its completeness table when
+    given by SourceStepp (by the completeness tables of the
+    catalogue if not) and only the complete events are given
+    to the following processing steps. The completeness
+    tables of the catalogue are the ones of the GriddedStepp
+    cells holding the events, the one of Stepp otherwise.
+    """
+
+    from mtoolkit.completeness import completeness_flags
+
+    if getattr(context, 'sm_definitions', None) is None:
+        matrix = context.catalog_matrix
+        context.completeness_mask = _catalogue_completeness(context,
+            event_year(matrix), catalogue_column(matrix, 'Mw'),
+            catalogue_column(matrix, 'longitude'),
+            catalogue_column(matrix, 'latitude'))
+        context.completeness_mask_matrix = context.catalog_matrix
+        return
+
+    matrix = context.vmain_shock
+    events = []
+    for sm in context.sm_definitions:
+        polygon = _create_polygon(sm)
+        _check_polygon(polygon)
+        events.append(np.nonzero(_polygon_mask(context, polygon))[0])
+    counts = [len(source_events) for source_events in events]
+    group = np.repeat(np.arange(len(counts)), counts)
+    event = np.concatenate(events + [np.zeros(0, dtype=int)])
+    year = event_year(matrix)[event]
+    mw = catalogue_column(matrix, 'Mw')[event]
+
+    tables = getattr(context, 'source_completeness_tables', None)
+    if tables is None:
+        complete = _catalogue_completeness(context, year, mw,
+            catalogue_column(matrix, 'longitude')[event],
+            catalogue_column(matrix, 'latitude')[event])
+    elif len(event):
+        # Source models without events have no table,
+        # any table with the same magnitudes fills in
+        filler = [table for table in tables if table is not None][0]
+        complete = completeness_flags(year, mw, [filler if table is None
+            else table for table in tables], group)
+    else:
+        complete = np.zeros(0, dtype=bool)
+
+    # Events are grouped by source model
+    context.complete_events = np.split(event[complete], np.cumsum(
+        np.bincount(group[complete], minlength=len(counts)))[:-1])
+    context.complete_events_matrix = matrix
+
+
+def _catalogue_completeness(context, year, mw, longitude, latitude):
+    """
+    Return the completeness flags of events given by the
+    completeness tables of the GriddedStepp cells holding
+    them and, for the events of other cells, by the one of
+    the catalogue (these events are incomplete without it)
+    """
+
+    from mtoolkit.completeness import completeness_flags, cell_groups
+
+    cell_tables = getattr(context, 'completeness_tables', None)
+    if cell_tables is None:
+        return completeness_flags(year, mw, _completeness_table(context))
+
+    group = cell_groups(longitude, latitude, context.completeness_cells,
+            context.config['GriddedStepp']['cell_size'])
+    in_cell = group >= 0
+    complete = np.zeros(len(group), dtype=bool)
+    if np.any(in_cell):
+        complete[in_cell] = completeness_flags(year[in_cell], mw[in_cell],
+                cell_tables, group[in_cell])
+    completeness_table = getattr(context, 'completeness_table', None)
+    if completeness_table is not None and not np.all(in_cell):
+        complete[~in_cell] = completeness_flags(year[~in_cell],
+                mw[~in_cell], completeness_table)
+    return complete
+
+
+def _completeness_table(context):
+    """Return the completeness table of the catalogue"""
+
+    completeness_table = getattr(context, 'completeness_table', None)
+    if completeness_table is None:
+        raise RuntimeError('Completeness filter without completeness '
+                'table, a completeness step (e.g. Stepp or GriddedStepp) '
+                'is required')
+    return completeness_table
+
+
+@logged_job
+def write_pprocessing_result(context):
+    """
+    Write the eq catalog in the pprocessing result file, along
+    with the cluster and flag of every event given by the
+    declustering step, its mainshock probability and its
+    completeness flag when computed by the preprocessing steps
+    """
+
+    eq_catalog = context.eq_catalog
+    columns = []
+    for name, attribute in [('vcl', 'vcl'), ('flag', 'flag_vector'),
+            ('mainshock_probability', 'mainshock_probability')]:
+        values = getattr(context, attribute, None)
+        if values is not None:
+            columns.append((name, values))
+    if getattr(context, 'completeness_table', None) is not None or \
+            getattr(context, 'completeness_tables', None) is not None:
+        complete = _catalogue_completeness(context,
+            _eq_catalog_column(eq_catalog, 'year'),
+            _eq_catalog_column(eq_catalog, 'Mw'),
+            _eq_catalog_column(eq_catalog, 'longitude'),
+            _eq_catalog_column(eq_catalog, 'latitude'))
+        columns.append(('complete', complete))
+        # Only the complete events pass the CompletenessFilter step
+        if getattr(context, 'completeness_mask', None) is not None:
+            eq_catalog = [eq_entry for eq_entry, keep in
+                    zip(eq_catalog, complete) if keep]
+            columns = [(name, np.asarray(values)[complete])
+                    for name, values in columns]
+
+    # Fields of the eq catalog read, followed by the
+    # ones added by the preprocessing steps (e.g. MwSource)
+    fieldnames = _eq_catalog_fieldnames(context.config['eq_catalog_file'])
+    if eq_catalog:
+        fieldnames += sorted(field for field in eq_catalog[0]
+                if field not in fieldnames)
+    EqCatalogWriter(context.config['pprocessing_result_file'],
+            fieldnames).write(eq_catalog, columns)
 
 
 def _processing_steps_required(context):
@@ -132,6 +720,8 @@ def _create_polygon(source_model):
     the source model geometry
     """
 
+    from shapely.geometry import Polygon
+
     area_boundary_plist = source_model['area_boundary']
     points_list = [(area_boundary_plist[i], area_boundary_plist[i + 1])
             for i in xrange(0, len(area_boundary_plist), 2)]
@@ -149,17 +739,38 @@ def _filter_eq_entries(context, polygon):
     """
     Return a numpy matrix of filtered eq events.
     The matrix contains all eq entries
-    contained in the given polygon
+    contained in the given polygon, complete
+    when flagged by the CompletenessFilter step
     """
 
-    filtered_eq = []
-    longitude = 3
-    latitude = 4
-    for eq in context.vmain_shock:
-        eq_point = Point(eq[longitude], eq[latitude])
-        if polygon.contains(eq_point):
-            filtered_eq.append(eq)
-    return np.array(filtered_eq)
+    inside = _polygon_mask(context, polygon)
+    if getattr(context, 'completeness_mask_matrix', None) is \
+            context.vmain_shock:
+        inside = inside & context.completeness_mask
+    return context.vmain_shock[inside]
+
+
+def _polygon_mask(context, polygon):
+    """Return the mask of the eq events contained in the polygon"""
+
+    from shapely.geometry import Point
+
+    longitude = catalogue_column(context.vmain_shock, 'longitude')
+    latitude = catalogue_column(context.vmain_shock, 'latitude')
+    # Masks of the polygons kept between runs (e.g. by
+    # a server), keyed by polygon and event coordinates
+    masks = getattr(context, 'polygon_masks', None)
+    if masks is not None:
+        key = (polygon.wkt, hashlib.sha1(
+            np.ascontiguousarray(longitude).tostring() +
+            np.ascontiguousarray(latitude).tostring()).hexdigest())
+        if key in masks:
+            return masks[key]
+    inside = np.array([polygon.contains(Point(lon, lat))
+            for lon, lat in zip(longitude, latitude)], dtype=bool)
+    if masks is not None:
+        masks[key] = inside
+    return inside
 
 
 def processing_workflow_setup_gen(context):
@@ -173,8 +784,215 @@ def processing_workflow_setup_gen(context):
     """
 
     if _processing_steps_required(context):
-        for sm in context.sm_definitions:
+        # Complete events of every source model, given
+        # by the CompletenessFilter step
+        complete_events = None
+        if getattr(context, 'complete_events_matrix', None) is \
+                context.vmain_shock:
+            complete_events = context.complete_events
+        for index, sm in enumerate(context.sm_definitions):
+            if complete_events is not None:
+                yield sm, context.vmain_shock[complete_events[index]]
+                continue
             polygon = _create_polygon(sm)
             _check_polygon(polygon)
             filtered_eq = _filter_eq_entries(context, polygon)
             yield sm, filtered_eq
+
+
+def _update_truncated_guten_richter(sm, a_value, b_value):
+    """
+    Set the a and b values of the truncated
+    gutenberg richter of a source model
+    """
+
+    for rrm_entry in sm['rupture_rate_model']:
+        if rrm_entry['name'] == 'truncated_guten_richter':
+            rrm_entry['a_value_cumulative'] = float(a_value)
+            rrm_entry['b_value'] = float(b_value)
+
+
+def _bootstrap_recurrence(context, sm, year, mw, algorithm, options):
+    """
+    Add to the truncated gutenberg richter of a source
+    model the bootstrap confidence intervals of its a and
+    b values, when a bootstrap is defined in the config
+    """
+
+    from mtoolkit.recurrence import confidence_interval
+
+    bootstrap_config = context.config['Recurrence'].get('bootstrap')
+    if not bootstrap_config:
+        return
+
+    b_values, rates = context.map_sc['bootstrap'](year, mw, algorithm,
+            options, bootstrap_config['samples'],
+            bootstrap_config.get('seed', 0),
+            bootstrap_config.get('processes', 1))
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        a_values = np.log10(rates) + \
+                b_values * options['reference_magnitude']
+    finally:
+        np.seterr(**olderr)
+
+    confidence_level = bootstrap_config['confidence_level']
+    for rrm_entry in sm['rupture_rate_model']:
+        if rrm_entry['name'] == 'truncated_guten_richter':
+            rrm_entry['confidence_level'] = confidence_level
+            rrm_entry['a_value_cumulative_confidence_interval'] = list(
+                confidence_interval(a_values, confidence_level))
+            rrm_entry['b_value_confidence_interval'] = list(
+                confidence_interval(b_values, confidence_level))
+
+
+def _weichert_recurrence(context, weichert_config):
+    """
+    Estimate the recurrence of every source model
+    with the Weichert algorithm, one source at a time
+    """
+
+    logger = logging.getLogger('mt_logger')
+    reference_magnitude = weichert_config['reference_magnitude']
+    source_tables = getattr(context, 'source_completeness_tables', None)
+    for index, (sm, filtered_eq) in enumerate(
+            processing_workflow_setup_gen(context)):
+        # The completeness table of the source model
+        # when given by the SourceStepp step
+        completeness_table = getattr(context, 'completeness_table', None)
+        if source_tables is not None:
+            completeness_table = source_tables[index]
+        if not len(filtered_eq):
+            logger.warn('No eq events in source model: %s' % sm.get('name'))
+            continue
+        b_value, _, rate, _ = context.map_sc['weichert'](
+            event_year(filtered_eq),
+            catalogue_column(filtered_eq, 'Mw'),
+            completeness_table, weichert_config['magnitude_window'],
+            reference_magnitude)
+        if np.isnan(b_value):
+            logger.warn('Recurrence not estimated for source model: %s'
+                    % sm.get('name'))
+            continue
+        a_value = np.log10(rate) + b_value * reference_magnitude
+        _update_truncated_guten_richter(sm, a_value, b_value)
+        _bootstrap_recurrence(context, sm,
+            event_year(filtered_eq),
+            catalogue_column(filtered_eq, 'Mw'), 'Wiechart',
+            {'completeness_table': completeness_table,
+             'dm': weichert_config['magnitude_window'],
+             'reference_magnitude': reference_magnitude})
+
+
+def _mle_recurrence(context, mle_config):
+    """
+    Estimate the recurrence of all the source models
+    at once with the maximum likelihood algorithm.
+    Events are complete above the lowest magnitude of
+    the completeness table, since its completeness year.
+    """
+
+    logger = logging.getLogger('mt_logger')
+    reference_magnitude = mle_config['reference_magnitude']
+
+    sources, years, mws = [], [], []
+    for sm, filtered_eq in processing_workflow_setup_gen(context):
+        sources.append(sm)
+        if len(filtered_eq):
+            years.append(event_year(filtered_eq))
+            mws.append(catalogue_column(filtered_eq, 'Mw'))
+        else:
+            years.append(np.zeros(0))
+            mws.append(np.zeros(0))
+    if not sources:
+        return
+
+    source_index = np.repeat(np.arange(len(sources)),
+            [len(mw) for mw in mws])
+    year = np.concatenate(years)
+    mw = np.concatenate(mws)
+    if not len(mw):
+        for sm in sources:
+            logger.warn('No eq events in source model: %s' % sm.get('name'))
+        return
+    completeness_table = getattr(context, 'completeness_table', None)
+    if completeness_table is None:
+        mmin, start_year = np.min(mw), np.min(year)
+    else:
+        mmin, start_year = completeness_table[0]
+    complete = np.logical_and(mw >= mmin, year >= start_year)
+    duration = np.max(year) - start_year + 1.
+
+    b_values, _, rates, _ = context.map_sc['aki_utsu'](
+        mw[complete], source_index[complete], len(sources), mmin,
+        mle_config['magnitude_window'], duration, reference_magnitude)
+
+    for index, (sm, b_value, rate) in enumerate(zip(sources, b_values,
+            rates)):
+        if np.isnan(b_value):
+            logger.warn('Recurrence not estimated for source model: %s'
+                    % sm.get('name'))
+            continue
+        a_value = np.log10(rate) + b_value * reference_magnitude
+        _update_truncated_guten_richter(sm, a_value, b_value)
+        in_source = np.logical_and(complete, source_index == index)
+        _bootstrap_recurrence(context, sm, year[in_source], mw[in_source],
+            'MLE', {'mmin': mmin, 'dm': mle_config['magnitude_window'],
+                    'duration': duration,
+                    'reference_magnitude': reference_magnitude})
+
+
+@logged_job
+@uses_columns(longitude='float64', latitude='float64', Mw='float64',
+        time='float64')
+@uses_config('Stepp')
+def source_stepp(context):
+    """
+    Apply step algorithm at once to the eq events of
+    every source model, the completeness tables are
+    stored in the source models order (None for the
+    source models without eq events)
+    """
+
+    config = context.config['Stepp']
+    years, mws = [], []
+    for _, filtered_eq in processing_workflow_setup_gen(context):
+        if len(filtered_eq):
+            years.append(event_year(filtered_eq))
+            mws.append(catalogue_column(filtered_eq, 'Mw'))
+        else:
+            years.append(np.zeros(0))
+            mws.append(np.zeros(0))
+    counts = [len(mw) for mw in mws]
+    if not sum(counts):
+        context.source_completeness_tables = [None] * len(counts)
+        return
+
+    tables = context.map_sc['grouped_stepp'](
+        np.repeat(np.arange(len(counts)), counts), np.concatenate(years),
+        np.concatenate(mws), len(counts), config['magnitude_windows'],
+        config['time_window'], config['sensitivity'],
+        config['increment_lock'])
+    context.source_completeness_tables = [table if count else None
+            for table, count in zip(tables, counts)]
+
+
+@logged_job
+@uses_columns(longitude='float64', latitude='float64', Mw='float64',
+        time='float64')
+def recurrence(context):
+    """
+    Apply the recurrence algorithm to the eq events
+    of every source model, the a and b values of
+    the truncated gutenberg richter of each source
+    model are updated with the estimated ones
+    """
+
+    config = context.config['Recurrence']
+    algorithm = config['recurrence_algorithm']
+    if algorithm == 'Wiechart':
+        _weichert_recurrence(context, config['Wiechart'])
+    elif algorithm == 'MLE':
+        _mle_recurrence(context, config['MLE'])
+    else:
+        raise RuntimeError('Invalid recurrence algorithm: %s' % algorithm)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+"""
+The purpose of this module is to provide the inner
+loops (kernels) of the haversine distances, of the
+Gardner & Knopoff declustering and of the Stepp
+completeness analysis. Every kernel has a numpy
+implementation and an explicit loop implementation,
+compiled with numba when it is importable. The
+backend is selected at runtime by set_backend, numba
+is imported and the kernels compiled only when the
+numba backend is used.
+"""
+
+import math
+import logging
+
+import numpy as np
+
+
+BACKENDS = ('numpy', 'numba')
+
+
+def _numpy_haversine(lon1, lat1, lon2, lat2, earth_rad, distance):
+    """
+    Fill distance (nlocs1 x nlocs2) with the haversine
+    distances between two sets of points given in radians
+    """
+
+    i = 0
+    while i < len(lon2):
+        # Perform distance calculation
+        dlat = lat1 - lat2[i]
+        dlon = lon1 - lon2[i]
+        aval = (np.sin(dlat / 2.) ** 2.) + (np.cos(lat1) * np.cos(lat2[i]) *
+             (np.sin(dlon / 2.) ** 2.))
+        distance[:, i] = 2. * earth_rad * np.arctan2(np.sqrt(aval),
+                                                    np.sqrt(1 - aval))
+        i += 1
+
+
+def _numpy_gardner_knopoff(time_day, lon, lat, f_space, f_time,
+    fs_time_prop, order, sorted_time, earth_rad, vcl):
+    """
+    Assign to vcl the cluster of every event, events are
+    sorted by descending magnitude, lon and lat are given
+    in radians and order/sorted_time index the event times
+    """
+
+    neq = len(time_day)
+    i = 0
+    while i < neq:
+        if vcl[i] == 0:
+            # Find Events inside both fore- and aftershock time windows
+            vsel = order[np.searchsorted(sorted_time,
+                    time_day[i] - f_time[i] * fs_time_prop, side='left'):
+                    np.searchsorted(sorted_time,
+                    time_day[i] + f_time[i], side='right')]
+            # Of those events inside time window, find those inside distance
+            # window
+            distance = np.zeros((len(vsel), 1), dtype=lon.dtype)
+            _numpy_haversine(lon[vsel], lat[vsel], lon[i:i + 1],
+                    lat[i:i + 1], earth_rad, distance)
+            vsel = vsel[distance[:, 0] <= f_space[i]]
+            # Allocate a cluster number
+            vcl[vsel] = i + 1
+            # Indicate the foreshocks
+            vcl[vsel[time_day[vsel] < time_day[i]]] = -1 * (i + 1)
+            vcl[i] = 0  # Remove mainshock from cluster
+        i += 1
+
+
+def _numpy_stepp_counts(mag_bin, sorted_year, tlb, counts):
+    """
+    Fill counts (time windows x magnitude bins) with the number
+    of events later than the lower bound of every time window,
+    mag_bin holds the magnitude bin of the time sorted events
+    """
+
+    # Lower bounds move back in time, so each time window
+    # adds to the previous counts the earthquakes of a slice
+    # of the time sorted catalogue
+    nbins = counts.shape[1]
+    current = np.zeros(nbins)
+    end = len(sorted_year)
+    ii = 0
+    while ii < len(tlb):
+        start = np.searchsorted(sorted_year, tlb[ii], side='left')
+        new_bins = mag_bin[start:end]
+        current += np.bincount(new_bins[new_bins >= 0], minlength=nbins)
+        counts[ii, :] = current
+        end = min(start, end)
+        ii += 1
+
+
+def _loop_haversine(lon1, lat1, lon2, lat2, earth_rad, distance):
+    """Explicit loop implementation of _numpy_haversine"""
+
+    for j in range(lon2.shape[0]):
+        cos_lat2 = math.cos(lat2[j])
+        for i in range(lon1.shape[0]):
+            sin_dlat = math.sin((lat1[i] - lat2[j]) / 2.)
+            sin_dlon = math.sin((lon1[i] - lon2[j]) / 2.)
+            aval = min(1., sin_dlat * sin_dlat +
+                    math.cos(lat1[i]) * cos_lat2 * sin_dlon * sin_dlon)
+            distance[i, j] = 2. * earth_rad * math.atan2(math.sqrt(aval),
+                    math.sqrt(1. - aval))
+
+
+def _loop_gardner_knopoff(time_day, lon, lat, f_space, f_time,
+    fs_time_prop, order, sorted_time, earth_rad, vcl):
+    """Explicit loop implementation of _numpy_gardner_knopoff"""
+
+    neq = time_day.shape[0]
+    for i in range(neq):
+        if vcl[i] != 0:
+            continue
+        # Binary search of the first event inside the time window
+        start_time = time_day[i] - f_time[i] * fs_time_prop
+        low, high = 0, neq
+        while low < high:
+            mid = (low + high) // 2
+            if sorted_time[mid] < start_time:
+                low = mid + 1
+            else:
+                high = mid
+        start = low
+        # and of the first event after it
+        end_time = time_day[i] + f_time[i]
+        high = neq
+        while low < high:
+            mid = (low + high) // 2
+            if sorted_time[mid] <= end_time:
+                low = mid + 1
+            else:
+                high = mid
+        cos_lat = math.cos(lat[i])
+        for k in range(start, low):
+            j = order[k]
+            sin_dlat = math.sin((lat[j] - lat[i]) / 2.)
+            sin_dlon = math.sin((lon[j] - lon[i]) / 2.)
+            aval = min(1., sin_dlat * sin_dlat +
+                    math.cos(lat[j]) * cos_lat * sin_dlon * sin_dlon)
+            if 2. * earth_rad * math.atan2(math.sqrt(aval),
+                    math.sqrt(1. - aval)) <= f_space[i]:
+                # +cluster = aftershock, -cluster = foreshock
+                if time_day[j] < time_day[i]:
+                    vcl[j] = -(i + 1)
+                else:
+                    vcl[j] = i + 1
+        vcl[i] = 0  # Remove mainshock from cluster
+
+
+def _loop_stepp_counts(mag_bin, sorted_year, tlb, counts):
+    """Explicit loop implementation of _numpy_stepp_counts"""
+
+    end = sorted_year.shape[0]
+    for ii in range(tlb.shape[0]):
+        if ii > 0:
+            counts[ii, :] = counts[ii - 1, :]
+        low, high = 0, sorted_year.shape[0]
+        while low < high:
+            mid = (low + high) // 2
+            if sorted_year[mid] < tlb[ii]:
+                low = mid + 1
+            else:
+                high = mid
+        for k in range(low, end):
+            if mag_bin[k] >= 0:
+                counts[ii, mag_bin[k]] += 1
+        end = min(low, end)
+
+
+NUMPY_KERNELS = {'haversine': _numpy_haversine,
+                 'gardner_knopoff': _numpy_gardner_knopoff,
+                 'stepp_counts': _numpy_stepp_counts}
+
+LOOP_KERNELS = {'haversine': _loop_haversine,
+                'gardner_knopoff': _loop_gardner_knopoff,
+                'stepp_counts': _loop_stepp_counts}
+
+# Loop kernels compiled by numba, built by set_backend
+NUMBA_KERNELS = {}
+
+_ACTIVE = {'backend': None, 'kernels': None}
+
+
+def numba_available():
+    """Return True if numba is importable"""
+
+    try:
+        import numba
+    except ImportError:
+        return False
+    return True
+
+
+def set_backend(name=None):
+    """
+    Select the backend ('numpy' or 'numba') of the kernels,
+    numba is the default when it is importable and numpy is
+    used in its place when it is not. Return the backend
+    actually selected.
+    """
+
+    if name is None:
+        name = 'numba' if numba_available() else 'numpy'
+    if name not in BACKENDS:
+        raise RuntimeError('Invalid backend: %s' % name)
+    if name == 'numba' and not numba_available():
+        logging.getLogger('mt_logger').warning(
+                'numba is not available, using the numpy backend')
+        name = 'numpy'
+    if name == 'numba' and not NUMBA_KERNELS:
+        import numba
+        # Loop kernels are compiled on first call
+        NUMBA_KERNELS.update((kernel_name, numba.njit(loop_kernel))
+                for kernel_name, loop_kernel in LOOP_KERNELS.items())
+    _ACTIVE['backend'] = name
+    _ACTIVE['kernels'] = NUMBA_KERNELS if name == 'numba' else NUMPY_KERNELS
+    return name
+
+
+def backend():
+    """Return the name of the selected backend"""
+
+    if _ACTIVE['backend'] is None:
+        set_backend()
+    return _ACTIVE['backend']
+
+
+def kernel(name):
+    """Return the kernel of the selected backend"""
+
+    if _ACTIVE['kernels'] is None:
+        set_backend()
+    return _ACTIVE['kernels'][name]
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+"""Module which implements recurrence algorithms"""
+
+
+from multiprocessing import Pool
+
+import numpy as np
+
+# Tolerance used when assigning magnitudes to bins, so that
+# values lying on a bin edge are not lost to rounding
+BIN_TOL = 1E-7
+
+# Maximum number of event indices drawn at once by bootstrap
+MAX_CHUNK_INDICES = 10 ** 7
+
+
+def weichert_bins(year, mw, completeness_table=None, dm=0.1,
+        end_year=None, mmax=None):
+    """
+    Return the magnitude bins used by the Weichert method
+    and, for each bin, the duration of complete recording
+    and the number of complete events.
+    Year    = Year of earthquake (a 2-D array gives one
+              catalogue per row, all sharing the same bins)
+    M       = Magnitude (Mw)
+    completeness_table = [magnitude, year] rows, as returned
+              by stepp_analysis; None takes the whole
+              catalogue as complete
+    dM      = Magnitude interval
+    end_year, mmax = Last year and highest magnitude covered
+              by the bins, by default those of the catalogue
+    """
+
+    if end_year is None:
+        end_year = np.max(year)
+    if mmax is None:
+        mmax = np.max(mw)
+    if completeness_table is None:
+        completeness_table = np.array([[np.min(mw), np.min(year)]])
+    completeness_table = np.asarray(completeness_table, dtype=float)
+
+    # Magnitude bins start at the lowest completeness magnitude
+    lowm = completeness_table[0, 0]
+    nbins = int(np.floor((mmax - lowm) / dm + BIN_TOL)) + 1
+    mbin = lowm + dm * np.arange(nbins)
+    fmag = mbin + dm / 2.
+
+    # Year of completeness of every bin and effective durations
+    irow = np.searchsorted(completeness_table[:, 0], mbin + BIN_TOL,
+            side='right') - 1
+    comp_year = completeness_table[np.maximum(irow, 0), 1]
+    tper = end_year - comp_year + 1.
+
+    # Count the events recorded in the complete part of each bin
+    ibin = np.floor((mw - lowm) / dm + BIN_TOL).astype(int)
+    complete = np.logical_and(ibin >= 0, ibin < nbins)
+    complete[complete] = year[complete] >= comp_year[ibin[complete]]
+    if np.ndim(year) == 1:
+        nobs = np.bincount(ibin[complete], minlength=nbins)
+    else:
+        row = np.arange(np.shape(year)[0])[:, np.newaxis] + \
+                np.zeros_like(ibin)
+        nobs = np.bincount(row[complete] * nbins + ibin[complete],
+            minlength=np.shape(year)[0] * nbins).reshape(-1, nbins)
+
+    return fmag, tper, nobs.astype(float)
+
+
+def weichert_newton(tper, fmag, nobs, bval=1.0, itstab=1E-5, maxiter=1000):
+    """
+    Solve the Weichert (1980) maximum likelihood equation
+    for beta with Newton iterations. Every step is a handful
+    of array reductions over the magnitude bins, nobs may
+    hold one catalogue per row which are solved together.
+    tper    = Duration of complete recording of each bin
+    fmag    = Central magnitude of each bin
+    nobs    = Number of complete events in each bin
+    bval    = Initial guess of the b-value
+    itstab  = Convergence threshold on beta
+    maxiter = Maximum number of iterations
+    Return beta, its standard deviation and the annual rate
+    of events with magnitude greater than the lowest bin edge,
+    NaN where the iteration does not converge.
+    """
+
+    nobs = np.atleast_2d(nobs)
+    nkount = np.sum(nobs, axis=-1)
+    snm = np.sum(nobs * fmag, axis=-1)
+    beta = bval * np.log(10.) * np.ones(np.shape(nobs)[0])
+    converged = np.zeros(np.shape(beta), dtype=bool)
+    sigbeta = np.zeros(np.shape(beta))
+    olderr = np.seterr(divide='ignore', invalid='ignore', over='ignore')
+    try:
+        for _ in xrange(maxiter):
+            beta_exp = np.exp(-beta[:, np.newaxis] * fmag)
+            tjexp = tper * beta_exp
+            tmexp = tjexp * fmag
+            sumtex = np.sum(tjexp, axis=-1)
+            stmex = np.sum(tmexp, axis=-1)
+            stm2x = np.sum(fmag * tmexp, axis=-1)
+            dldb = stmex / sumtex
+            d2ldb2 = nkount * ((dldb ** 2.) - (stm2x / sumtex))
+            dldb = (dldb * nkount) - snm
+            step = np.where(converged, 0., dldb / d2ldb2)
+            beta = beta - step
+            sigbeta = np.where(converged, sigbeta, np.sqrt(-1. / d2ldb2))
+            converged = np.logical_or(converged, np.abs(step) <= itstab)
+            if np.all(np.logical_or(converged, np.isnan(step))):
+                break
+
+        beta_exp = np.exp(-beta[:, np.newaxis] * fmag)
+        rate = nkount * (np.sum(beta_exp, axis=-1) /
+                np.sum(tper * beta_exp, axis=-1))
+    finally:
+        np.seterr(**olderr)
+
+    beta[~converged] = np.nan
+    sigbeta[~converged] = np.nan
+    rate[~converged] = np.nan
+    return beta, sigbeta, rate
+
+
+def weichert(year, mw, completeness_table=None, dm=0.1,
+        reference_magnitude=0.0, bval=1.0, itstab=1E-5, maxiter=1000):
+    """
+    Weichert (1980) function
+    Year    = Year of earthquake
+    M       = Magnitude (Mw)
+    completeness_table = [magnitude, year] rows, as returned
+              by stepp_analysis
+    dM      = Magnitude interval
+    reference_magnitude = Magnitude at which the rate is given
+    bval    = Initial guess of the b-value
+    itstab  = Convergence threshold
+    maxiter = Maximum number of iterations
+    Return b-value, its standard deviation, annual rate of
+    events with magnitude greater than the reference magnitude
+    and its standard deviation (NaN if no convergence).
+    """
+
+    fmag, tper, nobs = weichert_bins(year, mw, completeness_table, dm)
+    beta, sigbeta, rate = weichert_newton(tper, fmag, nobs, bval, itstab,
+            maxiter)
+    bvalue = beta / np.log(10.)
+    sigb = sigbeta / np.log(10.)
+    # Move the rate from the lowest bin edge to the reference magnitude
+    min_edge = fmag[0] - dm / 2.
+    rate_ref = rate * np.exp(-beta * (reference_magnitude - min_edge))
+    sigma_rate_ref = rate_ref / np.sqrt(np.sum(nobs, axis=-1))
+    return bvalue[0], sigb[0], rate_ref[0], sigma_rate_ref[0]
+
+
+def aki_utsu(mw, source_index, nsources, mmin, dm=0.1, duration=1.0,
+        reference_magnitude=0.0):
+    """
+    Aki (1965) / Utsu maximum likelihood b-value of many
+    sources in one pass: every statistic is a segmented sum
+    computed with np.bincount over the source of each event.
+    M       = Magnitude (Mw) of the events, not lower than mmin
+    source_index = Index (0..nsources - 1) of the source of
+              every event
+    nsources = Number of sources
+    mmin    = Magnitude of completeness
+    dM      = Magnitude interval the magnitudes are rounded to
+    duration = Duration of the catalogue (scalar or one
+              value for each source)
+    reference_magnitude = Magnitude at which the rate is given
+    Return for every source the b-value, its standard deviation
+    (Shi and Bolt, 1982), the annual rate of events with magnitude
+    greater than the reference magnitude and its standard
+    deviation; NaN for sources with less than two events.
+    """
+
+    counts = np.bincount(source_index, minlength=nsources).astype(float)
+    olderr = np.seterr(divide='ignore', invalid='ignore')
+    try:
+        mean_mw = np.bincount(source_index, weights=mw,
+                minlength=nsources) / counts
+        sq_dev = np.bincount(source_index,
+                weights=(mw - mean_mw[source_index]) ** 2.,
+                minlength=nsources)
+
+        bvalue = np.log10(np.e) / (mean_mw - (mmin - dm / 2.))
+        sigb = 2.3 * (bvalue ** 2.) * np.sqrt(sq_dev /
+                (counts * (counts - 1.)))
+        # Rate moved from the lowest bin edge (as in
+        # weichert) to the reference magnitude
+        rate = (counts / duration) * \
+                10. ** (-bvalue * (reference_magnitude - (mmin - dm / 2.)))
+        sigma_rate = rate / np.sqrt(counts)
+    finally:
+        np.seterr(**olderr)
+
+    undefined = counts < 2
+    for values in (bvalue, sigb, rate, sigma_rate):
+        values[undefined] = np.nan
+    return bvalue, sigb, rate, sigma_rate
+
+
+def _weichert_resamples(year, mw, resamples, completeness_table=None,
+        dm=0.1, reference_magnitude=0.0):
+    """
+    Return b-values and rates of the Weichert method
+    for every resample (row of indices) of a catalogue
+    """
+
+    if completeness_table is None:
+        completeness_table = np.array([[np.min(mw), np.min(year)]])
+    fmag, tper, nobs = weichert_bins(year[resamples], mw[resamples],
+            completeness_table, dm, np.max(year), np.max(mw))
+    beta, _, rate = weichert_newton(tper, fmag, nobs)
+    min_edge = fmag[0] - dm / 2.
+    return beta / np.log(10.), \
+            rate * np.exp(-beta * (reference_magnitude - min_edge))
+
+
+def _aki_utsu_resamples(year, mw, resamples, mmin, dm=0.1, duration=1.0,
+        reference_magnitude=0.0):
+    """
+    Return b-values and rates of the maximum likelihood
+    method for every resample (row of indices) of a
+    catalogue, each resample being a source of aki_utsu
+    """
+
+    nresamples = np.shape(resamples)[0]
+    source_index = np.repeat(np.arange(nresamples), np.shape(resamples)[1])
+    bvalue, _, rate, _ = aki_utsu(mw[resamples.ravel()], source_index,
+            nresamples, mmin, dm, duration, reference_magnitude)
+    return bvalue, rate
+
+
+BOOTSTRAP_ESTIMATORS = {'Wiechart': _weichert_resamples,
+                        'MLE': _aki_utsu_resamples}
+
+
+def _bootstrap_chunk(args):
+    """
+    Draw and evaluate one chunk of resamples, the random
+    generator is seeded with the seed and the chunk number
+    so results do not depend on how chunks are distributed
+    """
+
+    algorithm, year, mw, nresamples, seed, chunk, options = args
+    rnd = np.random.RandomState([seed, chunk])
+    resamples = rnd.randint(0, len(mw), (nresamples, len(mw)))
+    return BOOTSTRAP_ESTIMATORS[algorithm](year, mw, resamples, **options)
+
+
+def bootstrap(year, mw, algorithm, options, nsamples=1000, seed=0,
+        processes=1, chunk_size=None):
+    """
+    Bootstrap the recurrence parameters of a catalogue.
+    Resamples (with replacement) are drawn as matrices
+    of event indices and every chunk of resamples is
+    evaluated at once by the vectorized estimator.
+    Year    = Year of earthquake
+    M       = Magnitude (Mw)
+    algorithm = Wiechart or MLE
+    options = Keyword arguments of the estimator
+    nsamples = Number of resamples
+    seed    = Seed of the random generator
+    processes = Number of worker processes evaluating chunks
+    chunk_size = Number of resamples evaluated at once, by
+              default about 10^7 event indices per chunk
+    Return the b-values and the rates of all the resamples.
+    """
+
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_INDICES // max(1, len(mw)))
+    chunks = [(algorithm, year, mw, min(chunk_size, nsamples - start), seed,
+            chunk, options) for chunk, start in
+            enumerate(xrange(0, nsamples, chunk_size))]
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            results = pool.map(_bootstrap_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_bootstrap_chunk(chunk) for chunk in chunks]
+    return np.concatenate([bvalue for bvalue, _ in results]), \
+            np.concatenate([rate for _, rate in results])
+
+
+def confidence_interval(samples, confidence_level=0.95):
+    """
+    Return the lower and upper bounds of the
+    equal tailed confidence interval of samples,
+    NaN samples are ignored
+    """
+
+    tail = 100. * (1. - confidence_level) / 2.
+    samples = np.asarray(samples)
+    samples = samples[~np.isnan(samples)]
+    if not len(samples):
+        return np.nan, np.nan
+    lower, upper = np.percentile(samples, [tail, 100. - tail])
+    return lower, upper
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+"""
+The purpose of this module is to provide a server
+running pipelines on a worker pool, the configs are
+posted over http on localhost. The eq catalogs, the
+catalog matrices, the source models and the polygon
+masks are kept in memory between the requests, the
+nrml schema is compiled once by every worker.
+"""
+
+import os
+import copy
+import json
+import logging
+import threading
+from collections import OrderedDict
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from multiprocessing.pool import ThreadPool
+
+from mtoolkit.workflow import Context, PipeLineBuilder
+from mtoolkit.jobs import logged_job, read_eq_catalog, \
+create_catalog_matrix, read_source_model, _catalog_matrix_columns
+from mtoolkit.sweep import sweep_results
+
+
+def merge(config, overrides):
+    """
+    Return a copy of config updated with the overrides,
+    nested dicts (the step sections) are merged
+    """
+
+    config = copy.deepcopy(config)
+    for key, value in overrides.iteritems():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            value = merge(config[key], value)
+        config[key] = value
+    return config
+
+
+def _file_key(filename):
+    """Return the key of a file: path, modification time and size"""
+
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+
+# Largest number of entries of every table of the
+# resident cache, least recently used entries are evicted
+MAX_ENTRIES = {'eq_catalogs': 8, 'catalog_matrices': 16,
+               'source_models': 8, 'polygon_masks': 1024}
+
+# Config keys of the files written by the runs, they can't
+# be overridden by the posted configs
+SERVER_SIDE_KEYS = ('result_file', 'pprocessing_result_file',
+        'source_model_cache_dir', 'shared_directory')
+
+
+class LRUTable(object):
+    """
+    LRUTable is a thread safe mapping keeping at most
+    max_entries values, the least recently used value
+    is evicted when a new one is stored
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.values = OrderedDict()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.values)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.values
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.values.pop(key)
+            self.values[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self._store(key, value)
+
+    def setdefault(self, key, value):
+        """Store the value if the key is missing, return its value"""
+
+        with self.lock:
+            value = self.values.pop(key, value)
+            self._store(key, value)
+            return value
+
+    def _store(self, key, value):
+        """Store a value as the most recently used one"""
+
+        self.values[key] = value
+        while len(self.values) > self.max_entries:
+            self.values.popitem(last=False)
+
+
+class ResidentCache(object):
+    """
+    ResidentCache keeps the inputs read by the jobs in
+    memory, keyed by the files they are read from and
+    the modification time of the files. Every table keeps
+    the most recently used entries, so the entries of
+    changed files are evicted.
+    """
+
+    def __init__(self, max_entries=None):
+        max_entries = dict(MAX_ENTRIES, **(max_entries or {}))
+        self.lock = threading.Lock()
+        self.eq_catalogs = LRUTable(max_entries['eq_catalogs'])
+        self.catalog_matrices = LRUTable(max_entries['catalog_matrices'])
+        self.source_models = LRUTable(max_entries['source_models'])
+        self.polygon_masks = LRUTable(max_entries['polygon_masks'])
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table, key, load):
+        """
+        Return the value of a key, loaded (outside
+        the lock) and stored when it is missing
+        """
+
+        with self.lock:
+            if key in table:
+                self.hits += 1
+                return table[key]
+        value = load()
+        with self.lock:
+            self.misses += 1
+            return table.setdefault(key, value)
+
+    def status(self):
+        """Return the number of cached values, hits and misses"""
+
+        with self.lock:
+            return {'eq_catalogs': len(self.eq_catalogs),
+                    'catalog_matrices': len(self.catalog_matrices),
+                    'source_models': len(self.source_models),
+                    'polygon_masks': len(self.polygon_masks),
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def _loaded(job, context):
+    """
+    Run a reading job on a shallow copy of
+    the context, return the copy
+    """
+
+    scratch = copy.copy(context)
+    job(scratch)
+    return scratch
+
+
+@logged_job
+def cached_read_eq_catalog(context):
+    """
+    Create eq entries from the cached eq catalog, every
+    run gets copies of the entries as the preprocessing
+    steps change them
+    """
+
+    config = context.config
+    key = _file_key(config['eq_catalog_file']) + (
+            'MagnitudeHomogenisation' in config.get(
+                'preprocessing_steps', []),
+            json.dumps(config.get('region'), sort_keys=True))
+    eq_catalog = context.resident_cache.get(
+            context.resident_cache.eq_catalogs, key,
+            lambda: _loaded(read_eq_catalog, context).eq_catalog)
+    context.eq_catalog = [dict(eq_entry) for eq_entry in eq_catalog]
+    context.resident_eq_catalog = (key, context.eq_catalog)
+
+
+@logged_job
+def cached_create_catalog_matrix(context):
+    """
+    Create the catalog matrix, taken from the cache when
+    the eq entries are still the ones of the cached eq
+    catalog (no step before changed them). Jobs replace
+    the catalog matrix instead of changing it, so it is
+    shared by the runs.
+    """
+
+    eq_catalog_key, eq_catalog = getattr(context, 'resident_eq_catalog',
+            (None, None))
+    if eq_catalog is not context.eq_catalog:
+        create_catalog_matrix(context)
+        return
+    names, dtype = _catalog_matrix_columns(context)
+    context.catalog_matrix = context.resident_cache.get(
+            context.resident_cache.catalog_matrices,
+            (eq_catalog_key, tuple(names), dtype.name),
+            lambda: _loaded(create_catalog_matrix, context).catalog_matrix)
+
+
+@logged_job
+def cached_read_source_model(context):
+    """
+    Create smodel definitions from the cached source model,
+    every run gets a copy as recurrence updates them
+    """
+
+    sm_definitions = context.resident_cache.get(
+            context.resident_cache.source_models,
+            _file_key(context.config['source_model_file']),
+            lambda: _loaded(read_source_model, context).sm_definitions)
+    context.sm_definitions = copy.deepcopy(sm_definitions)
+
+
+# Jobs replaced by a cached version in the served pipelines
+CACHED_JOBS = {read_eq_catalog: cached_read_eq_catalog,
+               create_catalog_matrix: cached_create_catalog_matrix,
+               read_source_model: cached_read_source_model}
+
+
+def run_config(config, cache):
+    """
+    Run the pipeline of a config, with the inputs taken
+    from the cache, return the results of the run
+    """
+
+    context = Context(config=config)
+    context.resident_cache = cache
+    context.polygon_masks = cache.polygon_masks
+    pipeline = PipeLineBuilder('served pipeline').build(config)
+    pipeline.jobs = [CACHED_JOBS.get(job, job) for job in pipeline.jobs]
+    pipeline.run(context)
+    return sweep_results(context)
+
+
+class ToolkitServer(ThreadingMixIn, HTTPServer):
+    """
+    ToolkitServer runs the configs posted to /run, given
+    as overrides of a base config, on a pool of workers
+    and answers with the results in json. /status
+    returns the content of the cache.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config, port=0, workers=1):
+        HTTPServer.__init__(self, ('127.0.0.1', port), ToolkitHandler)
+        self.config = config
+        self.cache = ResidentCache()
+        self.pool = ThreadPool(workers)
+
+    def run(self, overrides):
+        """
+        Run the base config updated with the overrides,
+        the files written by the run are set by the base
+        config only
+        """
+
+        pinned = sorted(key for key in SERVER_SIDE_KEYS if key in overrides)
+        if pinned:
+            raise ValueError('Server side config keys: %s' %
+                    ', '.join(pinned))
+        return self.pool.apply(run_config,
+                (merge(self.config, overrides), self.cache))
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+
+class ToolkitHandler(BaseHTTPRequestHandler):
+    """Handle the requests of a ToolkitServer"""
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._reply(200, self.server.cache.status())
+        else:
+            self._reply(404, {'error': 'Unknown path: %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/run':
+            self._reply(404, {'error': 'Unknown path: %s' % self.path})
+            return
+        try:
+            overrides = json.loads(self.rfile.read(
+                int(self.headers.get('Content-Length', 0))) or '{}')
+            if not isinstance(overrides, dict):
+                raise ValueError('The config must be a json object')
+            results = self.server.run(overrides)
+        except Exception as error:
+            logging.getLogger('mt_logger').exception('Failed run')
+            self._reply(400, {'error': '%s: %s' % (
+                type(error).__name__, error)})
+        else:
+            self._reply(200, results)
+
+    def _reply(self, code, body):
+        """Send a json response"""
+
+        content = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logging.getLogger('mt_logger').debug(format % args)
+
+
+def serve(config, port, workers=1):
+    """Serve the base config on localhost until interrupted"""
+
+    server = ToolkitServer(config, port, workers)
+    logging.getLogger('mt_logger').info('Serving on 127.0.0.1:%s' %
+            server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
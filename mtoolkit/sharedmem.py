@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+
+"""
+The purpose of this module is to provide functions
+to share read only numpy arrays with the worker
+processes of a pool without pickling them: arrays
+are copied once in shared memory and the workers
+attach numpy views to it. The arrays of a context
+are shared through memory mapped files, so that
+any process can attach them (not only the ones
+forked after sharing).
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from mtoolkit.catalogue_utilities import CatalogueMatrix
+
+
+def share(array):
+    """
+    Copy a numpy array in shared memory, return the shared
+    buffer along with the dtype and shape of the array
+    """
+
+    array = np.ascontiguousarray(array)
+    buf = RawArray('c', max(1, array.nbytes))
+    np.frombuffer(buf, dtype=np.uint8, count=array.nbytes)[:] = \
+            array.view(np.uint8).ravel()
+    return buf, array.dtype.str, array.shape
+
+
+def attach(shared):
+    """Return a numpy view of an array shared by share"""
+
+    buf, dtype, shape = shared
+    return np.frombuffer(buf, dtype=dtype,
+            count=int(np.prod(shape))).reshape(shape)
+
+
+# Directory of the memory mapped files of the context
+# stores, in shared memory when available (Linux)
+SHM_DIR = '/dev/shm'
+
+
+class ContextStore(object):
+    """
+    ContextStore shares the numpy arrays of a context (e.g.
+    catalog_matrix, vcl, flag_vector) with worker processes
+    through memory mapped files: the workers attach read only,
+    zero copy views of the files given by a handle, which is
+    small to pickle. An array is written again only when it
+    is replaced or changed in place (its checksum changes),
+    the file of the replaced array is removed. The files are
+    written on first use and removed by close.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None and os.path.isdir(SHM_DIR):
+            directory = SHM_DIR
+        self.parent = directory
+        self.directory = None
+        # Shared array, its checksum and its file
+        # for every context attribute
+        self.arrays = {}
+
+    def share(self, arrays):
+        """
+        Share the given arrays (a dict of context attribute
+        names to arrays), arrays already shared and not
+        changed are not written again, return the handle
+        of the arrays
+        """
+
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='mtoolkit-context-',
+                    dir=self.parent)
+        handle = {}
+        for name, array in arrays.iteritems():
+            digest = _checksum(array)
+            shared, shared_digest, _ = self.arrays.get(name,
+                    (None, None, None))
+            if shared is not array or shared_digest != digest:
+                self._update(name, array, digest)
+            handle[name] = (self.arrays[name][2],
+                    getattr(array, 'columns', None))
+        return handle
+
+    def _update(self, name, array, digest):
+        """Share a new or changed array of a context attribute"""
+
+        # The same array (e.g. catalog_matrix and vmain_shock)
+        # is written once, its other names get the new file
+        path = None
+        for shared, shared_digest, shared_path in self.arrays.values():
+            if shared is array and shared_digest == digest:
+                path = shared_path
+        if path is None:
+            path = self._write(array)
+        old_paths = set()
+        for other, (shared, _, shared_path) in self.arrays.items():
+            if shared is array or other == name:
+                old_paths.add(shared_path)
+                self.arrays[other] = (array, digest, path)
+        self.arrays[name] = (array, digest, path)
+        for old_path in old_paths.difference([shared_path for
+                _, _, shared_path in self.arrays.values()]):
+            os.remove(old_path)
+
+    def _write(self, array):
+        """Write an array in a new file of the store, return its path"""
+
+        handle, path = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+        os.close(handle)
+        mapped = np.lib.format.open_memmap(path, mode='w+',
+                dtype=np.asarray(array).dtype, shape=np.shape(array))
+        mapped[...] = array
+        mapped.flush()
+        del mapped
+        return path
+
+    def close(self):
+        """Remove the files of the store"""
+
+        self.arrays.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+def _checksum(array):
+    """Return the checksum of the data, dtype and shape of an array"""
+
+    array = np.ascontiguousarray(array)
+    return hashlib.sha1(array.view(np.uint8).ravel().data).hexdigest() + \
+            array.dtype.str + str(array.shape)
+
+
+def attach_arrays(handle):
+    """
+    Return a dict of read only views of the arrays shared
+    by a ContextStore, catalogue matrices keep their columns
+    """
+
+    arrays = {}
+    for name, (path, columns) in handle.iteritems():
+        array = np.load(path, mmap_mode='r')
+        if columns is not None:
+            array = CatalogueMatrix(array, columns)
+        arrays[name] = array
+    return arrays
@@ -418,3 +418,282 @@ class NRMLReader(object):
         sp_node.clear()
 
         return simple_point
+
+
+def _text(values):
+    """Return the nrml text of a float or of a list of floats"""
+
+    if isinstance(values, (list, tuple)):
+        return ' '.join([repr(float(value)) for value in values])
+    return repr(float(values))
+
+
+def _sub_element(parent, tag, text=None, attrib=None):
+    """Append to parent a new element, return it"""
+
+    element = etree.SubElement(parent, tag, attrib or {})
+    if text is not None:
+        element.text = text
+    return element
+
+
+class _ValidatingOutput(object):
+    """
+    File like object which writes data to a file
+    and, at the same time, feeds it to a parser
+    validating against a schema. Completed source
+    elements are released as soon as they are
+    validated, so memory stays bounded.
+    """
+
+    def __init__(self, output_file, schema):
+        self.output_file = output_file
+        self.parser = etree.XMLPullParser(events=('end',),
+                schema=utils.compiled_schema(schema))
+
+    def write(self, data):
+        """Write data to the file and validate it"""
+
+        self.output_file.write(data)
+        self.parser.feed(data)
+        for _, element in self.parser.read_events():
+            if element.tag in NRMLWriter.SOURCE_TAGS:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    def close(self):
+        """Terminate the validation"""
+
+        self.parser.close()
+
+
+class NRMLWriter(object):
+    """
+    NRMLWriter allows to write source models (SM),
+    given in the dict data structure provided by
+    NRMLReader, in a nrml file. Source models are
+    serialized one at a time as soon as they are
+    given, using incremental xml generation, and
+    optionally validated against a schema during
+    the same pass.
+    """
+
+    SOURCE_TAGS = (utils.AREA_SOURCE, utils.SIMPLE_FAULT_SOURCE,
+            utils.COMPLEX_FAULT_SOURCE, utils.SIMPLE_POINT_SOURCE)
+
+    NSMAP = {None: utils.NRML_NS, 'gml': utils.GML_NS,
+            'qml': utils.QUAKEML_NS}
+
+    def __init__(self, filename, schema=None, nrml_id='n1'):
+        self.filename = filename
+        self.schema = schema
+        self.nrml_id = nrml_id
+        self.type_action = {'area_source': self._build_area_source,
+            'simple_fault': self._build_simple_fault,
+            'complex_fault': self._build_complex_fault,
+            'simple_point': self._build_simple_point}
+        self._output_file = None
+        self._output = None
+        self._xml_file = None
+        self._contexts = []
+        self._sm_started = False
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+
+    def open(self):
+        """Start the nrml document"""
+
+        self._output_file = open(self.filename, 'wb')
+        self._output = self._output_file
+        if self.schema is not None:
+            self._output = _ValidatingOutput(self._output_file,
+                    self.schema)
+        self._xml_file = self._enter(etree.xmlfile(self._output,
+                encoding='UTF-8'))
+        self._xml_file.write_declaration()
+        self._enter(self._xml_file.element(utils.NRML_ROOT,
+                {utils.GML_ID: self.nrml_id}, nsmap=self.NSMAP))
+
+    def _enter(self, context):
+        """Enter an xml generation context, return its value"""
+
+        value = context.__enter__()
+        self._contexts.append(context)
+        return value
+
+    def serialize(self, sm):
+        """Write a SM definition in the nrml document"""
+
+        if not self._sm_started:
+            self._enter(self._xml_file.element(utils.SOURCE_MODEL,
+                    {utils.GML_ID: sm.get('id_sm', 'sm1')}))
+            self._xml_file.write(etree.Element(utils.CONFIG))
+            self._sm_started = True
+        self._xml_file.write(self.type_action[sm['type']](sm))
+        self._xml_file.flush()
+
+    def close(self, complete=True):
+        """
+        Terminate the nrml document, raise
+        XMLValidationError if the written
+        document does not conform to the schema.
+        """
+
+        if self._output_file is None:
+            return
+        try:
+            while self._contexts:
+                self._contexts.pop().__exit__(None, None, None)
+            if complete and self._output is not self._output_file:
+                try:
+                    self._output.close()
+                except etree.XMLSyntaxError, error:
+                    raise utils.XMLValidationError(self.filename,
+                            str(error))
+        finally:
+            self._output_file.close()
+            self._output_file = None
+            self._sm_started = False
+
+    def _build_area_source(self, area_source):
+        """Return the element of an area source"""
+
+        as_node = etree.Element(utils.AREA_SOURCE,
+                {utils.GML_ID: area_source['id_as']})
+        _sub_element(as_node, utils.GML_NAME, area_source['name'])
+        _sub_element(as_node, utils.TECTONIC_REGION,
+                area_source['tectonic_region'])
+        ring = _sub_element(_sub_element(_sub_element(
+                _sub_element(as_node, utils.AREA_BOUNDARY),
+                utils.GML_POLYGON), utils.GML_EXTERIOR),
+                utils.GML_LINEAR_RING)
+        _sub_element(ring, utils.POS_LIST,
+                _text(area_source['area_boundary']))
+        self._build_rupture_rate_model(as_node,
+                area_source['rupture_rate_model'])
+        self._build_rupture_depth_distrib(as_node,
+                area_source['rupture_depth_distribution'])
+        _sub_element(as_node, utils.HYPOCENTRAL_DEPTH,
+                _text(area_source['hypocentral_depth']))
+        return as_node
+
+    def _build_truncated_guten_richter(self, parent, tgr):
+        """Append a truncated gutenberg richter element to parent"""
+
+        tgr_node = _sub_element(parent, utils.TRUNCATED_GUTEN_RICHTER)
+        _sub_element(tgr_node, utils.A_VALUE_CUMULATIVE,
+                _text(tgr['a_value_cumulative']))
+        _sub_element(tgr_node, utils.B_VALUE, _text(tgr['b_value']))
+        _sub_element(tgr_node, utils.MIN_MAGNITUDE,
+                _text(tgr['min_magnitude']))
+        _sub_element(tgr_node, utils.MAX_MAGNITUDE,
+                _text(tgr['max_magnitude']))
+
+    def _build_focal_mechanism(self, parent, focal_mechanism):
+        """Append a focal mechanism element to parent"""
+
+        fm_node = _sub_element(parent, utils.FOCAL_MECHANISM,
+                attrib={utils.FM_ID_ATTR: focal_mechanism['id']})
+        nodal_planes = _sub_element(fm_node, utils.NODAL_PLANES)
+        for nodal_plane in focal_mechanism['nodal_planes']:
+            np_node = _sub_element(nodal_planes,
+                    utils.NODAL_PLANE % (nodal_plane['id'] + 1))
+            for tag, key in ((utils.NODAL_PLANE_STRIKE, 'strike'),
+                    (utils.NODAL_PLANE_DIP, 'dip'),
+                    (utils.NODAL_PLANE_RAKE, 'rake')):
+                _sub_element(_sub_element(np_node, tag),
+                        utils.NODAL_PLANE_VALUE, _text(nodal_plane[key]))
+
+    def _build_rupture_rate_model(self, parent, rupture_rate_model):
+        """Append a rupture rate model element to parent"""
+
+        rrm_node = _sub_element(parent, utils.RUPTURE_RATE_MODEL)
+        for rrm_entry in rupture_rate_model:
+            if rrm_entry['name'] == 'truncated_guten_richter':
+                self._build_truncated_guten_richter(rrm_node, rrm_entry)
+            else:
+                self._build_focal_mechanism(rrm_node, rrm_entry)
+
+    def _build_rupture_depth_distrib(self, parent, rdd):
+        """Append a rupture depth distribution element to parent"""
+
+        rdd_node = _sub_element(parent, utils.RUPTURE_DEPTH_DISTRIB)
+        _sub_element(rdd_node, utils.MAGNITUDE, _text(rdd['magnitude']))
+        _sub_element(rdd_node, utils.DEPTH, _text(rdd['depth']))
+
+    def _build_simple_fault(self, simple_fault):
+        """Return the element of a simple fault source"""
+
+        sf_node = etree.Element(utils.SIMPLE_FAULT_SOURCE,
+                {utils.GML_ID: simple_fault['id_sf']})
+        _sub_element(sf_node, utils.GML_NAME, simple_fault['name'])
+        _sub_element(sf_node, utils.TECTONIC_REGION,
+                simple_fault['tectonic_region'])
+        _sub_element(sf_node, utils.RAKE, _text(simple_fault['rake']))
+        self._build_truncated_guten_richter(sf_node,
+                simple_fault['truncated_guten_richter'])
+
+        geometry = simple_fault['geometry']
+        geo_node = _sub_element(sf_node, utils.SIMPLE_FAULT_GEOMETRY,
+                attrib={utils.GML_ID: geometry['id_geo']})
+        _sub_element(_sub_element(_sub_element(geo_node, utils.FAULT_TRACE),
+                utils.GML_LINE_STRING), utils.POS_LIST,
+                _text(geometry['fault_trace_pos_list']))
+        _sub_element(geo_node, utils.DIP, _text(geometry['dip']))
+        _sub_element(geo_node, utils.UPPER_SEISMOGENIC_DEPTH,
+                _text(geometry['upper_seismogenic_depth']))
+        _sub_element(geo_node, utils.LOWER_SEISMOGENIC_DEPTH,
+                _text(geometry['lower_seismogenic_depth']))
+        return sf_node
+
+    def _build_complex_fault(self, complex_fault):
+        """Return the element of a complex fault source"""
+
+        cf_node = etree.Element(utils.COMPLEX_FAULT_SOURCE,
+                {utils.GML_ID: complex_fault['id_cf']})
+        _sub_element(cf_node, utils.GML_NAME, complex_fault['name'])
+        _sub_element(cf_node, utils.TECTONIC_REGION,
+                complex_fault['tectonic_region'])
+        _sub_element(cf_node, utils.RAKE, _text(complex_fault['rake']))
+
+        mfd = complex_fault['evenly_discretized_inc_MFD']
+        _sub_element(cf_node, utils.EVENLY_DISCRETIZED_INC_MFD,
+                _text(mfd['values']), {utils.BIN_SIZE: _text(mfd['bin_size']),
+                    utils.MIN_VAL: _text(mfd['min_val'])})
+
+        fault_top_edge, fault_bottom_edge = complex_fault['geometry']
+        edges = _sub_element(_sub_element(cf_node,
+                utils.COMPLEX_FAULT_GEOMETRY), utils.FAULT_EDGES)
+        for tag, edge in ((utils.FAULT_TOP_EDGE, fault_top_edge),
+                (utils.FAULT_BOTTOM_EDGE, fault_bottom_edge)):
+            _sub_element(_sub_element(_sub_element(edges, tag),
+                    utils.GML_LINE_STRING), utils.POS_LIST, _text(edge))
+        return cf_node
+
+    def _build_simple_point(self, simple_point):
+        """Return the element of a simple point source"""
+
+        sp_node = etree.Element(utils.SIMPLE_POINT_SOURCE,
+                {utils.GML_ID: simple_point['id_sp']})
+        _sub_element(sp_node, utils.GML_NAME, simple_point['name'])
+        _sub_element(sp_node, utils.TECTONIC_REGION,
+                simple_point['tectonic_region'])
+
+        location = simple_point['location']
+        point = _sub_element(_sub_element(sp_node, utils.LOCATION),
+                utils.POINT, attrib={utils.SRS_NAME: location['srs_name']})
+        _sub_element(point, utils.POS, _text(location['pos']))
+
+        self._build_rupture_rate_model(sp_node,
+                simple_point['rupture_rate_model'])
+        self._build_rupture_depth_distrib(sp_node,
+                simple_point['rupture_depth_distribution'])
+        _sub_element(sp_node, utils.HYPOCENTRAL_DEPTH,
+                _text(simple_point['hypocentral_depth']))
+        return sp_node
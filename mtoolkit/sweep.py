@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+"""
+The purpose of this module is to provide objects to
+run a base configuration with every combination of a
+grid of overrides (a parameter sweep). The pipelines
+of all the combinations are merged in a tree, so the
+jobs shared by several combinations run once, and the
+branches of the tree run in parallel.
+"""
+
+import csv
+import copy
+import itertools
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import yaml
+import numpy as np
+
+from mtoolkit.workflow import PipeLineBuilder, Context
+
+
+# Config keys of the files written by the pipeline,
+# a sweep writes the results table only
+OUTPUT_FILES = ('pprocessing_result_file', 'result_file')
+
+
+def override(config, key, value):
+    """
+    Return a copy of config where the value of a key,
+    given by its dotted path (e.g. Stepp.time_window),
+    is replaced
+    """
+
+    config = copy.deepcopy(config)
+    section = config
+    names = key.split('.')
+    for name in names[:-1]:
+        if not isinstance(section.get(name), dict):
+            section[name] = {}
+        section = section[name]
+    section[names[-1]] = value
+    return config
+
+
+def combinations(parameters):
+    """
+    Return the list of the combinations of the values
+    of the parameters, each one as a list of (dotted
+    key, value index) pairs sorted by key
+    """
+
+    keys = sorted(parameters)
+    return [zip(keys, indices) for indices in itertools.product(
+        *[range(len(parameters[key])) for key in keys])]
+
+
+class SweepNode(object):
+    """
+    SweepNode is a job of the sweep tree along with the
+    config it runs with, the combinations ending at it
+    and the nodes of the following jobs
+    """
+
+    def __init__(self, job, config, catalog_columns):
+        self.job = job
+        self.config = config
+        self.catalog_columns = catalog_columns
+        self.children = OrderedDict()
+        self.combinations = []
+
+    def run(self, context):
+        """
+        Run the job and the subtree, return the results
+        rows of the combinations ending in the subtree
+        """
+
+        context.config = self.config
+        context.catalog_columns = self.catalog_columns
+        self.job(context)
+        return _run_children(self, context)
+
+
+def copy_context(context):
+    """
+    Return a copy of a context for a branch of the sweep:
+    numpy arrays are shared, as jobs replace them instead
+    of changing them, eq entries are copied (they hold
+    scalar values) and any other value is deep copied
+    """
+
+    branch_context = copy.copy(context)
+    memo = {}
+    for name, value in vars(context).items():
+        if name == 'eq_catalog':
+            value = [dict(eq_entry) for eq_entry in value]
+        elif name == 'map_sc':
+            value = copy.copy(value)
+        elif not isinstance(value, np.ndarray):
+            value = copy.deepcopy(value, memo)
+        setattr(branch_context, name, value)
+    return branch_context
+
+
+def _run_children(node, context):
+    """
+    Run the children of a node, every child but the
+    last one works on a copy of the context
+    """
+
+    rows = [(combination, sweep_results(context))
+            for combination in node.combinations]
+    children = node.children.values()
+    for i, child in enumerate(children):
+        child_context = context if i == len(children) - 1 else \
+                copy_context(context)
+        rows.extend(child.run(child_context))
+    return rows
+
+
+class Sweep(object):
+    """
+    Sweep builds the tree of the pipelines of the
+    combinations of a base config and a grid of
+    overrides, given as a dict of lists of values
+    keyed by the dotted path of the overridden key.
+    A job depends on the overrides of its step config
+    section and of the sections it declares reading
+    (uses_config): combinations only differing by the
+    overrides of later steps share it. Any other
+    override (e.g. eq_catalog_file) splits the tree
+    at the first job.
+    """
+
+    def __init__(self, config, parameters, name='sweep'):
+        self.parameters = parameters
+        self.builder = PipeLineBuilder(name)
+        self.root = SweepNode(None, None, None)
+        step_names = dict((job, step) for step, job in
+                self.builder.map_step_callable.items())
+        for combination in combinations(parameters):
+            combination_config = config
+            for key, index in combination:
+                combination_config = override(combination_config, key,
+                        parameters[key][index])
+            for key in OUTPUT_FILES:
+                combination_config[key] = None
+            pipeline = self.builder.build(combination_config)
+
+            node = self.root
+            for position, job in enumerate(pipeline.jobs):
+                # Overrides of the config sections read by the
+                # job, and of the global keys for the first job
+                sections = (step_names.get(job), ) + \
+                        tuple(getattr(job, 'config_sections', ()))
+                signature = (position, job, tuple(
+                    (key, index) for key, index in combination
+                    if key.split('.')[0] in sections or
+                    (position == 0 and key.split('.')[0] not in
+                        self.builder.map_step_callable)))
+                if signature not in node.children:
+                    node.children[signature] = SweepNode(job,
+                            combination_config, pipeline.catalog_columns)
+                node = node.children[signature]
+            node.combinations.append(combination)
+
+    def nodes(self):
+        """Return the number of jobs run by the sweep"""
+
+        pending = [self.root]
+        count = -1
+        while pending:
+            node = pending.pop()
+            count += 1
+            pending.extend(node.children.values())
+        return count
+
+    def run(self, context, processes=1):
+        """
+        Run the sweep on the given context, return the
+        results rows sorted by combination. The branches
+        below the first job shared by all the combinations
+        run in parallel when processes > 1.
+        """
+
+        # Run the jobs shared by all the combinations
+        node = self.root
+        while len(node.children) == 1 and not node.combinations:
+            node = node.children.values()[0]
+            context.config = node.config
+            context.catalog_columns = node.catalog_columns
+            node.job(context)
+
+        if processes > 1 and len(node.children) > 1:
+            _SWEEP['node'] = node
+            _SWEEP['context'] = context
+            pool = Pool(processes)
+            try:
+                rows = [(combination, sweep_results(context))
+                        for combination in node.combinations]
+                for branch_rows in pool.map(_run_branch,
+                        range(len(node.children))):
+                    rows.extend(branch_rows)
+            finally:
+                pool.close()
+                pool.join()
+                _SWEEP.clear()
+        else:
+            rows = _run_children(node, context)
+        return sorted(rows)
+
+    def write(self, filename, rows):
+        """Write the results table, one row per combination"""
+
+        keys = sorted(self.parameters)
+        with open(filename, 'wb') as csv_file:
+            writer = csv.writer(csv_file, lineterminator='\n')
+            result_names = rows[0][1].keys() if rows else []
+            writer.writerow(keys + result_names)
+            for combination, results in rows:
+                writer.writerow([_format_parameter(
+                    self.parameters[key][index])
+                    for key, index in combination] + results.values())
+
+
+# Branching node and its context, inherited by the
+# worker processes running the branches
+_SWEEP = {}
+
+
+def _run_branch(index):
+    """Run a branch of the sweep tree in a worker process"""
+
+    # A worker may run several branches, each one
+    # starts from the context of the branching node
+    context = copy_context(_SWEEP['context'])
+    return _SWEEP['node'].children.values()[index].run(context)
+
+
+def _format_parameter(value):
+    """Return the text of a parameter value in the results table"""
+
+    if isinstance(value, (list, dict)):
+        return repr(value)
+    return value
+
+
+def sweep_results(context):
+    """
+    Return the results of a combination: number of
+    events and of mainshocks, completeness table and
+    b-values of the source models
+    """
+
+    results = OrderedDict()
+    results['events'] = len(context.eq_catalog)
+    results['mainshocks'] = len(context.catalog_matrix)
+    completeness_table = getattr(context, 'completeness_table', None)
+    results['completeness_table'] = '' if completeness_table is None \
+            else ';'.join('%g:%g' % (magnitude, year)
+                    for magnitude, year in completeness_table)
+    b_values = []
+    for sm in getattr(context, 'sm_definitions', []):
+        for rrm_entry in sm.get('rupture_rate_model', []):
+            if rrm_entry.get('name') == 'truncated_guten_richter':
+                b_values.append('%s:%s' % (sm.get('name'),
+                    rrm_entry.get('b_value')))
+    results['b_values'] = ';'.join(b_values)
+    return results
+
+
+def read_sweep_config(filename):
+    """Return the sweep config read from a yaml file"""
+
+    with open(filename, 'r') as sweep_file:
+        return yaml.load(sweep_file)
+
+
+def run_sweep(config, sweep_config):
+    """
+    Run the sweep defined by a sweep config (parameters,
+    processes, result_file) on a base config, write the
+    results table and return the results rows
+    """
+
+    sweep = Sweep(config, sweep_config['parameters'])
+    rows = sweep.run(Context(config=config),
+            sweep_config.get('processes') or 1)
+    sweep.write(sweep_config.get('result_file') or 'sweep_results.csv',
+            rows)
+    return rows
@@ -25,7 +25,7 @@ nrml schema path.
 """
 
 import os
-from lxml import etree
+import threading
 
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -49,6 +49,10 @@ NRML = "{%s}" % NRML_NS
 GML = "{%s}" % GML_NS
 QUAKEML = "{%s}" % QUAKEML_NS
 
+NRML_ROOT = "%snrml" % NRML
+SOURCE_MODEL = "%ssourceModel" % NRML
+CONFIG = "%sconfig" % NRML
+
 AREA_SOURCE = "%sareaSource" % NRML
 GML_ID = "%sid" % GML
 GML_NAME = "%sname" % GML
@@ -56,6 +60,10 @@ TECTONIC_REGION = "%stectonicRegion" % NRML
 
 AREA_BOUNDARY = "%sareaBoundary" % NRML
 POS_LIST = "%sposList" % GML
+GML_POLYGON = "%sPolygon" % GML
+GML_EXTERIOR = "%sexterior" % GML
+GML_LINEAR_RING = "%sLinearRing" % GML
+GML_LINE_STRING = "%sLineString" % GML
 
 TRUNCATED_GUTEN_RICHTER = "%struncatedGutenbergRichter" % NRML
 
@@ -67,6 +75,8 @@ MAX_MAGNITUDE = "%smaxMagnitude" % NRML
 FOCAL_MECHANISM = "%sfocalMechanism" % NRML
 FM_ID_ATTR = "publicID"
 NODAL_PLANES = "%snodalPlanes" % QUAKEML
+NODAL_PLANE = "%snodalPlane%%d" % QUAKEML
+NODAL_PLANE_VALUE = "%svalue" % QUAKEML
 NODAL_PLANE_STRIKE = "%sstrike" % QUAKEML
 NODAL_PLANE_DIP = "%sdip" % QUAKEML
 NODAL_PLANE_RAKE = "%srake" % QUAKEML
@@ -82,6 +92,7 @@ SIMPLE_FAULT_SOURCE = "%ssimpleFaultSource" % NRML
 RAKE = "%srake" % NRML
 DIP = "%sdip" % NRML
 SIMPLE_FAULT_GEOMETRY = "%ssimpleFaultGeometry" % NRML
+FAULT_TRACE = "%sfaultTrace" % NRML
 UPPER_SEISMOGENIC_DEPTH = "%supperSeismogenicDepth" % NRML
 LOWER_SEISMOGENIC_DEPTH = "%slowerSeismogenicDepth" % NRML
 
@@ -90,6 +101,7 @@ EVENLY_DISCRETIZED_INC_MFD = "%sevenlyDiscretizedIncrementalMFD" % NRML
 BIN_SIZE = "binSize"
 MIN_VAL = "minVal"
 COMPLEX_FAULT_GEOMETRY = "%scomplexFaultGeometry" % NRML
+FAULT_EDGES = "%sfaultEdges" % NRML
 FAULT_TOP_EDGE = "%sfaultTopEdge" % NRML
 FAULT_BOTTOM_EDGE = "%sfaultBottomEdge" % NRML
 
@@ -111,11 +123,33 @@ class XMLValidationError(Exception):
         self.message = message
 
 
+# Compiled schemas of every thread, lxml
+# schemas are not shared between threads
+_SCHEMAS = threading.local()
+
+
+def compiled_schema(schema_path):
+    """
+    Return the compiled xml schema of a schema file,
+    compiled once per thread and file modification
+    """
+
+    from lxml import etree
+
+    if not hasattr(_SCHEMAS, 'schemas'):
+        _SCHEMAS.schemas = {}
+    key = (os.path.abspath(schema_path), os.path.getmtime(schema_path))
+    if key not in _SCHEMAS.schemas:
+        _SCHEMAS.schemas[key] = etree.XMLSchema(etree.parse(schema_path))
+    return _SCHEMAS.schemas[key]
+
+
 def valid_schema(source_model_path, schema_path):
     """Check if the xml is conform to the schema provided"""
+    from lxml import etree
+
     xml_doc = etree.parse(source_model_path)
-    xmlschema = etree.XMLSchema(etree.parse(schema_path))
-    return xmlschema.validate(xml_doc)
+    return compiled_schema(schema_path).validate(xml_doc)
 
 
 def get_data_path(filename, dirname):
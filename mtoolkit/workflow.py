@@ -23,13 +23,56 @@ to process a series of jobs in a predetermined
 order. The order is determined by the queue of jobs.
 """
 
+import importlib
+
 import yaml
+import numpy as np
 
 from mtoolkit.jobs import read_eq_catalog, gardner_knopoff, stepp, \
-create_catalog_matrix
+create_catalog_matrix, read_source_model, recurrence, write_source_model, \
+reasenberg, stochastic_declustering, magnitude_homogenisation, \
+duplicate_removal, write_pprocessing_result, gridded_stepp, source_stepp, \
+completeness_filter
+
+from mtoolkit.catalogue_utilities import CatalogueIndex
+
+
+# Scientific callables used by the jobs
+# with the module and name defining them
+SCIENTIFIC_CALLABLES = {
+    'gardner_knopoff': 'mtoolkit.declustering.gardner_knopoff_decluster',
+    'gardner_knopoff_append': 'mtoolkit.declustering.gardner_knopoff_append',
+    'reasenberg': 'mtoolkit.declustering.reasenberg_decluster',
+    'stochastic_decluster': 'mtoolkit.declustering.stochastic_decluster',
+    'homogenise': 'mtoolkit.homogenisation.homogenise',
+    'find_duplicates': 'mtoolkit.duplicates.find_duplicates',
+    'stepp': 'mtoolkit.completeness.stepp_analysis',
+    'gridded_stepp': 'mtoolkit.completeness.gridded_completeness',
+    'grouped_stepp': 'mtoolkit.completeness.grouped_stepp_analysis',
+    'weichert': 'mtoolkit.recurrence.weichert',
+    'aki_utsu': 'mtoolkit.recurrence.aki_utsu',
+    'bootstrap': 'mtoolkit.recurrence.bootstrap'}
+
+
+class CallableMap(dict):
+    """
+    CallableMap maps names to callables given by their
+    dotted path, every callable is imported when first
+    used and can be replaced by assignment (e.g. by a mock)
+    """
 
-from mtoolkit.declustering import gardner_knopoff_decluster
-from mtoolkit.completeness import stepp_analysis
+    def __init__(self, paths):
+        dict.__init__(self)
+        self.paths = dict(paths)
+
+    def __missing__(self, name):
+        module_name, _, callable_name = self.paths[name].rpartition('.')
+        value = getattr(importlib.import_module(module_name), callable_name)
+        self[name] = value
+        return value
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.paths
 
 
 class PipeLine(object):
@@ -41,21 +84,30 @@ class PipeLine(object):
     def __init__(self, name):
         """
         Initialize a PipeLine object having
-        attributes: name and jobs, a list
-        of callable objects.
+        attributes: name, jobs, a list
+        of callable objects, and catalog_columns,
+        the catalog matrix columns used by the jobs.
         """
 
         self.name = name
         self.jobs = []
+        self.catalog_columns = {}
 
     def __eq__(self, other):
         return self.name == other.name \
                 and self.jobs == other.jobs
 
     def add_job(self, a_job):
-        """Append a new job the to queue"""
+        """
+        Append a new job the to queue, collecting the
+        catalog matrix columns it uses at the widest
+        dtype required by the jobs
+        """
 
         self.jobs.append(a_job)
+        for name, dtype in getattr(a_job, 'catalog_columns', {}).iteritems():
+            self.catalog_columns[name] = np.promote_types(
+                    self.catalog_columns.get(name, dtype), dtype).name
 
     def run(self, context):
         """
@@ -66,10 +118,24 @@ class PipeLine(object):
         If logging is triggered by cmdline
         each job is decorated by adding
         logging statements.
+        The catalog matrix is created with
+        the columns used by the jobs.
+        The context arrays shared with worker
+        processes while the jobs run are removed
+        when the pipeline ends.
         """
 
-        for job in self.jobs:
-            job(context)
+        from mtoolkit.sharedmem import ContextStore
+
+        context.catalog_columns = self.catalog_columns
+        context.shared_store = ContextStore(
+                context.config.get('shared_directory'))
+        try:
+            for job in self.jobs:
+                job(context)
+        finally:
+            context.shared_store.close()
+            context.shared_store = None
 
 
 class PipeLineBuilder(object):
@@ -81,8 +147,22 @@ class PipeLineBuilder(object):
 
     def __init__(self, name):
         self.name = name
-        self.map_step_callable = {'GardnerKnopoff': gardner_knopoff,
-                                  'Stepp': stepp}
+        self.map_step_callable = {'MagnitudeHomogenisation':
+                                        magnitude_homogenisation,
+                                  'DuplicateRemoval': duplicate_removal,
+                                  'GardnerKnopoff': gardner_knopoff,
+                                  'Reasenberg': reasenberg,
+                                  'StochasticDeclustering':
+                                        stochastic_declustering,
+                                  'Stepp': stepp,
+                                  'GriddedStepp': gridded_stepp,
+                                  'SourceStepp': source_stepp,
+                                  'CompletenessFilter': completeness_filter,
+                                  'Recurrence': recurrence}
+        # Steps working on the eq catalog entries, they
+        # run before the catalog matrix is created
+        self.eq_catalog_steps = ['MagnitudeHomogenisation',
+                                 'DuplicateRemoval']
 
     def build(self, config):
         """
@@ -95,13 +175,29 @@ class PipeLineBuilder(object):
 
         pipeline = PipeLine(self.name)
         pipeline.add_job(read_eq_catalog)
+        steps = config['preprocessing_steps']
+        self._add_steps(pipeline, [step for step in steps
+                if step in self.eq_catalog_steps])
         pipeline.add_job(create_catalog_matrix)
-        for step in config['preprocessing_steps']:
+        self._add_steps(pipeline, [step for step in steps
+                if step not in self.eq_catalog_steps])
+        if config.get('pprocessing_result_file'):
+            pipeline.add_job(write_pprocessing_result)
+        if config.get('apply_processing_steps'):
+            pipeline.add_job(read_source_model)
+            self._add_steps(pipeline, config['processing_steps'])
+            if config.get('result_file'):
+                pipeline.add_job(write_source_model)
+        return pipeline
+
+    def _add_steps(self, pipeline, steps):
+        """Add to the pipeline the jobs of the given steps"""
+
+        for step in steps:
             try:
                 pipeline.add_job(self.map_step_callable[step])
             except KeyError:
                 raise RuntimeError('Invalid step: %s' % step)
-        return pipeline
 
 
 class Context(object):
@@ -111,8 +207,47 @@ class Context(object):
     intermediate results.
     """
 
-    def __init__(self, config_filename):
-        config_file = open(config_filename, 'r')
-        self.config = yaml.load(config_file)
-        self.map_sc = {'gardner_knopoff': gardner_knopoff_decluster,
-                        'stepp': stepp_analysis}
+    def __init__(self, config_filename=None, config=None):
+        """
+        The config is read from the config file
+        or given as a dict (e.g. by a sweep)
+        """
+
+        if config is None:
+            with open(config_filename, 'r') as config_file:
+                config = yaml.load(config_file)
+        self.config = config
+        self.map_sc = CallableMap(SCIENTIFIC_CALLABLES)
+        self._catalog_index = None
+        self.shared_store = None
+
+    def shared_arrays(self, *names):
+        """
+        Return the handle of the given context arrays
+        shared with worker processes, which attach them
+        by mtoolkit.sharedmem.attach_arrays. Arrays are
+        shared while a pipeline runs the context.
+        """
+
+        if self.shared_store is None:
+            raise RuntimeError('Context arrays are shared only '
+                    'while a pipeline runs')
+        return self.shared_store.share(dict((name, getattr(self, name))
+            for name in names))
+
+    @property
+    def catalog_index(self):
+        """
+        Time index of the current catalog matrix, built
+        on first access and whenever a step replaces
+        the catalog matrix (e.g. after declustering).
+        """
+
+        from mtoolkit.declustering import event_time
+
+        matrix = self.catalog_matrix
+        if self._catalog_index is None or \
+                self._catalog_index[0] is not matrix:
+            self._catalog_index = (matrix,
+                    CatalogueIndex(event_time(matrix)))
+        return self._catalog_index[1]
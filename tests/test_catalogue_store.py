@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from mtoolkit.catalogue_store import CatalogueStore, morton_code, \
+region_mask, region_bounds, is_catalogue_store
+from mtoolkit.eqcatalog import EqEntryReader, EqEntryValidationError
+from mtoolkit.utils import get_data_path, DATA_DIR
+
+
+class CatalogueStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.store_dir)
+        self.eq_catalog_file = get_data_path('ISC_correct.csv', DATA_DIR)
+        self.store = CatalogueStore.build(self.eq_catalog_file,
+                self.store_dir)
+        self.eq_entries = list(EqEntryReader(self.eq_catalog_file).read())
+
+    def _inside(self, region):
+        mask = region_mask(region,
+                [eq_entry['longitude'] for eq_entry in self.eq_entries],
+                [eq_entry['latitude'] for eq_entry in self.eq_entries])
+        return [self.eq_entries[i] for i in np.nonzero(mask)[0]]
+
+    def test_read_all_events(self):
+        self.assertTrue(is_catalogue_store(self.store_dir))
+        self.assertEqual(len(self.eq_entries), len(self.store))
+        self.assertEqual(self.eq_entries, self.store.read())
+
+    def test_read_bbox(self):
+        region = {'bbox': [12.0, 40.0, 16.0, 43.0]}
+
+        eq_entries = self.store.read(region)
+
+        self.assertTrue(0 < len(eq_entries) < len(self.eq_entries))
+        self.assertEqual(self._inside(region), eq_entries)
+
+    def test_read_polygon(self):
+        region = {'polygon': [12.0, 40.0, 16.0, 40.0, 16.0, 43.0]}
+
+        eq_entries = self.store.read(region)
+
+        self.assertTrue(0 < len(eq_entries) < len(self.store.read(
+            {'bbox': region_bounds(region)})))
+        self.assertEqual(self._inside(region), eq_entries)
+
+    def test_only_intersecting_tiles_are_read(self):
+        slices = self.store.tile_slices({'bbox': [12.5, 40.5, 12.6, 40.6]})
+
+        self.assertEqual(1, len(slices))
+        self.assertTrue(slices[0].stop - slices[0].start <
+                len(self.store) / 10)
+        self.assertEqual([], self.store.read({'bbox': [-10, -10, -9, -9]}))
+
+    def test_invalid_region(self):
+        self.assertRaises(RuntimeError, self.store.read,
+                {'bbox': [16.0, 40.0, 12.0, 43.0]})
+        self.assertRaises(RuntimeError, self.store.read, {'circle': []})
+
+    def test_missing_mw(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        store = CatalogueStore.build(get_data_path(
+            'homogenisation_input_test.csv', DATA_DIR), store_dir)
+
+        self.assertRaises(EqEntryValidationError, store.read)
+        self.assertTrue('' in [eq_entry['Mw'] for eq_entry in
+            store.read(compulsory_mw=False)])
+
+    def test_morton_code(self):
+        self.assertEqual([0, 1, 2, 3, 12], morton_code([0, 1, 0, 1, 2],
+            [0, 0, 1, 1, 2]).tolist())
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import unittest
+import numpy as np
+
+from mtoolkit.catalogue_utilities import decimal_year, greg2julian, \
+julian2year, event_year, CatalogueIndex, CatalogueMatrix, \
+catalogue_column, column_names, haversine, HAVERSINE_FLOAT32_ERROR
+
+
+class TimeTestCase(unittest.TestCase):
+
+    def test_greg2julian(self):
+        self.assertEqual(2451545.0, greg2julian(2000, 1, 1, 12, 0, 0))
+        self.assertEqual(2400000.5, greg2julian(1858, 11, 17, 0, 0, 0))
+        # 1900 is not a leap year, 2000 is
+        self.assertEqual(1., greg2julian(1900, 3, 1, 0, 0, 0) -
+                greg2julian(1900, 2, 28, 0, 0, 0))
+        self.assertEqual(2., greg2julian(2000, 3, 1, 0, 0, 0) -
+                greg2julian(2000, 2, 28, 0, 0, 0))
+
+    def test_decimal_year(self):
+        self.assertTrue(np.allclose([2001.5, 2000.5],
+                decimal_year(np.array([2001, 2000]), np.array([7, 7]),
+                    np.array([2, 1]), 12, 0, 0.)))
+        self.assertEqual(2000., decimal_year(2000, 1, 1))
+
+    def test_julian2year(self):
+        year = np.array([1, 1582, 1899, 1900, 1999, 2000, 2000, 2100])
+        month = np.array([1, 10, 12, 3, 12, 1, 2, 12])
+        day = np.array([1, 15, 31, 1, 31, 1, 29, 31])
+        for hour, minute, second in [(0, 0, 0.), (23, 59, 59.99)]:
+            self.assertTrue(np.array_equal(year, julian2year(
+                greg2julian(year, month, day, hour, minute, second))))
+
+
+class CatalogueIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.time = np.array([5., 1., 3., 3., 9., 7.])
+        self.index = CatalogueIndex(self.time)
+
+    def test_events_between(self):
+        self.assertEqual(6, len(self.index))
+        self.assertEqual(slice(1, 4), self.index.events_between(3., 5.))
+        self.assertTrue(np.array_equal([2, 3, 0],
+                self.index.events(3., 5.)))
+
+    def test_events_outside_catalogue(self):
+        self.assertEqual(0, len(self.index.events(10., 20.)))
+        self.assertTrue(np.array_equal([1, 2, 3, 0, 5, 4],
+                self.index.events(-1., 20.)))
+
+
+class HaversineTestCase(unittest.TestCase):
+
+    def test_float32_error(self):
+        rnd = np.random.RandomState(11)
+        lon1, lat1 = rnd.uniform(-180., 180., 50), rnd.uniform(-90., 90., 50)
+        lon2, lat2 = rnd.uniform(-180., 180., 60), rnd.uniform(-90., 90., 60)
+
+        expected = haversine(lon1, lat1, lon2, lat2)
+        distance = haversine(lon1, lat1, lon2, lat2, dtype=np.float32)
+
+        self.assertEqual(np.float32, distance.dtype)
+        near = expected < 10000.
+        self.assertTrue(np.all(np.abs(distance - expected)[near] <
+                HAVERSINE_FLOAT32_ERROR))
+
+
+class CatalogueMatrixTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.matrix = CatalogueMatrix(np.arange(12.).reshape(4, 3),
+                ['year', 'Mw', 'time'])
+
+    def test_catalogue_column(self):
+        self.assertTrue(np.array_equal([1., 4., 7., 10.],
+                catalogue_column(self.matrix, 'Mw')))
+        self.assertRaises(ValueError, catalogue_column, self.matrix,
+                'depth')
+
+    def test_rows_keep_column_names(self):
+        self.assertEqual(('year', 'Mw', 'time'),
+                self.matrix[[0, 2]].columns)
+        self.assertEqual(('year', 'Mw', 'time'),
+                self.matrix[1:3].columns)
+        self.assertEqual(('year', 'Mw', 'time'),
+                self.matrix[[0, 2], :].columns)
+
+    def test_selected_columns_get_their_names(self):
+        self.assertEqual(('year', 'Mw'), self.matrix[:, :2].columns)
+        self.assertEqual(('time', 'Mw', 'year'),
+                self.matrix[:, ::-1].columns)
+        self.assertEqual(('time', 'year'), self.matrix[1:, [2, 0]].columns)
+        self.assertTrue(np.array_equal(self.matrix[:, 0],
+                catalogue_column(self.matrix[:, ::-1], 'year')))
+        self.assertEqual(None, self.matrix[..., ::-1].columns)
+
+    def test_event_year(self):
+        time = greg2julian(np.array([1990., 2000.]), 12., 31., 23., 0., 0.)
+        matrix = CatalogueMatrix(np.column_stack(([1., 2.], time)),
+                ['year', 'time'])
+        self.assertTrue(np.array_equal([1990., 2000.], event_year(matrix)))
+        self.assertTrue(np.array_equal([1., 2.], event_year(matrix[:, :1])))
+
+    def test_sample_format(self):
+        matrix = np.zeros((2, 6))
+        self.assertEqual(('year', 'month', 'day', 'longitude', 'latitude',
+                'Mw'), column_names(matrix))
+        self.assertTrue(np.array_equal(matrix[:, 5],
+                catalogue_column(matrix, 'Mw')))
+
+    def test_invalid_number_of_columns_raise_exception(self):
+        self.assertRaises(ValueError, CatalogueMatrix, np.zeros((2, 2)),
+                ['year'])
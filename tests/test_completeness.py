@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import unittest
+import numpy as np
+
+from mtoolkit.completeness import stepp_analysis, SteppAnalyser, \
+grouped_stepp_analysis, gridded_completeness, _stepp_bins, _stepp_table, \
+_magnitude_bins, _round_magnitudes, completeness_flags, cell_groups
+from mtoolkit.workflow import Context
+from mtoolkit.jobs import read_eq_catalog, create_catalog_matrix
+from mtoolkit.catalogue_utilities import catalogue_column, CatalogueIndex
+from mtoolkit.kernels import kernel
+from mtoolkit.utils import get_data_path, DATA_DIR
+
+
+class SteppAnalyserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        context = Context(get_data_path('config.yml', DATA_DIR))
+        context.config['eq_catalog_file'] = get_data_path(
+            'completeness_input_test.csv', DATA_DIR)
+        read_eq_catalog(context)
+        create_catalog_matrix(context)
+        year = catalogue_column(context.catalog_matrix, 'year')
+        order = np.argsort(year, kind='mergesort')
+        self.year = year[order]
+        self.mw = catalogue_column(context.catalog_matrix, 'Mw')[order]
+
+    def test_yearly_updates(self):
+        for dm, dt in [(0.1, 1), (0.2, 5)]:
+            analyser = SteppAnalyser(dm, dt, 0.2, True)
+            for year in np.unique(self.year):
+                analyser.add(self.year[self.year == year],
+                        self.mw[self.year == year])
+                inside = self.year <= year
+                # Stepp needs a few time windows
+                if year - self.year[0] > 3 * dt:
+                    self.assertTrue(np.array_equal(
+                        stepp_analysis(self.year[inside], self.mw[inside],
+                            dm, dt, 0.2, True),
+                        analyser.completeness_table()))
+            self.assertEqual(len(self.year), len(analyser))
+
+    def test_new_magnitude_range(self):
+        analyser = SteppAnalyser(0.2, 5)
+        weak = self.mw < 4.5
+        analyser.add(self.year[~weak], self.mw[~weak])
+        analyser.add(self.year[weak], self.mw[weak])
+
+        self.assertTrue(np.array_equal(stepp_analysis(self.year, self.mw,
+            0.2, 5), analyser.completeness_table()))
+
+    def test_remove(self):
+        analyser = SteppAnalyser(0.1, 5)
+        analyser.add(self.year, self.mw)
+        analyser.remove(self.year[-30:], self.mw[-30:])
+
+        self.assertTrue(np.array_equal(stepp_analysis(self.year[:-30],
+            self.mw[:-30], 0.1, 5), analyser.completeness_table()))
+        self.assertRaises(RuntimeError, analyser.remove, [1000.], [5.])
+        self.assertEqual(len(self.year) - 30, len(analyser))
+
+
+class GroupedSteppTestCase(unittest.TestCase):
+
+    def setUp(self):
+        context = Context(get_data_path('config.yml', DATA_DIR))
+        context.config['eq_catalog_file'] = get_data_path(
+            'ISC_correct.csv', DATA_DIR)
+        read_eq_catalog(context)
+        create_catalog_matrix(context)
+        self.longitude = catalogue_column(context.catalog_matrix,
+                'longitude')
+        self.latitude = catalogue_column(context.catalog_matrix, 'latitude')
+        self.year = catalogue_column(context.catalog_matrix, 'year')
+        self.mw = catalogue_column(context.catalog_matrix, 'Mw')
+
+    def _group_table(self, inside, events, dm, dt, ttol, iloc):
+        # Stepp of a group with the bins of all the events
+        mw = _round_magnitudes(self.mw)
+        mbin, T, TLB = _stepp_bins(np.min(self.year[events]),
+                np.max(self.year[events]), np.min(mw[events]),
+                np.max(mw[events]), dm, dt)
+        N = np.zeros((len(T), len(mbin) - 1))
+        index = CatalogueIndex(self.year[inside])
+        kernel('stepp_counts')(_magnitude_bins(mbin,
+            mw[inside][index.order]), index.sorted_time, TLB, N)
+        return _stepp_table(N, mbin, T, np.max(self.year[events]), ttol,
+                iloc)
+
+    def test_single_group(self):
+        for dm, dt, ttol, iloc in [(0.1, 1, 0.2, True), (0.2, 5, 0.1, False)]:
+            tables = grouped_stepp_analysis(np.zeros(len(self.year)),
+                    self.year, self.mw, 1, dm, dt, ttol, iloc)
+
+            self.assertTrue(np.array_equal(stepp_analysis(self.year,
+                self.mw, dm, dt, ttol, iloc), tables[0]))
+
+    def test_catalogue_index(self):
+        # Events sorted by time are sorted by year
+        time = self.year + self.mw / 10.
+        self.assertTrue(np.array_equal(stepp_analysis(self.year, self.mw),
+                stepp_analysis(self.year, self.mw,
+                    index=CatalogueIndex(time))))
+
+    def test_overlapping_groups(self):
+        west = np.nonzero(self.longitude < np.median(self.longitude))[0]
+        north = np.nonzero(self.latitude > np.median(self.latitude))[0]
+        group = np.concatenate([np.zeros(len(west)), np.ones(len(north))])
+        events = np.concatenate([west, north])
+
+        tables = grouped_stepp_analysis(group, self.year[events],
+                self.mw[events], 2, 0.1, 2, 0.1, True)
+
+        self.assertTrue(np.array_equal(self._group_table(west, events, 0.1,
+            2, 0.1, True), tables[0]))
+        self.assertTrue(np.array_equal(self._group_table(north, events, 0.1,
+            2, 0.1, True), tables[1]))
+
+    def test_gridded_completeness(self):
+        corners, tables = gridded_completeness(self.longitude, self.latitude,
+                self.year, self.mw, 2.0, 0.2, 5, 0.1, True)
+
+        self.assertEqual(len(corners), len(tables))
+        self.assertTrue(len(corners) > 1)
+        for corner, table in zip(corners, tables):
+            inside = (self.longitude >= corner[0]) & \
+                    (self.longitude < corner[0] + 2.0) & \
+                    (self.latitude >= corner[1]) & \
+                    (self.latitude < corner[1] + 2.0)
+            self.assertTrue(np.any(inside))
+            self.assertTrue(np.array_equal(self._group_table(inside,
+                slice(None), 0.2, 5, 0.1, True), table))
+
+    def test_cell_groups(self):
+        corners, _ = gridded_completeness(self.longitude, self.latitude,
+                self.year, self.mw, 2.0, 0.2, 5, 0.1, True)
+
+        group = cell_groups(self.longitude, self.latitude, corners, 2.0)
+        self.assertTrue(np.all(corners[group][:, 0] <= self.longitude))
+        self.assertTrue(np.all(self.longitude < corners[group][:, 0] + 2.))
+        self.assertTrue(np.all(corners[group][:, 1] <= self.latitude))
+        self.assertTrue(np.all(self.latitude < corners[group][:, 1] + 2.))
+        # Points of cells without events
+        self.assertEqual([-1], cell_groups([corners[:, 0].max() + 2.],
+                [0.], corners, 2.0).tolist())
+        self.assertEqual([-1], cell_groups([0.], [0.], [], 2.0).tolist())
+
+
+class CompletenessFlagsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.year = np.array([1950., 1990., 1960., 2000., 1900., 1985.])
+        self.mw = np.array([4.0, 4.0, 5.0, 3.9, 6.0, 5.2])
+
+    def test_completeness_flags(self):
+        table = [[4.0, 1980.], [5.0, 1950.]]
+
+        self.assertEqual([False, True, True, False, False, True],
+                completeness_flags(self.year, self.mw, table).tolist())
+
+    def test_group_tables(self):
+        tables = [[[4.0, 1980.], [5.0, 1950.]], [[4.0, 1940.], [5.0, 1990.]]]
+        group = np.array([0, 1, 0, 1, 0, 1])
+
+        self.assertEqual([False, True, True, False, False, False],
+                completeness_flags(self.year, self.mw, tables,
+                    group).tolist())
+        self.assertTrue(np.array_equal(completeness_flags(self.year,
+            self.mw, tables[0]), completeness_flags(self.year, self.mw,
+                tables, np.zeros(6, dtype=int))))
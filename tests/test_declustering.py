@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import unittest
+import numpy as np
+
+from mtoolkit.declustering import calc_windows, window_formulas, \
+magnitude_decimals, WindowTable, reasenberg_decluster, \
+gardner_knopoff_decluster, stochastic_decluster, gardner_knopoff_append, \
+event_time
+from mtoolkit.catalogue_utilities import CatalogueMatrix, CatalogueIndex, \
+SAMPLE_FORMAT
+
+
+class WindowTableTestCase(unittest.TestCase):
+
+    def test_magnitude_decimals(self):
+        self.assertEqual(0, magnitude_decimals(np.array([4., 5.])))
+        self.assertEqual(1, magnitude_decimals(np.array([4.1, 5.])))
+        self.assertEqual(2, magnitude_decimals(np.array([4.15, 5.3])))
+        self.assertEqual(None, magnitude_decimals(np.array([4.1234])))
+
+    def test_tables_match_window_formulas(self):
+        for decimals in [1, 2]:
+            m = np.round(np.linspace(2.0, 8.5, 200), decimals)
+            for window_opt in ['GardnerKnopoff', 'Uhrhammer', 'Gruenthal']:
+                f_space, f_time = calc_windows(m, window_opt)
+                expected_space, expected_time = window_formulas(m,
+                        window_opt)
+                self.assertTrue(np.array_equal(expected_space, f_space))
+                self.assertTrue(np.array_equal(expected_time, f_time))
+
+    def test_fine_magnitudes_get_exact_windows(self):
+        m = np.array([4.12345, 6.54321])
+        f_space, f_time = calc_windows(m, 'GardnerKnopoff')
+        expected_space, expected_time = window_formulas(m, 'GardnerKnopoff')
+        self.assertTrue(np.array_equal(expected_space, f_space))
+        self.assertTrue(np.array_equal(expected_time, f_time))
+
+    def test_custom_table(self):
+        table = WindowTable.from_config({'magnitude': [5., 3.],
+                'distance': [50., 10.], 'time': [730., 365.]})
+        f_space, f_time = calc_windows(np.array([2.5, 3.0, 4.2, 5.0, 7.1]),
+                table)
+        self.assertTrue(np.allclose([10., 10., 34., 50., 50.], f_space))
+        self.assertTrue(np.allclose([1., 1., 1.6, 2., 2.], f_time))
+
+
+class GardnerKnopoffAppendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rnd = np.random.RandomState(11)
+        neq = 400
+        data = np.zeros((neq, 7))
+        data[:, 0] = 2000
+        data[:, 3] = 10. + rnd.normal(0., 1., neq)
+        data[:, 4] = 45. + rnd.normal(0., 1., neq)
+        # Rounded magnitudes, many events share a magnitude
+        data[:, 5] = np.round(rnd.uniform(2.5, 6.5, neq), 1)
+        data[:, 6] = np.sort(2451545. + rnd.uniform(0., 20000., neq))
+        self.data = CatalogueMatrix(data, SAMPLE_FORMAT)
+
+    def _assert_append_is_full_run(self, old, new, *options):
+        expected = gardner_knopoff_decluster(np.concatenate((old, new)),
+                *options)
+        vcl = gardner_knopoff_decluster(old, *options)[0]
+
+        results = gardner_knopoff_append(old, vcl, new, *options)
+
+        for expected_result, result in zip(expected, results):
+            self.assertTrue(np.array_equal(expected_result, result))
+        self.assertEqual(SAMPLE_FORMAT, results[1].columns)
+
+    def test_append_latest_events(self):
+        for options in [('GardnerKnopoff', 0.), ('Uhrhammer', 0.5),
+                ('Gruenthal', 0.5, 'float32')]:
+            self._assert_append_is_full_run(self.data[:390],
+                    self.data[390:], *options)
+
+    def test_append_events_of_any_time(self):
+        order = np.random.RandomState(2).permutation(len(self.data))
+        data = self.data[order]
+        for start in [395, 300]:
+            self._assert_append_is_full_run(data[:start], data[start:],
+                    'GardnerKnopoff', 0.5)
+
+    def test_equal_magnitudes_in_catalogue_order(self):
+        data = self.data[:2].copy()
+        data[:, 3:6] = [10., 45., 5.]
+        data[1, 6] = data[0, 6] + 1.
+
+        self.assertTrue(np.array_equal([0, 1],
+                gardner_knopoff_decluster(data)[0]))
+        self.assertTrue(np.array_equal([0, -1],
+                gardner_knopoff_decluster(data[::-1], fs_time_prop=1.)[0]))
+
+    def test_catalogue_index(self):
+        data = self.data[np.random.RandomState(2).permutation(len(self.data))]
+        index = CatalogueIndex(event_time(data))
+        for options in [('GardnerKnopoff', 0.), ('Uhrhammer', 0.5)]:
+            expected = gardner_knopoff_decluster(data, *options)
+            results = gardner_knopoff_decluster(data, *options, index=index)
+            for expected_result, result in zip(expected, results):
+                self.assertTrue(np.array_equal(expected_result, result))
+
+    def test_columns_mismatch(self):
+        vcl = gardner_knopoff_decluster(self.data)[0]
+        self.assertRaises(ValueError, gardner_knopoff_append, self.data, vcl,
+                CatalogueMatrix(self.data[:, :6], SAMPLE_FORMAT[:6]))
+
+
+class ReasenbergTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # time (days), longitude, latitude, magnitude
+        events = np.array([
+            [0.0, 10.00, 45.00, 4.0],
+            [0.5, 10.01, 45.01, 6.0],
+            [1.2, 10.02, 45.00, 4.5],
+            [2.0, 10.00, 45.02, 3.5],
+            [2.1, 50.00, -10.0, 5.0],
+            [30., 10.00, 45.00, 3.0]])
+        # Events are not given in time order
+        self.order = [3, 5, 1, 0, 4, 2]
+        self.data = np.zeros((6, 7))
+        self.data[:, 0] = 2000
+        self.data[:, 3:6] = events[self.order, 1:]
+        self.data[:, 6] = 2451545. + events[self.order, 0]
+
+    def test_reasenberg(self):
+        vcl, vmain_shock, flag_vector = reasenberg_decluster(self.data,
+                taumin=1., taumax=10., p=0.95, xk=0.5, xmeff=1.5, rfact=10)
+
+        expected_vcl = np.array([-1, 0, 1, 1, 0, 0])[self.order]
+        self.assertTrue(np.array_equal(expected_vcl, vcl))
+        self.assertTrue(np.array_equal(expected_vcl, flag_vector))
+        self.assertTrue(np.array_equal(self.data[vcl == 0], vmain_shock))
+
+    def test_catalogue_index(self):
+        index = CatalogueIndex(self.data[:, 6])
+        self.assertTrue(np.array_equal(reasenberg_decluster(self.data)[0],
+                reasenberg_decluster(self.data, index=index)[0]))
+
+    def test_spatial_grid_does_not_change_clusters(self):
+        expected = reasenberg_decluster(self.data)[0]
+        for cell_size in [0.01, 5., 90.]:
+            self.assertTrue(np.array_equal(expected,
+                    reasenberg_decluster(self.data, cell_size=cell_size)[0]))
+
+
+class StochasticDeclusteringTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rnd = np.random.RandomState(3)
+        self.data = np.zeros((60, 7))
+        self.data[:, 0] = 2000
+        self.data[:, 3] = 10. + rnd.normal(0., 0.2, 60)
+        self.data[:, 4] = 45. + rnd.normal(0., 0.2, 60)
+        self.data[:, 5] = np.round(rnd.uniform(3., 6., 60), 1)
+        self.data[:, 6] = 2451545. + rnd.uniform(0., 1000., 60)
+        self.sigma_mw = np.ones(60) * 0.2
+        self.semi_major90 = np.ones(60) * 10.
+
+    def test_certain_catalogue(self):
+        vcl = gardner_knopoff_decluster(self.data, 'Uhrhammer', 0.5)[0]
+        probability = stochastic_decluster(self.data, np.zeros(60),
+                np.zeros(60), ['Uhrhammer'], 0.5, nrealisations=5)
+        self.assertTrue(np.array_equal((vcl == 0).astype(float),
+                probability))
+
+    def test_mainshock_probability(self):
+        probability = stochastic_decluster(self.data, self.sigma_mw,
+                self.semi_major90, ['GardnerKnopoff', 'Gruenthal'],
+                nrealisations=20, seed=7, chunk_size=3)
+        self.assertTrue(np.all(probability >= 0.))
+        self.assertTrue(np.all(probability <= 1.))
+        self.assertTrue(np.any(np.logical_and(probability > 0.,
+                probability < 1.)))
+
+    def test_processes_do_not_change_results(self):
+        expected = stochastic_decluster(self.data, self.sigma_mw,
+                self.semi_major90, nrealisations=6, seed=7, chunk_size=2)
+        self.assertTrue(np.array_equal(expected,
+                stochastic_decluster(self.data, self.sigma_mw,
+                    self.semi_major90, nrealisations=6, seed=7,
+                    processes=2, chunk_size=2)))
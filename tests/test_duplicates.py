@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+
+import unittest
+import numpy as np
+
+from mtoolkit.duplicates import find_duplicates, preferred_events
+
+
+class DuplicatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        second = 1. / 86400.
+        self.time = np.array([0., 5., 2., 100., 105., 1000.]) * second
+        self.longitude = np.array([179.95, -179.95, 179.9, 10., 10., 10.])
+        self.latitude = np.array([0., 0., 0.1, 89.99, 89.99, 89.99])
+        self.magnitude = np.array([5.0, 5.1, 4.9, 4.0, 4.1, 4.0])
+        self.agency = np.array(['AAA', 'BBB', 'CCC', 'AAA', 'BBB', 'CCC'])
+
+    def test_find_duplicates(self):
+        groups = find_duplicates(self.time, self.longitude, self.latitude,
+                self.magnitude, self.agency, 16. / 86400., 50., 0.3)
+        # Events across the antimeridian and the pole are duplicates
+        self.assertTrue(np.array_equal([0, 0, 0, 3, 3, 5], groups))
+
+    def test_tolerances(self):
+        groups = find_duplicates(self.time, self.longitude, self.latitude,
+                self.magnitude, self.agency, 2.5 / 86400., 50., 0.3)
+        self.assertTrue(np.array_equal([0, 1, 0, 3, 4, 5], groups))
+
+        groups = find_duplicates(self.time, self.longitude, self.latitude,
+                self.magnitude, self.agency, 16. / 86400., 5., 0.3)
+        self.assertTrue(np.array_equal([0, 1, 2, 3, 3, 5], groups))
+
+        groups = find_duplicates(self.time, self.longitude, self.latitude,
+                self.magnitude, self.agency, 16. / 86400., 50., 0.05)
+        self.assertTrue(np.array_equal([0, 1, 2, 3, 4, 5], groups))
+
+    def test_duplicates_on_cell_boundaries(self):
+        # About 99.65 km apart, across cells of the tolerance size
+        latitude = np.degrees(np.arcsin([0.015624, 0.03126]))
+        groups = find_duplicates(np.zeros(2), np.zeros(2), latitude,
+                np.array([5., 5.]), np.array(['AAA', 'BBB']), 1. / 86400.,
+                100., 0.1)
+        self.assertTrue(np.array_equal([0, 0], groups))
+
+    def test_same_agency_events_are_not_duplicates(self):
+        groups = find_duplicates(self.time, self.longitude, self.latitude,
+                self.magnitude, np.array(['AAA'] * 6), 16. / 86400., 50.,
+                0.3)
+        self.assertTrue(np.array_equal(np.arange(6), groups))
+
+    def test_preferred_events(self):
+        groups = np.array([0, 0, 0, 3, 3, 5])
+        keep = preferred_events(groups, self.agency, ['CCC', 'BBB'])
+        self.assertTrue(np.array_equal([False, False, True, False, True,
+                True], keep))
+        keep = preferred_events(groups, self.agency, [])
+        self.assertTrue(np.array_equal([True, False, False, True, False,
+                True], keep))
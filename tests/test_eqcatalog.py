@@ -17,10 +17,14 @@
 # version 3 along with OpenQuake. If not, see
 # <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
 
+import os
+import shutil
+import tempfile
 import unittest
+import numpy as np
 
 from mtoolkit.eqcatalog import CsvReader, EqEntryReader, \
-EqEntryValidationError
+EqEntryValidationError, EqCatalogWriter
 from mtoolkit.utils import get_data_path, DATA_DIR, FILE_NAME_ERROR
 
 FIELDNAMES = ['eventID', 'Agency', 'Identifier',
@@ -221,3 +225,61 @@ class EqEntryReaderTestCase(unittest.TestCase):
             EqEntryReader.EMPTY_STRING)
         self.assertEqual(eq_entry['ErrorStrike'],
             EqEntryReader.EMPTY_STRING)
+
+
+class EqCatalogWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.eq_entries = list(EqEntryReader(get_data_path(
+            'ISC_small_data.csv', DATA_DIR)).read())
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def test_write_csv(self):
+        filename = os.path.join(self.output_dir, 'catalog.csv')
+        EqCatalogWriter(filename, FIELDNAMES, chunk_size=3).write(
+            self.eq_entries)
+
+        self.assertEqual(FIELDNAMES, CsvReader(filename).fieldnames)
+        self.assertEqual(self.eq_entries,
+                list(EqEntryReader(filename).read()))
+
+    def test_write_csv_columns(self):
+        filename = os.path.join(self.output_dir, 'catalog.csv')
+        vcl = np.arange(10)
+        complete = vcl > 4
+        EqCatalogWriter(filename, FIELDNAMES, chunk_size=4).write(
+            self.eq_entries, [('vcl', vcl), ('complete', complete)])
+
+        self.assertEqual(FIELDNAMES + ['vcl', 'complete'],
+                CsvReader(filename).fieldnames)
+        lines = list(CsvReader(filename).read())
+        self.assertEqual(10, len(lines))
+        self.assertEqual([str(value) for value in vcl],
+                [line[-2] for line in lines])
+        self.assertEqual(['0'] * 5 + ['1'] * 5, [line[-1] for line in lines])
+
+    def test_write_npz(self):
+        filename = os.path.join(self.output_dir, 'catalog.npz')
+        vcl = np.arange(10)
+        EqCatalogWriter(filename, FIELDNAMES).write(self.eq_entries,
+                [('vcl', vcl)])
+
+        arrays = np.load(filename)
+        self.assertEqual(set(FIELDNAMES + ['vcl']), set(arrays.files))
+        self.assertTrue(np.array_equal(vcl, arrays['vcl']))
+        self.assertEqual(np.int64, arrays['year'].dtype)
+        self.assertEqual([eq_entry['Agency'] for eq_entry in
+            self.eq_entries], arrays['Agency'].tolist())
+        ms = arrays['Ms']
+        for i, eq_entry in enumerate(self.eq_entries):
+            if eq_entry['Ms'] == EqEntryReader.EMPTY_STRING:
+                self.assertTrue(np.isnan(ms[i]))
+            else:
+                self.assertEqual(eq_entry['Ms'], ms[i])
+
+    def test_column_length_mismatch_raise_exception(self):
+        writer = EqCatalogWriter(os.path.join(self.output_dir,
+            'catalog.csv'), FIELDNAMES)
+        self.assertRaises(RuntimeError, writer.write, self.eq_entries,
+                [('vcl', np.arange(3))])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+
+import unittest
+import numpy as np
+
+from mtoolkit.homogenisation import Conversion, homogenise
+
+
+class HomogenisationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        nan = np.nan
+        self.magnitudes = {'Mw': np.array([5.0, nan, nan, nan, nan]),
+                'Ms': np.array([4.0, 5.0, 7.0, nan, nan]),
+                'mb': np.array([nan, 4.0, nan, 5.0, nan]),
+                'ML': np.array([nan, nan, nan, nan, nan])}
+        self.sigmas = {'Mw': np.array([0.1, nan, nan, nan, nan]),
+                'Ms': np.array([0.2, 0.1, nan, nan, nan]),
+                'mb': np.array([nan, nan, nan, 0.3, nan]),
+                'ML': np.array([nan, nan, nan, nan, nan])}
+        self.agency = np.array(['AAA', 'AAA', 'BBB', 'AAA', 'BBB'])
+
+    def test_homogenise(self):
+        conversions = [Conversion('Mw'),
+                Conversion('Ms', [2.07, 0.67], [3.0, 6.1], 0.17),
+                Conversion('Ms', [0.08, 0.99], [6.2, 8.2], 0.2),
+                Conversion('mb', [1.03, 0.85], [3.5, 6.2], 0.29)]
+
+        mw, sigma_mw, source = homogenise(self.magnitudes, self.sigmas,
+                self.agency, conversions)
+
+        self.assertTrue(np.allclose([5.0, 5.42, 7.01, 5.28], mw[:4]))
+        self.assertTrue(np.isnan(mw[4]))
+        self.assertTrue(np.allclose([0.1, np.hypot(0.067, 0.17), 0.2,
+                np.hypot(0.255, 0.29)], sigma_mw[:4]))
+        self.assertTrue(np.array_equal([0, 1, 2, 3, -1], source))
+
+    def test_agency_priority(self):
+        conversions = [Conversion('mb', [1.03, 0.85], agencies=['AAA']),
+                Conversion('Ms', [2.07, 0.67], name='Ms Scordilis'),
+                Conversion('mb', [1.03, 0.85])]
+
+        _, _, source = homogenise(self.magnitudes, self.sigmas,
+                self.agency, conversions)
+
+        self.assertTrue(np.array_equal([1, 0, 1, 0, -1], source))
+        self.assertEqual('Ms Scordilis', conversions[1].name)
+
+    def test_polynomial_conversion(self):
+        conversion = Conversion('ML', [0.53, 0.646, 0.0376], sigma=0.2)
+        mw, sigma = conversion.convert(np.array([4.]), np.array([0.1]))
+        self.assertTrue(np.allclose([0.53 + 0.646 * 4 + 0.0376 * 16], mw))
+        self.assertTrue(np.allclose([np.hypot(0.1 * (0.646 + 0.0752 * 4),
+                0.2)], sigma))
+
+    def test_invalid_scale_raise_exception(self):
+        self.assertRaises(ValueError, Conversion, 'mB')
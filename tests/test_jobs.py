@@ -18,6 +18,9 @@
 # <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
 
 
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 from shapely.geometry import Polygon
@@ -25,7 +28,15 @@ from shapely.geometry import Polygon
 from mtoolkit.workflow import Context
 from mtoolkit.jobs import read_eq_catalog, read_source_model, \
 create_catalog_matrix, gardner_knopoff, stepp, _check_polygon, \
-processing_workflow_setup_gen
+processing_workflow_setup_gen, clear_source_model_cache, nrml_schema_path, \
+recurrence, reasenberg, stochastic_declustering, magnitude_homogenisation, \
+duplicate_removal, write_pprocessing_result, build_catalogue_store, \
+append_eq_entries, gridded_stepp, source_stepp, completeness_filter, \
+write_source_model, confidence_intervals_filename
+from mtoolkit.eqcatalog import CsvReader
+from mtoolkit.cache import SourceModelCache
+from mtoolkit.declustering import WindowTable
+from mtoolkit.catalogue_utilities import catalogue_column
 from mtoolkit.utils import get_data_path, DATA_DIR
 
 
@@ -56,6 +67,58 @@ class JobsTestCase(unittest.TestCase):
         self.assertEqual(expected_first_eq_entry,
                 self.context.eq_catalog[0])
 
+    def test_read_eq_catalog_region(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        self.context.config['eq_catalog_file'] = self.eq_catalog_filename
+        self.context.config['region'] = {'bbox': [7.0, 44.0, 8.0, 45.0]}
+
+        read_eq_catalog(self.context)
+        expected = self.context.eq_catalog
+        self.assertTrue(0 < len(expected) < 10)
+        self.assertTrue(all(7.0 <= eq_entry['longitude'] <= 8.0
+            for eq_entry in expected))
+
+        self.assertEqual(10, build_catalogue_store(self.context, store_dir))
+        self.context.config['eq_catalog_file'] = store_dir
+        read_eq_catalog(self.context)
+
+        self.assertEqual(expected, self.context.eq_catalog)
+
+    def test_create_catalog_matrix(self):
+        self.context.config['eq_catalog_file'] = self.eq_catalog_filename
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+
+        self.assertEqual((10, 7), self.context.catalog_matrix.shape)
+        # 2000-01-02 03:49:13 as Julian day
+        self.assertAlmostEqual(2451545.5 + (3 * 3600 + 49 * 60 + 13) /
+                86400., self.context.catalog_matrix[0, 6])
+
+    def test_create_catalog_matrix_with_columns(self):
+        self.context.config['eq_catalog_file'] = self.eq_catalog_filename
+        self.context.config['catalog_columns'] = {'Mw': 'float32',
+                'depth': 'float32', 'year': 'float32'}
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+
+        matrix = self.context.catalog_matrix
+        self.assertEqual(('year', 'Mw', 'depth'), matrix.columns)
+        self.assertEqual(np.float32, matrix.dtype)
+        self.assertEqual((10, 3), matrix.shape)
+        self.assertEqual(np.float32(9.3), catalogue_column(matrix, 'depth')[0])
+        # Rows selected from the matrix keep the column names
+        self.assertEqual(matrix.columns, matrix[matrix[:, 0] > 0].columns)
+
+    def test_create_catalog_matrix_with_invalid_column(self):
+        self.context.config['eq_catalog_file'] = self.eq_catalog_filename
+        self.context.config['catalog_columns'] = {'Agency': 'float64'}
+
+        read_eq_catalog(self.context)
+        self.assertRaises(RuntimeError, create_catalog_matrix, self.context)
+
     def test_read_smodel(self):
         self.context.config['source_model_file'] = self.smodel_filename
         expected_first_sm_definition = \
@@ -98,6 +161,43 @@ class JobsTestCase(unittest.TestCase):
         self.assertEqual(expected_first_sm_definition,
                 self.context.sm_definitions[0])
 
+    def test_read_smodel_from_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.context.config['source_model_file'] = self.smodel_filename
+        self.context.config['source_model_cache_dir'] = cache_dir
+
+        read_source_model(self.context)
+        cache = SourceModelCache(cache_dir)
+        self.assertEqual(1, len(os.listdir(cache_dir)))
+        self.assertEqual(self.context.sm_definitions,
+                cache.load(self.smodel_filename, nrml_schema_path()))
+
+        # Entries are served from the cache from now on
+        cached_sm = {'id_as': 'cached'}
+        cache.store(self.smodel_filename, nrml_schema_path(), [cached_sm])
+        read_source_model(self.context)
+        self.assertEqual([cached_sm], self.context.sm_definitions)
+
+        self.assertEqual(1, clear_source_model_cache(self.context))
+        read_source_model(self.context)
+        self.assertEqual(2, len(self.context.sm_definitions))
+
+    def test_cache_key_covers_imported_schemas(self):
+        schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, schema_dir)
+        nrml_schema = nrml_schema_path()
+        for name in os.listdir(os.path.dirname(nrml_schema)):
+            shutil.copy(os.path.join(os.path.dirname(nrml_schema), name),
+                    schema_dir)
+        schema = os.path.join(schema_dir, os.path.basename(nrml_schema))
+        cache = SourceModelCache(schema_dir)
+        key = cache.key(self.smodel_filename, schema)
+
+        with open(os.path.join(schema_dir, 'gmlsf.xsd'), 'ab') as gml_file:
+            gml_file.write('<!-- changed -->\n')
+        self.assertNotEqual(key, cache.key(self.smodel_filename, schema))
+
     def test_a_bad_polygon_raises_exception(self):
         polygon = Polygon([(1, 1), (1, 2), (2, 1), (2, 2)])
 
@@ -125,6 +225,44 @@ class JobsTestCase(unittest.TestCase):
         self.assertTrue(np.array_equal(expected_eq_events, filtered_eq_sm))
         self.assertEqual(sm, first_sm)
 
+    def test_magnitude_homogenisation(self):
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'homogenisation_input_test.csv', DATA_DIR)
+        self.context.config['preprocessing_steps'] = [
+            'MagnitudeHomogenisation']
+        self.context.config['MagnitudeHomogenisation'] = {'conversions': [
+            {'scale': 'Mw'},
+            {'scale': 'Ms', 'coefficients': [2.07, 0.67], 'sigma': 0.17,
+                'agencies': ['AAA']},
+            {'scale': 'mb', 'coefficients': [1.03, 0.85], 'sigma': 0.29,
+                'name': 'mb Scordilis'}]}
+
+        read_eq_catalog(self.context)
+        magnitude_homogenisation(self.context)
+
+        self.assertEqual([1, 2, 3], [eq_entry['eventID']
+                for eq_entry in self.context.eq_catalog])
+        self.assertEqual(['Mw', 'mb Scordilis', 'mb Scordilis'],
+                [eq_entry['MwSource'] for eq_entry in self.context.eq_catalog])
+        self.assertTrue(np.allclose([4.71, 4.855, 4.855],
+                [eq_entry['Mw'] for eq_entry in self.context.eq_catalog]))
+
+        create_catalog_matrix(self.context)
+        self.assertEqual((3, 7), self.context.catalog_matrix.shape)
+
+    def test_duplicate_removal(self):
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'duplicates_input_test.csv', DATA_DIR)
+        self.context.config['DuplicateRemoval'] = {'time_window': 16.,
+            'distance_window': 50., 'magnitude_window': 0.5,
+            'agency_priority': ['BBB', 'CCC']}
+
+        read_eq_catalog(self.context)
+        duplicate_removal(self.context)
+
+        self.assertEqual([2, 3, 4], [eq_entry['eventID']
+                for eq_entry in self.context.eq_catalog])
+
     def test_gardner_knopoff(self):
 
         self.context.config['eq_catalog_file'] = get_data_path(
@@ -153,6 +291,52 @@ class JobsTestCase(unittest.TestCase):
         self.assertTrue(np.array_equal(expected_flag_vector,
                 self.context.flag_vector))
 
+    def test_gardner_knopoff_float32(self):
+
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'ISC_correct.csv', DATA_DIR)
+        self.context.config['GardnerKnopoff']['time_dist_windows'] = \
+                'Uhrhammer'
+        self.context.config['GardnerKnopoff']['foreshock_time_window'] = 0.5
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        catalog_matrix = self.context.catalog_matrix
+
+        gardner_knopoff(self.context)
+        expected_vcl = self.context.vcl
+
+        self.context.catalog_matrix = catalog_matrix
+        self.context.config['GardnerKnopoff']['precision'] = 'float32'
+        gardner_knopoff(self.context)
+
+        self.assertTrue(np.array_equal(expected_vcl, self.context.vcl))
+
+    def test_append_eq_entries(self):
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'completeness_input_test.csv', DATA_DIR)
+        self.context.config['GardnerKnopoff']['time_dist_windows'] = \
+                'GardnerKnopoff'
+        self.context.config['GardnerKnopoff']['foreshock_time_window'] = 0.5
+
+        self.assertRaises(RuntimeError, append_eq_entries, self.context, [])
+        read_eq_catalog(self.context)
+        eq_catalog = self.context.eq_catalog
+        create_catalog_matrix(self.context)
+        gardner_knopoff(self.context)
+        expected = [self.context.vcl, self.context.flag_vector,
+                self.context.vmain_shock]
+
+        self.context.eq_catalog = eq_catalog[:-40]
+        create_catalog_matrix(self.context)
+        gardner_knopoff(self.context)
+        append_eq_entries(self.context, eq_catalog[-40:])
+
+        self.assertEqual(eq_catalog, self.context.eq_catalog)
+        for expected_result, result in zip(expected, [self.context.vcl,
+                self.context.flag_vector, self.context.catalog_matrix]):
+            self.assertTrue(np.array_equal(expected_result, result))
+
     def test_parameters_gardner_knopoff(self):
 
         self.context.config['eq_catalog_file'] = get_data_path(
@@ -164,14 +348,147 @@ class JobsTestCase(unittest.TestCase):
         read_eq_catalog(self.context)
         create_catalog_matrix(self.context)
 
-        def mock(data, time_dist_windows, foreshock_time_window):
+        def mock(data, time_dist_windows, foreshock_time_window, precision,
+                index):
+            self.assertTrue(index is self.context.catalog_index)
             self.assertEquals("GardnerKnopoff", time_dist_windows)
             self.assertEquals(0.5, foreshock_time_window)
+            self.assertEquals('float64', precision)
+            return None, None, None
+
+        self.context.map_sc['gardner_knopoff'] = mock
+        gardner_knopoff(self.context)
+
+    def test_gardner_knopoff_window_table(self):
+
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'declustering_input_test.csv', DATA_DIR)
+        self.context.config['GardnerKnopoff']['window_table'] = {
+            'magnitude': [3., 7.], 'distance': [20., 80.],
+            'time': [10., 900.]}
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+
+        def mock(data, time_dist_windows, foreshock_time_window, precision,
+                index):
+            self.assertTrue(isinstance(time_dist_windows, WindowTable))
+            f_space, f_time = time_dist_windows.windows(np.array([5.]))
+            self.assertTrue(np.allclose([50.], f_space))
+            self.assertTrue(np.allclose([455. / 365.], f_time))
             return None, None, None
 
         self.context.map_sc['gardner_knopoff'] = mock
         gardner_knopoff(self.context)
 
+    def test_parameters_reasenberg(self):
+
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'declustering_input_test.csv', DATA_DIR)
+        self.context.config['Reasenberg'] = {'taumin': 1., 'taumax': 10.,
+                'p': 0.95, 'xk': 0.5, 'xmeff': 1.5, 'rfact': 10}
+        self.context.config['precision'] = 'float32'
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+
+        def mock(data, taumin=1., taumax=10., p=0.95, xk=0.5, xmeff=1.5,
+                rfact=10., cell_size=1., precision='float64', index=None):
+            self.assertTrue(index is self.context.catalog_index)
+            self.assertEqual((1., 10., 0.95, 0.5, 1.5, 10),
+                    (taumin, taumax, p, xk, xmeff, rfact))
+            self.assertEqual(1., cell_size)
+            self.assertEqual('float32', precision)
+            return np.zeros(len(data), dtype=int), data, \
+                    np.zeros(len(data), dtype=int)
+
+        self.context.map_sc['reasenberg'] = mock
+        reasenberg(self.context)
+        self.assertEqual(20, len(self.context.catalog_matrix))
+        self.assertTrue(np.array_equal(np.zeros(20), self.context.vcl))
+
+    def test_reasenberg(self):
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'declustering_input_test.csv', DATA_DIR)
+        self.context.config['Reasenberg'] = {'taumin': 1., 'taumax': 10.,
+                'p': 0.95, 'xk': 0.5, 'xmeff': 1.5, 'rfact': 10}
+        self.context.config['precision'] = 'float32'
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        reasenberg(self.context)
+
+        self.assertEqual(20, len(self.context.vcl))
+        self.assertTrue(np.array_equal(self.context.vmain_shock,
+            self.context.catalog_matrix))
+        self.assertEqual(np.sum(self.context.vcl == 0),
+                len(self.context.catalog_matrix))
+
+    def test_parameters_stochastic_declustering(self):
+
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'declustering_input_test.csv', DATA_DIR)
+        self.context.config['StochasticDeclustering'] = {
+                'time_dist_windows': ['GardnerKnopoff', 'Uhrhammer'],
+                'foreshock_time_window': 0.5, 'realisations': 10,
+                'seed': 42, 'processes': 1, 'precision': 'float32'}
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        catalog_matrix = self.context.catalog_matrix
+
+        def mock(data, sigma_mw, semi_major90, windows,
+                foreshock_time_window, realisations, seed, processes,
+                precision):
+            self.assertEqual(20, len(sigma_mw))
+            self.assertEqual(20, len(semi_major90))
+            self.assertEqual(['GardnerKnopoff', 'Uhrhammer'], windows)
+            self.assertEqual((0.5, 10, 42, 1, 'float32'),
+                    (foreshock_time_window, realisations, seed, processes,
+                        precision))
+            return np.ones(len(data))
+
+        self.context.map_sc['stochastic_decluster'] = mock
+        stochastic_declustering(self.context)
+        self.assertTrue(np.array_equal(np.ones(20),
+                self.context.mainshock_probability))
+        self.assertTrue(catalog_matrix is self.context.catalog_matrix)
+
+    def test_write_pprocessing_result(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'declustering_input_test.csv', DATA_DIR)
+        self.context.config['pprocessing_result_file'] = os.path.join(
+            output_dir, 'catalog.csv')
+        self.context.config['GardnerKnopoff']['time_dist_windows'] = \
+                'GardnerKnopoff'
+        self.context.config['GardnerKnopoff']['foreshock_time_window'] = 0.5
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        gardner_knopoff(self.context)
+        self.context.completeness_table = np.array([[4.5, 1990.],
+            [5.5, 1950.]])
+        write_pprocessing_result(self.context)
+
+        reader = CsvReader(self.context.config['pprocessing_result_file'])
+        fieldnames = CsvReader(self.context.config['eq_catalog_file'])\
+                .fieldnames
+        self.assertEqual(fieldnames + ['vcl', 'flag', 'complete'],
+                reader.fieldnames)
+        lines = list(reader.read())
+        self.assertEqual(len(self.context.eq_catalog), len(lines))
+        self.assertEqual(self.context.vcl.tolist(),
+                [int(line[-3]) for line in lines])
+        self.assertEqual(self.context.flag_vector.tolist(),
+                [int(line[-2]) for line in lines])
+        expected_complete = [int((eq_entry['Mw'] >= 5.5 and
+            eq_entry['year'] >= 1950) or (eq_entry['Mw'] >= 4.5 and
+                eq_entry['year'] >= 1990)) for eq_entry in
+            self.context.eq_catalog]
+        self.assertEqual(expected_complete, [int(line[-1]) for line in lines])
+
     def test_stepp(self):
         self.context.config['eq_catalog_file'] = get_data_path(
             'completeness_input_test.csv', DATA_DIR)
@@ -219,7 +536,9 @@ class JobsTestCase(unittest.TestCase):
         read_eq_catalog(self.context)
         create_catalog_matrix(self.context)
 
-        def mock(year, mw, magnitude_windows, time_window, sensitivity, iloc):
+        def mock(year, mw, magnitude_windows, time_window, sensitivity, iloc,
+                index):
+            self.assertTrue(index is self.context.catalog_index)
             self.assertEqual(time_window, 5)
             self.assertEqual(magnitude_windows, 0.1)
             self.assertEqual(sensitivity, 0.2)
@@ -227,3 +546,322 @@ class JobsTestCase(unittest.TestCase):
 
         self.context.map_sc['stepp'] = mock
         stepp(self.context)
+
+    def test_gridded_stepp(self):
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'completeness_input_test.csv', DATA_DIR)
+        self.context.config['GriddedStepp'] = {'cell_size': 360.0}
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        stepp(self.context)
+        gridded_stepp(self.context)
+
+        self.assertEqual([[-180.0, -90.0]],
+                self.context.completeness_cells.tolist())
+        self.assertTrue(np.array_equal(self.context.completeness_table,
+            self.context.completeness_tables[0]))
+
+    def test_source_stepp(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.vmain_shock = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2],
+            [2000, 1, 2, -0.25, 0.20, 4.7],
+            [2000, 1, 2, 0.5, 0.25, 4.9]])
+        self.context.sm_definitions = [{'name': 'sm',
+            'area_boundary': [-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0]},
+            {'name': 'empty',
+            'area_boundary': [1.0, 0.0, 1.0, 0.5, 1.5, 0.5, 1.5, 0.0]}]
+
+        def mock(group, year, mw, ngroups, magnitude_windows, time_window,
+                sensitivity, iloc):
+            self.assertTrue(np.array_equal([0, 0], group))
+            self.assertTrue(np.array_equal([1990, 2000], year))
+            self.assertTrue(np.array_equal([4.2, 4.7], mw))
+            self.assertEqual(2, ngroups)
+            return np.array([[[4.2, 1990.]], [[4.2, 2000.]]])
+
+        self.context.map_sc['grouped_stepp'] = mock
+        source_stepp(self.context)
+
+        self.assertEqual([[4.2, 1990.]],
+                self.context.source_completeness_tables[0].tolist())
+        self.assertEqual(None, self.context.source_completeness_tables[1])
+
+    def test_completeness_filter(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.vmain_shock = self.context.catalog_matrix = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2],
+            [1970, 1, 2, -0.25, 0.20, 4.7],
+            [2000, 1, 2, -0.25, 0.25, 3.5],
+            [1970, 1, 2, 0.5, 0.25, 4.9]])
+        self.context.completeness_table = np.array([[4.0, 1980.]])
+
+        completeness_filter(self.context)
+        self.assertEqual([True, False, False, False],
+                self.context.completeness_mask.tolist())
+
+        self.context.sm_definitions = [{'name': 'sm',
+            'area_boundary': [-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0]},
+            {'name': 'empty',
+            'area_boundary': [1.0, 0.0, 1.0, 0.5, 1.5, 0.5, 1.5, 0.0]}]
+        completeness_filter(self.context)
+        filtered = [filtered_eq.tolist() for _, filtered_eq in
+                processing_workflow_setup_gen(self.context)]
+        self.assertEqual([[self.context.vmain_shock[0].tolist()], []],
+                filtered)
+
+        self.context.source_completeness_tables = [
+                np.array([[4.0, 1960.]]), None]
+        completeness_filter(self.context)
+        self.assertEqual([[0, 1], []], [events.tolist() for events in
+            self.context.complete_events])
+
+        # Not used once the events are replaced
+        self.context.vmain_shock = self.context.vmain_shock[:3]
+        self.assertEqual(3, len(processing_workflow_setup_gen(
+            self.context).next()[1]))
+
+    def test_completeness_filter_downstream(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        self.context.config['eq_catalog_file'] = get_data_path(
+            'declustering_input_test.csv', DATA_DIR)
+        self.context.config['pprocessing_result_file'] = os.path.join(
+            output_dir, 'catalog.csv')
+        self.context.config['apply_processing_steps'] = True
+
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        gardner_knopoff(self.context)
+        self.context.completeness_table = np.array([[4.5, 1990.],
+            [5.5, 1950.]])
+        completeness_filter(self.context)
+        write_pprocessing_result(self.context)
+
+        lines = list(CsvReader(
+            self.context.config['pprocessing_result_file']).read())
+        complete = [eq_entry for eq_entry in self.context.eq_catalog
+                if (eq_entry['Mw'] >= 5.5 and eq_entry['year'] >= 1950) or
+                (eq_entry['Mw'] >= 4.5 and eq_entry['year'] >= 1990)]
+        self.assertTrue(0 < len(complete) < len(self.context.eq_catalog))
+        self.assertEqual(len(complete), len(lines))
+        self.assertEqual(['1'] * len(lines), [line[-1] for line in lines])
+
+        # The processing steps get only the complete mainshocks
+        longitude = catalogue_column(self.context.vmain_shock, 'longitude')
+        latitude = catalogue_column(self.context.vmain_shock, 'latitude')
+        self.context.sm_definitions = [{'name': 'sm', 'area_boundary': [
+            longitude.min() - 1, latitude.min() - 1,
+            longitude.min() - 1, latitude.max() + 1,
+            longitude.max() + 1, latitude.max() + 1,
+            longitude.max() + 1, latitude.min() - 1]}]
+        filtered_eq = processing_workflow_setup_gen(self.context).next()[1]
+        self.assertEqual(np.sum(self.context.completeness_mask),
+                len(filtered_eq))
+        self.assertTrue(len(filtered_eq) < len(self.context.vmain_shock))
+
+    def test_completeness_filter_gridded_tables(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        self.context.config['pprocessing_result_file'] = os.path.join(
+            output_dir, 'catalog.csv')
+        self.context.config['GriddedStepp'] = {'cell_size': 1.0}
+        self.context.catalog_matrix = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2],
+            [1970, 1, 2, -0.25, 0.20, 4.7],
+            [1970, 1, 2, 0.5, 0.25, 4.9]])
+        self.context.eq_catalog = [dict(zip(['year', 'month', 'day',
+            'longitude', 'latitude', 'Mw'], row))
+            for row in self.context.catalog_matrix]
+        self.context.completeness_cells = np.array([[-1., 0.]])
+        self.context.completeness_tables = np.array([[[4.0, 1980.]]])
+
+        # The event of the cell without table is incomplete
+        completeness_filter(self.context)
+        self.assertEqual([True, False, False],
+                self.context.completeness_mask.tolist())
+
+        # unless the catalogue has a table
+        self.context.completeness_table = np.array([[4.0, 1960.]])
+        completeness_filter(self.context)
+        self.assertEqual([True, False, True],
+                self.context.completeness_mask.tolist())
+
+        write_pprocessing_result(self.context)
+        reader = CsvReader(self.context.config['pprocessing_result_file'])
+        self.assertEqual(['4.2', '4.9'], [line[reader.fieldnames.index('Mw')]
+            for line in reader.read()])
+
+    def test_completeness_filter_without_table(self):
+        self.context.catalog_matrix = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2]])
+
+        self.assertRaises(RuntimeError, completeness_filter, self.context)
+
+    def test_recurrence(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['Recurrence'] = {
+            'recurrence_algorithm': 'Wiechart',
+            'Wiechart': {'reference_magnitude': 4.0,
+                'magnitude_window': 0.1, 'time_window': 0.2}}
+
+        self.context.vmain_shock = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2],
+            [2000, 1, 2, -0.25, 0.20, 4.7],
+            [2000, 1, 2, 0.5, 0.25, 4.9]])
+        self.context.completeness_table = np.array([[4.0, 1980.]])
+        tgr = {'name': 'truncated_guten_richter',
+                'a_value_cumulative': 0.0, 'b_value': 0.0}
+        self.context.sm_definitions = [{'name': 'sm',
+            'area_boundary': [-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0],
+            'rupture_rate_model': [tgr]}]
+
+        def mock(year, mw, completeness_table, magnitude_window,
+                reference_magnitude):
+            self.assertTrue(np.array_equal([1990, 2000], year))
+            self.assertTrue(np.array_equal([4.2, 4.7], mw))
+            self.assertEqual(0.1, magnitude_window)
+            self.assertEqual(4.0, reference_magnitude)
+            return 0.9, 0.1, 0.01, 0.001
+
+        self.context.map_sc['weichert'] = mock
+        recurrence(self.context)
+
+        self.assertAlmostEqual(0.9, tgr['b_value'])
+        self.assertAlmostEqual(-2.0 + 0.9 * 4.0, tgr['a_value_cumulative'])
+        self.assertFalse('b_value_confidence_interval' in tgr)
+
+    def test_recurrence_source_completeness(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['Recurrence'] = {
+            'recurrence_algorithm': 'Wiechart',
+            'Wiechart': {'reference_magnitude': 4.0,
+                'magnitude_window': 0.1}}
+        self.context.vmain_shock = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2]])
+        self.context.completeness_table = np.array([[4.0, 1980.]])
+        self.context.source_completeness_tables = [np.array([[4.2, 1985.]])]
+        self.context.sm_definitions = [{'name': 'sm',
+            'area_boundary': [-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0],
+            'rupture_rate_model': []}]
+
+        def mock(year, mw, completeness_table, magnitude_window,
+                reference_magnitude):
+            self.assertEqual([[4.2, 1985.]], completeness_table.tolist())
+            return 0.9, 0.1, 0.01, 0.001
+
+        self.context.map_sc['weichert'] = mock
+        recurrence(self.context)
+
+    def test_recurrence_bootstrap(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['Recurrence'] = {
+            'recurrence_algorithm': 'Wiechart',
+            'Wiechart': {'reference_magnitude': 4.0,
+                'magnitude_window': 0.1, 'time_window': 0.2},
+            'bootstrap': {'samples': 10, 'confidence_level': 0.9,
+                'seed': 3, 'processes': 1}}
+
+        self.context.vmain_shock = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2],
+            [2000, 1, 2, -0.25, 0.20, 4.7]])
+        tgr = {'name': 'truncated_guten_richter'}
+        self.context.sm_definitions = [{'name': 'sm',
+            'area_boundary': [-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0],
+            'rupture_rate_model': [tgr]}]
+
+        self.context.map_sc['weichert'] = \
+            lambda *args: (1.0, 0.1, 0.01, 0.001)
+
+        def mock(year, mw, algorithm, options, samples, seed, processes):
+            self.assertEqual('Wiechart', algorithm)
+            self.assertEqual(4.0, options['reference_magnitude'])
+            self.assertEqual((10, 3, 1), (samples, seed, processes))
+            return np.array([0.8, 1.0, 1.2]), np.array([0.1, 0.01, 0.001])
+
+        self.context.map_sc['bootstrap'] = mock
+        recurrence(self.context)
+
+        self.assertEqual(0.9, tgr['confidence_level'])
+        lower, upper = tgr['b_value_confidence_interval']
+        self.assertTrue(0.8 <= lower < upper <= 1.2)
+        self.assertEqual(2, len(tgr['a_value_cumulative_confidence_interval']))
+
+    def test_write_confidence_intervals(self):
+        result_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, result_dir)
+        result_file = os.path.join(result_dir, 'result.xml')
+        self.context.config['source_model_file'] = self.smodel_filename
+        self.context.config['result_file'] = result_file
+
+        read_source_model(self.context)
+        sm = self.context.sm_definitions[0]
+        tgr = [rrm_entry for rrm_entry in sm['rupture_rate_model']
+                if rrm_entry['name'] == 'truncated_guten_richter'][0]
+        tgr['confidence_level'] = 0.9
+        tgr['a_value_cumulative_confidence_interval'] = [3.5, 4.5]
+        tgr['b_value_confidence_interval'] = [0.8, 1.2]
+        written = self.context.sm_definitions
+        write_source_model(self.context)
+
+        self.context.config['source_model_file'] = result_file
+        read_source_model(self.context)
+        self.assertEqual(len(written), len(self.context.sm_definitions))
+        reader = CsvReader(confidence_intervals_filename(result_file))
+        rows = [dict(zip(reader.fieldnames, line)) for line in reader.read()]
+        self.assertEqual([{'id_sm': sm['id_sm'], 'source_id': sm['id_as'],
+            'name': sm['name'], 'confidence_level': '0.9',
+            'a_value_cumulative_lower': '3.5',
+            'a_value_cumulative_upper': '4.5',
+            'b_value_lower': '0.8', 'b_value_upper': '1.2'}], rows)
+
+    def test_mle_recurrence(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['Recurrence'] = {
+            'recurrence_algorithm': 'MLE',
+            'MLE': {'reference_magnitude': 4.0, 'magnitude_window': 0.1}}
+
+        self.context.vmain_shock = np.array([
+            [1990, 1, 2, -0.25, 0.25, 4.2],
+            [2000, 1, 2, -0.25, 0.20, 4.7],
+            [1970, 1, 2, -0.25, 0.20, 4.7],
+            [2000, 1, 2, 0.5, 0.25, 4.9]])
+        self.context.completeness_table = np.array([[4.0, 1980.]])
+        boundaries = [[-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0],
+                [0.0, 0.0, 0.0, 0.5, 1.0, 0.5, 1.0, 0.0]]
+        tgrs = [{'name': 'truncated_guten_richter'} for _ in boundaries]
+        self.context.sm_definitions = [{'name': 'sm', 'area_boundary': ab,
+            'rupture_rate_model': [tgr]} for ab, tgr in zip(boundaries, tgrs)]
+
+        def mock(mw, source_index, nsources, mmin, magnitude_window,
+                duration, reference_magnitude):
+            self.assertTrue(np.array_equal([4.2, 4.7, 4.9], mw))
+            self.assertTrue(np.array_equal([0, 0, 1], source_index))
+            self.assertEqual(2, nsources)
+            self.assertEqual(4.0, mmin)
+            self.assertEqual(0.1, magnitude_window)
+            self.assertEqual(21., duration)
+            return np.array([0.9, 1.1]), None, np.array([0.01, 0.1]), None
+
+        self.context.map_sc['aki_utsu'] = mock
+        recurrence(self.context)
+
+        self.assertAlmostEqual(0.9, tgrs[0]['b_value'])
+        self.assertAlmostEqual(-1.0 + 1.1 * 4.0,
+                tgrs[1]['a_value_cumulative'])
+
+    def test_mle_recurrence_without_events(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['Recurrence'] = {
+            'recurrence_algorithm': 'MLE',
+            'MLE': {'reference_magnitude': 4.0, 'magnitude_window': 0.1}}
+        self.context.vmain_shock = np.array([
+            [1990, 1, 2, 5.0, 5.0, 4.2]])
+        tgr = {'name': 'truncated_guten_richter'}
+        self.context.sm_definitions = [{'name': 'sm',
+            'area_boundary': [-0.5, 0.0, -0.5, 0.5, 0.0, 0.5, 0.0, 0.0],
+            'rupture_rate_model': [tgr]}]
+
+        recurrence(self.context)
+        self.assertEqual({'name': 'truncated_guten_richter'}, tgr)
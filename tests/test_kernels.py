@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import unittest
+import numpy as np
+
+from mtoolkit import kernels
+from mtoolkit.kernels import set_backend, backend, NUMPY_KERNELS, \
+LOOP_KERNELS, NUMBA_KERNELS
+from mtoolkit.workflow import Context
+from mtoolkit.jobs import read_eq_catalog, create_catalog_matrix
+from mtoolkit.declustering import gardner_knopoff_decluster
+from mtoolkit.completeness import stepp_analysis
+from mtoolkit.catalogue_utilities import catalogue_column
+from mtoolkit.utils import get_data_path, DATA_DIR
+
+
+class KernelsParityTestCase(unittest.TestCase):
+    """
+    The loop kernels, compiled by the numba backend,
+    give the results of the numpy kernels.
+    """
+
+    def setUp(self):
+        self.rnd = np.random.RandomState(5)
+
+    def test_haversine(self):
+        lon1, lat1 = np.radians(self.rnd.uniform(-180., 180., (2, 40)))
+        lon2, lat2 = np.radians(self.rnd.uniform(-90., 90., (2, 30)))
+        expected = np.zeros((40, 30))
+        distance = np.zeros((40, 30))
+
+        NUMPY_KERNELS['haversine'](lon1, lat1, lon2, lat2, 6371.227,
+                expected)
+        LOOP_KERNELS['haversine'](lon1, lat1, lon2, lat2, 6371.227,
+                distance)
+
+        self.assertTrue(np.allclose(expected, distance, rtol=0, atol=1E-6))
+
+    def test_gardner_knopoff(self):
+        neq = 300
+        time_day = self.rnd.uniform(0., 3000., neq)
+        lon, lat = np.radians(self.rnd.uniform(10., 12., (2, neq)))
+        f_space = self.rnd.uniform(5., 60., neq)
+        f_time = self.rnd.uniform(5., 200., neq)
+        order = np.argsort(time_day, kind='mergesort')
+        expected = np.zeros(neq, dtype=int)
+        vcl = np.zeros(neq, dtype=int)
+
+        NUMPY_KERNELS['gardner_knopoff'](time_day, lon, lat, f_space,
+                f_time, 0.5, order, time_day[order], 6371.227, expected)
+        LOOP_KERNELS['gardner_knopoff'](time_day, lon, lat, f_space,
+                f_time, 0.5, order, time_day[order], 6371.227, vcl)
+
+        self.assertTrue(np.any(expected != 0))
+        self.assertTrue(np.array_equal(expected, vcl))
+
+    def test_stepp_counts(self):
+        sorted_year = np.sort(self.rnd.randint(1900, 2010, 500)).astype(float)
+        mag_bin = self.rnd.randint(-1, 8, 500)
+        tlb = 2009. - np.arange(1., 112.)
+        expected = np.zeros((len(tlb), 8))
+        counts = np.zeros((len(tlb), 8))
+
+        NUMPY_KERNELS['stepp_counts'](mag_bin, sorted_year, tlb, expected)
+        LOOP_KERNELS['stepp_counts'](mag_bin, sorted_year, tlb, counts)
+
+        self.assertTrue(np.array_equal(expected, counts))
+
+
+class BackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.default_backend = backend()
+
+    def tearDown(self):
+        set_backend(self.default_backend)
+
+    def test_set_backend(self):
+        self.assertEqual('numpy', set_backend('numpy'))
+        self.assertTrue(kernels.kernel('haversine') is
+                NUMPY_KERNELS['haversine'])
+        self.assertRaises(RuntimeError, set_backend, 'fortran')
+
+    @unittest.skipIf(kernels.numba_available(), 'numba is installed')
+    def test_missing_numba_falls_back_to_numpy(self):
+        self.assertEqual('numpy', set_backend('numba'))
+        self.assertEqual('numpy', set_backend())
+
+    @unittest.skipIf(not kernels.numba_available(), 'numba is not installed')
+    def test_numba_backend(self):
+        self.assertEqual('numba', set_backend('numba'))
+        self.assertTrue(kernels.kernel('haversine') is
+                NUMBA_KERNELS['haversine'])
+
+    def _run_algorithms(self, catalog_matrix, backend_name):
+        set_backend(backend_name)
+        mw = catalogue_column(catalog_matrix, 'Mw')
+        year = catalogue_column(catalog_matrix, 'year')
+        return [gardner_knopoff_decluster(catalog_matrix, window_opt,
+                0.5)[0] for window_opt in ['GardnerKnopoff', 'Uhrhammer',
+                'Gruenthal']] + [stepp_analysis(year, mw)]
+
+    @unittest.skipIf(not kernels.numba_available(), 'numba is not installed')
+    def test_numba_parity(self):
+        context = Context(get_data_path('config.yml', DATA_DIR))
+        context.config['eq_catalog_file'] = get_data_path(
+            'ISC_correct.csv', DATA_DIR)
+        read_eq_catalog(context)
+        create_catalog_matrix(context)
+
+        expected = self._run_algorithms(context.catalog_matrix, 'numpy')
+        for expected_result, result in zip(expected,
+                self._run_algorithms(context.catalog_matrix, 'numba')):
+            self.assertTrue(np.array_equal(expected_result, result))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import unittest
+import numpy as np
+
+from mtoolkit.recurrence import weichert, weichert_bins, aki_utsu, \
+bootstrap, confidence_interval
+
+
+def synthetic_catalogue(neq=20000, bval=1.0, mmin=3.0, seed=1):
+    """
+    Return years and magnitudes of a synthetic
+    Gutenberg-Richter catalogue covering 1900-2009
+    """
+
+    rnd = np.random.RandomState(seed)
+    mw = mmin + rnd.exponential(1. / (bval * np.log(10.)), neq)
+    year = rnd.randint(1900, 2010, neq).astype(float)
+    return year, mw
+
+
+class WeichertTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.year, self.mw = synthetic_catalogue()
+        self.completeness_table = np.array([[3.0, 1980.], [4.0, 1950.],
+                [5.0, 1900.]])
+
+    def test_bins_durations_and_counts(self):
+        year = np.array([1990., 1960., 1970., 2000.])
+        mw = np.array([3.05, 3.15, 4.05, 4.12])
+
+        fmag, tper, nobs = weichert_bins(year, mw,
+                np.array([[3.0, 1980.], [4.0, 1950.]]), 0.1)
+
+        self.assertTrue(np.allclose([3.05, 3.15, 3.25, 3.35, 3.45, 3.55,
+                3.65, 3.75, 3.85, 3.95, 4.05, 4.15], fmag))
+        self.assertTrue(np.allclose([21.] * 10 + [51.] * 2, tper))
+        # The event of 1960 is before the completeness of its bin
+        self.assertTrue(np.array_equal([1] + [0] * 9 + [1, 1], nobs))
+
+    def test_estimate_without_completeness(self):
+        bval, sigmab, rate, _ = weichert(self.year, self.mw, None, 0.1, 3.0)
+
+        self.assertAlmostEqual(1.0, bval, 1)
+        self.assertTrue(0 < sigmab < 0.05)
+        self.assertAlmostEqual(1., rate / (len(self.mw) / 110.), 1)
+
+    def test_estimate_with_completeness(self):
+        complete = self.year >= 1980
+        complete[self.mw >= 4.0] = self.year[self.mw >= 4.0] >= 1950
+        complete[self.mw >= 5.0] = True
+
+        bval, _, rate, _ = weichert(self.year[complete], self.mw[complete],
+                self.completeness_table, 0.1, 4.0)
+
+        self.assertAlmostEqual(1.0, bval, 1)
+        self.assertAlmostEqual(1., rate / (len(self.mw) / 1100.), 1)
+
+    def test_catalogues_solved_together(self):
+        years = np.vstack([self.year, self.year[::-1]])
+        mws = np.vstack([self.mw, self.mw[::-1]])
+
+        fmag, tper, nobs = weichert_bins(years, mws,
+                self.completeness_table, 0.1)
+
+        self.assertEqual((2, len(fmag)), np.shape(nobs))
+        single = weichert_bins(self.year, self.mw,
+                self.completeness_table, 0.1)[2]
+        self.assertTrue(np.array_equal(single, nobs[0]))
+
+
+class AkiUtsuTestCase(unittest.TestCase):
+
+    def setUp(self):
+        _, mw_1 = synthetic_catalogue(5000, 1.0, 2.95, seed=2)
+        _, mw_2 = synthetic_catalogue(5000, 0.8, 2.95, seed=3)
+        # Magnitudes are rounded to 0.1 as in a real catalogue
+        self.mw = np.around(np.concatenate([mw_1, mw_2]), 1)
+        self.source_index = np.repeat([0, 2], 5000)
+
+    def test_every_source_estimated_at_once(self):
+        bval, sigmab, rate, _ = aki_utsu(self.mw, self.source_index, 4,
+                3.0, 0.1, 10., 2.95)
+
+        self.assertAlmostEqual(1.0, bval[0], 1)
+        self.assertAlmostEqual(0.8, bval[2], 1)
+        self.assertTrue(np.all(sigmab[[0, 2]] < 0.05))
+        self.assertTrue(np.allclose([500., 500.], rate[[0, 2]]))
+        # Sources without events have no estimate
+        self.assertTrue(np.all(np.isnan(bval[[1, 3]])))
+
+    def test_batch_equals_single_source(self):
+        batch = aki_utsu(self.mw, self.source_index, 4, 3.0, 0.1, 10., 4.0)
+        single = aki_utsu(self.mw[5000:], np.zeros(5000, dtype=int), 1,
+                3.0, 0.1, 10., 4.0)
+
+        for batch_values, single_values in zip(batch, single):
+            self.assertAlmostEqual(single_values[0], batch_values[2])
+
+
+class BootstrapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.year, self.mw = synthetic_catalogue(2000, 1.0, 2.95, seed=4)
+        self.mw = np.around(self.mw, 1)
+        self.weichert_options = {'completeness_table': None, 'dm': 0.1,
+                'reference_magnitude': 3.0}
+        self.mle_options = {'mmin': 3.0, 'dm': 0.1, 'duration': 110.,
+                'reference_magnitude': 3.0}
+
+    def test_confidence_interval_contains_estimate(self):
+        for algorithm, options in (('Wiechart', self.weichert_options),
+                ('MLE', self.mle_options)):
+            bvalues, rates = bootstrap(self.year, self.mw, algorithm,
+                    options, 200, seed=1)
+
+            self.assertEqual(200, len(bvalues))
+            self.assertEqual(200, len(rates))
+            lower, upper = confidence_interval(bvalues, 0.95)
+            self.assertTrue(lower < 1.0 < upper)
+            self.assertTrue(upper - lower < 0.2)
+
+    def test_results_independent_of_processes(self):
+        serial = bootstrap(self.year, self.mw, 'MLE', self.mle_options,
+                100, seed=7, chunk_size=30)
+        parallel = bootstrap(self.year, self.mw, 'MLE', self.mle_options,
+                100, seed=7, processes=2, chunk_size=30)
+
+        self.assertTrue(np.array_equal(serial[0], parallel[0]))
+        self.assertTrue(np.array_equal(serial[1], parallel[1]))
+
+    def test_confidence_interval_ignores_nan(self):
+        self.assertEqual((1.0, 1.0),
+                confidence_interval([1.0, np.nan, 1.0]))
+        self.assertTrue(np.all(np.isnan(confidence_interval([np.nan]))))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import json
+import urllib2
+import threading
+import unittest
+
+from mtoolkit.workflow import Context, PipeLineBuilder
+from mtoolkit.server import ToolkitServer, ResidentCache, merge, \
+run_config, cached_read_source_model, LRUTable
+from mtoolkit.sweep import sweep_results
+from mtoolkit.utils import get_data_path, DATA_DIR
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Context(get_data_path('config.yml', DATA_DIR)).config
+        self.config['eq_catalog_file'] = get_data_path(
+            'completeness_input_test.csv', DATA_DIR)
+        self.config['preprocessing_steps'] = ['GardnerKnopoff', 'Stepp']
+        self.config['GardnerKnopoff']['time_dist_windows'] = \
+                'GardnerKnopoff'
+
+        self.server = ToolkitServer(self.config)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def _post(self, overrides):
+        return json.loads(urllib2.urlopen(self.url + '/run',
+            json.dumps(overrides)).read())
+
+    def _status(self):
+        return json.loads(urllib2.urlopen(self.url + '/status').read())
+
+    def test_merge(self):
+        config = merge(self.config, {'Stepp': {'time_window': 10}})
+
+        self.assertEqual(10, config['Stepp']['time_window'])
+        self.assertEqual(0.2, config['Stepp']['magnitude_windows'])
+        self.assertEqual(5, self.config['Stepp']['time_window'])
+
+    def test_results_match_direct_runs(self):
+        for overrides in [{}, {'Stepp': {'time_window': 10}},
+                {'GardnerKnopoff': {'time_dist_windows': 'Uhrhammer'}}]:
+            config = merge(self.config, overrides)
+            context = Context(config=config)
+            PipeLineBuilder('direct run').build(config).run(context)
+
+            self.assertEqual(dict(sweep_results(context)),
+                    self._post(overrides))
+
+    def test_catalogs_stay_resident(self):
+        self._post({})
+        self.assertEqual(1, self._status()['eq_catalogs'])
+        self.assertEqual(2, self._status()['misses'])
+
+        self._post({'Stepp': {'time_window': 10}})
+        status = self._status()
+        self.assertEqual(2, status['misses'])
+        self.assertEqual(2, status['hits'])
+
+    def test_invalid_config(self):
+        try:
+            self._post({'preprocessing_steps': ['Unknown']})
+        except urllib2.HTTPError as error:
+            self.assertEqual(400, error.code)
+            self.assertTrue('Invalid step' in json.loads(
+                error.read())['error'])
+        else:
+            self.fail('No error for an invalid step')
+
+    def test_output_paths_are_server_side(self):
+        for key in ['result_file', 'pprocessing_result_file']:
+            try:
+                self._post({key: '/tmp/elsewhere'})
+            except urllib2.HTTPError as error:
+                self.assertEqual(400, error.code)
+                self.assertTrue(key in json.loads(error.read())['error'])
+            else:
+                self.fail('No error for a posted %s' % key)
+
+
+class ResidentCacheTestCase(unittest.TestCase):
+
+    def test_source_model_copies(self):
+        context = Context(get_data_path('config.yml', DATA_DIR))
+        context.config['source_model_file'] = get_data_path(
+            'area_source_model.xml', DATA_DIR)
+        context.resident_cache = ResidentCache()
+
+        cached_read_source_model(context)
+        first = context.sm_definitions
+        cached_read_source_model(context)
+
+        self.assertEqual(first, context.sm_definitions)
+        self.assertFalse(first is context.sm_definitions)
+        self.assertEqual(1, context.resident_cache.hits)
+
+    def test_run_config(self):
+        config = Context(get_data_path('config.yml', DATA_DIR)).config
+        cache = ResidentCache()
+
+        self.assertEqual(run_config(config, cache),
+                run_config(config, cache))
+        self.assertEqual({'eq_catalogs': 1, 'catalog_matrices': 1,
+            'source_models': 0, 'polygon_masks': 0, 'hits': 2,
+            'misses': 2}, cache.status())
+
+    def test_least_recently_used_entries_are_evicted(self):
+        table = LRUTable(2)
+        table['a'] = 1
+        table['b'] = 2
+        self.assertEqual(1, table['a'])
+        table['c'] = 3
+
+        self.assertEqual(2, len(table))
+        self.assertFalse('b' in table)
+        self.assertEqual(1, table.setdefault('a', 4))
+        self.assertEqual(5, table.setdefault('d', 5))
+        self.assertFalse('c' in table)
+
+    def test_changed_files_are_evicted(self):
+        cache = ResidentCache({'eq_catalogs': 1})
+        cache.get(cache.eq_catalogs, ('catalog.csv', 1.0), lambda: [1])
+        cache.get(cache.eq_catalogs, ('catalog.csv', 2.0), lambda: [2])
+
+        self.assertEqual(1, cache.status()['eq_catalogs'])
+        self.assertEqual([2], cache.eq_catalogs[('catalog.csv', 2.0)])
@@ -17,10 +17,12 @@
 # version 3 along with OpenQuake. If not, see
 # <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
 
+import os
+import tempfile
 import unittest
 
 from mtoolkit import utils
-from mtoolkit.smodel import NRMLReader
+from mtoolkit.smodel import NRMLReader, NRMLWriter
 from mtoolkit.utils import get_data_path, DATA_DIR, \
     SCHEMA_DIR, FILE_NAME_ERROR
 
@@ -319,3 +321,48 @@ class NRMLReaderTestCase(unittest.TestCase):
         self.assertEqual(name, sp_rdd.get('name'))
         self.assertEqual(depth, sp_rdd.get('depth'))
         self.assertEqual(magnitude, sp_rdd.get('magnitude'))
+
+
+class NRMLWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = get_data_path('nrml.xsd', SCHEMA_DIR)
+        output_fd, self.output_nrml = tempfile.mkstemp(suffix='.xml')
+        os.close(output_fd)
+        self.addCleanup(os.remove, self.output_nrml)
+
+    def _read(self, filename):
+        return list(NRMLReader(filename, self.schema).read())
+
+    def _round_trip(self, filename):
+        sm_definitions = self._read(filename)
+        with NRMLWriter(self.output_nrml, self.schema) as writer:
+            for sm in sm_definitions:
+                writer.serialize(sm)
+        self.assertEqual(sm_definitions, self._read(self.output_nrml))
+
+    def test_write_area_source(self):
+        self._round_trip(get_data_path('area_source_model.xml', DATA_DIR))
+
+    def test_write_simple_fault(self):
+        self._round_trip(get_data_path(
+            'simple_fault_source_model.xml', DATA_DIR))
+
+    def test_write_complex_fault(self):
+        self._round_trip(get_data_path(
+            'complex_source_model.xml', DATA_DIR))
+
+    def test_write_simple_point(self):
+        self._round_trip(get_data_path(
+            'simple_point_source_model.xml', DATA_DIR))
+
+    def test_invalid_sm_raise_exception(self):
+        area_source = self._read(get_data_path(
+            'area_source_model.xml', DATA_DIR))[0]
+        area_source['hypocentral_depth'] = -1.0
+
+        def write():
+            with NRMLWriter(self.output_nrml, self.schema) as writer:
+                writer.serialize(area_source)
+
+        self.assertRaises(utils.XMLValidationError, write)
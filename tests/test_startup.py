@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import sys
+import subprocess
+import unittest
+
+from mtoolkit.utils import ROOT_DIR
+
+# Seconds allowed to import the workflow module
+# in a new interpreter (numpy and yaml included)
+IMPORT_TIME_BUDGET = 1.0
+
+# Packages only needed by the source model jobs
+SOURCE_MODEL_PACKAGES = ('lxml', 'shapely')
+
+# Modules imported by the jobs or the scientific
+# callables using them, not by the workflow module
+ALGORITHM_MODULES = ('mtoolkit.cache', 'mtoolkit.catalogue_store',
+        'mtoolkit.recurrence', 'mtoolkit.declustering',
+        'mtoolkit.homogenisation', 'mtoolkit.duplicates',
+        'mtoolkit.completeness', 'mtoolkit.kernels', 'mtoolkit.sharedmem',
+        'mtoolkit.smodel', 'multiprocessing')
+
+
+def _run(statements):
+    """
+    Run python statements in a new interpreter, return
+    the output followed by the names of the imported modules
+    """
+
+    output = subprocess.check_output([sys.executable, '-c',
+        'import sys\n' + statements + '\nprint " ".join(sys.modules)'],
+        cwd=ROOT_DIR, stderr=subprocess.STDOUT)
+    return output.split()
+
+
+def _packages(modules, packages):
+    """Return the modules of the given packages"""
+
+    return [module for module in modules
+            if module.split('.')[0] in packages]
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_cmdline_help_does_not_import_the_toolkit(self):
+        modules = _run("import runpy\n"
+                "sys.argv = ['main.py', '--version']\n"
+                "try:\n"
+                "    runpy.run_path('main.py', run_name='__main__')\n"
+                "except SystemExit:\n"
+                "    pass")
+
+        self.assertEqual([], _packages(modules, ('numpy', 'yaml') +
+            SOURCE_MODEL_PACKAGES))
+        self.assertFalse('mtoolkit.workflow' in modules)
+
+    def test_catalogue_pipeline_does_not_import_source_model_packages(self):
+        modules = _run("from mtoolkit.workflow import Context, "
+                "PipeLineBuilder\n"
+                "context = Context('tests/data/config.yml')\n"
+                "PipeLineBuilder('catalogue').build(context.config)"
+                ".run(context)")
+
+        self.assertEqual([], _packages(modules, SOURCE_MODEL_PACKAGES))
+
+    def test_workflow_does_not_import_the_algorithm_modules(self):
+        modules = _run("import mtoolkit.workflow")
+
+        self.assertEqual([], [module for module in ALGORITHM_MODULES
+                if module in modules])
+        self.assertEqual([], _packages(modules, SOURCE_MODEL_PACKAGES))
+
+    def test_import_time(self):
+        output = _run("import time\n"
+                "start = time.time()\n"
+                "import mtoolkit.workflow\n"
+                "print time.time() - start")
+
+        self.assertTrue(float(output[0]) < IMPORT_TIME_BUDGET)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2011, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3
+# only, as published by the Free Software Foundation.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License version 3 for more details
+# (a copy is included in the LICENSE file that accompanied this code).
+#
+# You should have received a copy of the GNU Lesser General Public License
+# version 3 along with OpenQuake. If not, see
+# <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mtoolkit.workflow import Context, PipeLineBuilder
+from mtoolkit.sweep import Sweep, override, sweep_results, run_sweep
+from mtoolkit.eqcatalog import CsvReader
+from mtoolkit.utils import get_data_path, DATA_DIR
+
+
+class SweepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Context(get_data_path('config.yml', DATA_DIR)).config
+        self.config['eq_catalog_file'] = get_data_path(
+            'completeness_input_test.csv', DATA_DIR)
+        self.config['preprocessing_steps'] = ['GardnerKnopoff', 'Stepp']
+        self.config['GardnerKnopoff']['time_dist_windows'] = \
+                'GardnerKnopoff'
+        self.parameters = {
+            'GardnerKnopoff.time_dist_windows': ['GardnerKnopoff',
+                'Uhrhammer'],
+            'Stepp.time_window': [5, 10, 20]}
+
+    def test_override(self):
+        config = override(self.config, 'Stepp.time_window', 10)
+
+        self.assertEqual(10, config['Stepp']['time_window'])
+        self.assertEqual(5, self.config['Stepp']['time_window'])
+
+    def test_context_from_config(self):
+        context = Context(config=self.config)
+        self.assertTrue(context.config is self.config)
+
+    def test_shared_jobs_run_once(self):
+        # read, catalog matrix, 2 declustering, 6 stepp
+        self.assertEqual(10, Sweep(self.config, self.parameters).nodes())
+
+        # Global overrides split the tree at the first job
+        self.parameters['precision'] = ['float64', 'float32']
+        self.assertEqual(20, Sweep(self.config, self.parameters).nodes())
+
+    def test_jobs_reading_other_sections(self):
+        # GriddedStepp reads the Stepp section
+        self.config['preprocessing_steps'] = ['GardnerKnopoff',
+                'GriddedStepp']
+        self.config['GriddedStepp'] = {'cell_size': 360.0}
+        sweep = Sweep(self.config, {'Stepp.time_window': [5, 40]})
+
+        # read, catalog matrix, declustering, 2 gridded stepp
+        self.assertEqual(5, sweep.nodes())
+        node = sweep.root
+        while len(node.children) == 1:
+            node = node.children.values()[0]
+        self.assertEqual([5, 40], [child.config['Stepp']['time_window']
+            for child in node.children.values()])
+
+    def test_results_match_single_runs(self):
+        rows = Sweep(self.config, self.parameters).run(
+                Context(config=self.config))
+
+        self.assertEqual(6, len(rows))
+        for combination, results in rows:
+            config = self.config
+            for key, index in combination:
+                config = override(config, key, self.parameters[key][index])
+            context = Context(config=config)
+            PipeLineBuilder('single run').build(config).run(context)
+            self.assertEqual(sweep_results(context), results)
+
+    def test_parallel_branches(self):
+        sweep = Sweep(self.config, self.parameters)
+
+        self.assertEqual(sweep.run(Context(config=self.config)),
+                sweep.run(Context(config=self.config), processes=2))
+
+    def test_results_table(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        result_file = os.path.join(output_dir, 'sweep.csv')
+
+        rows = run_sweep(self.config, {'parameters': self.parameters,
+            'result_file': result_file})
+
+        reader = CsvReader(result_file)
+        self.assertEqual(['GardnerKnopoff.time_dist_windows',
+            'Stepp.time_window', 'events', 'mainshocks',
+            'completeness_table', 'b_values'], reader.fieldnames)
+        lines = list(reader.read())
+        self.assertEqual(6, len(lines))
+        self.assertEqual(['Uhrhammer', '10'], lines[4][:2])
+        self.assertEqual(str(rows[4][1]['mainshocks']), lines[4][3])
@@ -17,14 +17,29 @@
 # version 3 along with OpenQuake. If not, see
 # <http://www.gnu.org/licenses/lgpl-3.0.txt> for a copy of the LGPLv3 License.
 
+import os
 import unittest
+from multiprocessing import Pool
+
+import numpy as np
 
 from mtoolkit.workflow import PipeLine, PipeLineBuilder, Context
+from mtoolkit.catalogue_utilities import CatalogueMatrix
+from mtoolkit.sharedmem import attach_arrays
 from mtoolkit.jobs import read_eq_catalog, create_catalog_matrix, \
-gardner_knopoff
+gardner_knopoff, read_source_model, recurrence, write_source_model, \
+magnitude_homogenisation, write_pprocessing_result
 from mtoolkit.utils import get_data_path, DATA_DIR
 
 
+def _shared_sums(handle):
+    """Sum the shared arrays in a worker process"""
+
+    arrays = attach_arrays(handle)
+    return dict((name, (float(array.sum()), getattr(array, 'columns', None),
+        array.flags.writeable)) for name, array in arrays.iteritems())
+
+
 class ContextTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -33,7 +48,7 @@ class ContextTestCase(unittest.TestCase):
     def test_load_config_file(self):
         expected_config_dict = {
             'apply_processing_steps': None,
-            'pprocessing_result_file': 'path_to_file',
+            'pprocessing_result_file': None,
             'GardnerKnopoff': {'time_dist_windows': False,
                     'foreshock_time_window': 0},
             'Stepp': {'increment_lock': True,
@@ -47,6 +62,19 @@ class ContextTestCase(unittest.TestCase):
 
         self.assertEqual(expected_config_dict, self.context.config)
 
+    def test_catalog_index(self):
+        read_eq_catalog(self.context)
+        create_catalog_matrix(self.context)
+        index = self.context.catalog_index
+        self.assertTrue(index is self.context.catalog_index)
+        self.assertEqual(len(self.context.catalog_matrix), len(index))
+
+        # A new catalog matrix gets a new index
+        gardner_knopoff(self.context)
+        self.assertFalse(index is self.context.catalog_index)
+        self.assertEqual(len(self.context.catalog_matrix),
+                len(self.context.catalog_index))
+
 
 class PipeLineTestCase(unittest.TestCase):
 
@@ -84,6 +112,74 @@ class PipeLineTestCase(unittest.TestCase):
 
         self.assertEqual(16, self.context.number)
 
+    def test_shared_arrays(self):
+        results = {}
+
+        def decluster_job(context):
+            context.catalog_matrix = CatalogueMatrix(
+                    np.arange(6.).reshape(3, 2), ('year', 'Mw'))
+            context.vmain_shock = context.catalog_matrix
+            context.vcl = np.array([0, 1, 1])
+            handle = context.shared_arrays('catalog_matrix', 'vmain_shock',
+                    'vcl')
+            results['paths'] = set(path for path, _ in handle.values())
+            pool = Pool(2)
+            try:
+                results['sums'] = pool.map(_shared_sums, [handle] * 2)
+            finally:
+                pool.close()
+                pool.join()
+            self.assertEqual(handle, context.shared_arrays('catalog_matrix',
+                'vmain_shock', 'vcl'))
+
+        self.pipeline.add_job(decluster_job)
+        self.pipeline.run(self.context)
+
+        expected = {'catalog_matrix': (15., ('year', 'Mw'), False),
+                'vmain_shock': (15., ('year', 'Mw'), False),
+                'vcl': (2., None, False)}
+        self.assertEqual([expected] * 2, results['sums'])
+        # catalog_matrix and vmain_shock share the same file,
+        # files are removed once the pipeline ends
+        self.assertEqual(2, len(results['paths']))
+        self.assertFalse(any(os.path.exists(path)
+            for path in results['paths']))
+        self.assertRaises(RuntimeError, self.context.shared_arrays, 'vcl')
+
+    def test_shared_arrays_cleanup_on_error(self):
+        paths = []
+
+        def failing_job(context):
+            context.vcl = np.zeros(3)
+            paths.extend(path for path, _ in
+                    context.shared_arrays('vcl').values())
+            raise ValueError('failing job')
+
+        self.pipeline.add_job(failing_job)
+        self.assertRaises(ValueError, self.pipeline.run, self.context)
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertEqual(None, self.context.shared_store)
+
+    def test_changed_shared_arrays(self):
+        def update_job(context):
+            context.vcl = np.zeros(3)
+            (path, _), = context.shared_arrays('vcl').values()
+            # Changed in place, written again
+            context.vcl[0] = 5.
+            (new_path, _), = context.shared_arrays('vcl').values()
+            self.assertEqual([5., 0., 0.],
+                    attach_arrays(context.shared_arrays('vcl'))[
+                        'vcl'].tolist())
+            self.assertFalse(os.path.exists(path))
+            # Replaced, the file of the old array is removed
+            context.vcl = np.ones(2)
+            (last_path, _), = context.shared_arrays('vcl').values()
+            self.assertFalse(os.path.exists(new_path))
+            self.assertTrue(os.path.exists(last_path))
+
+        self.pipeline.add_job(update_job)
+        self.pipeline.run(self.context)
+
 
 class PipeLineBuilderTestCase(unittest.TestCase):
 
@@ -101,6 +197,61 @@ class PipeLineBuilderTestCase(unittest.TestCase):
         self.assertEqual(expected_pipeline,
             self.pipeline_builder.build(self.context.config))
 
+    def test_build_pipeline_with_processing_steps(self):
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['processing_steps'] = ['Recurrence']
+
+        expected_pipeline = PipeLine(self.pipeline_name)
+        expected_pipeline.add_job(read_eq_catalog)
+        expected_pipeline.add_job(create_catalog_matrix)
+        expected_pipeline.add_job(gardner_knopoff)
+        expected_pipeline.add_job(read_source_model)
+        expected_pipeline.add_job(recurrence)
+        expected_pipeline.add_job(write_source_model)
+
+        self.assertEqual(expected_pipeline,
+            self.pipeline_builder.build(self.context.config))
+
+    def test_build_pipeline_with_pprocessing_result_file(self):
+        self.context.config['pprocessing_result_file'] = 'catalog.csv'
+        self.context.config['apply_processing_steps'] = True
+        self.context.config['processing_steps'] = ['Recurrence']
+
+        expected_pipeline = PipeLine(self.pipeline_name)
+        expected_pipeline.add_job(read_eq_catalog)
+        expected_pipeline.add_job(create_catalog_matrix)
+        expected_pipeline.add_job(gardner_knopoff)
+        expected_pipeline.add_job(write_pprocessing_result)
+        expected_pipeline.add_job(read_source_model)
+        expected_pipeline.add_job(recurrence)
+        expected_pipeline.add_job(write_source_model)
+
+        self.assertEqual(expected_pipeline,
+            self.pipeline_builder.build(self.context.config))
+
+    def test_eq_catalog_steps_run_before_catalog_matrix(self):
+        self.context.config['preprocessing_steps'] = ['GardnerKnopoff',
+                'MagnitudeHomogenisation']
+
+        expected_pipeline = PipeLine(self.pipeline_name)
+        expected_pipeline.add_job(read_eq_catalog)
+        expected_pipeline.add_job(magnitude_homogenisation)
+        expected_pipeline.add_job(create_catalog_matrix)
+        expected_pipeline.add_job(gardner_knopoff)
+
+        self.assertEqual(expected_pipeline,
+            self.pipeline_builder.build(self.context.config))
+
+    def test_pipeline_catalog_columns(self):
+        self.context.config['preprocessing_steps'] = ['GardnerKnopoff',
+                'Stepp']
+
+        pipeline = self.pipeline_builder.build(self.context.config)
+
+        self.assertEqual({'longitude': 'float64', 'latitude': 'float64',
+                'Mw': 'float64', 'time': 'float64'},
+                pipeline.catalog_columns)
+
     def test_non_existent_job_raise_exception(self):
         self.context.config['preprocessing_steps'] = ['invalid_job']
         self.assertRaises(RuntimeError, self.pipeline_builder.build,